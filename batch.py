@@ -0,0 +1,151 @@
+"""Runs many jobs in one process: reads one job per line, writes one JSON result per line.
+
+A job is either a JSON object such as {"op": "equiv", "args": ["(AvB)", "~(~A&~B)"]}, or
+tab-separated text: the op, then its arguments. JSON jobs may also carry an "id" (echoed in
+the result), an "engine" (see truthtable.ENGINES) and "minimize" (for dnf and cnf).
+
+Expressions go through parsing.parse, whose cache is shared by every job in the batch."""
+from __future__ import print_function
+import json
+import multiprocessing
+import parsing
+import truthtable
+import normal_forms
+import proofs
+import count
+import simplify
+import stats
+from nodes import LogicError
+from StringIO import StringIO
+from nose.tools import assert_equal
+
+# Jobs sent to each worker at a time, when running with a pool.
+POOL_CHUNK = 64
+
+def _one(args):
+    if len(args) != 1:
+        raise ValueError("Expected 1 expression, got %d." % len(args))
+    return args[0]
+
+def _table(args, job):
+    exp = _one(args)
+    atoms = sorted(truthtable.find_atoms(exp))
+    bits = truthtable.table_bits(parsing.parse(exp), atoms)
+    return {"atoms": atoms, "values": truthtable.row_values(bits, 1 << len(atoms))}
+
+def _equiv(args, job):
+    if len(args) != 2:
+        raise ValueError("Expected 2 expressions, got %d." % len(args))
+    return truthtable.equivalent(args[0], args[1], job.get("engine", "table"))
+
+def _proof(args, job):
+    if not args:
+        raise ValueError("A proof needs at least a conclusion.")
+    return proofs.valid_proof(args, job.get("engine", "table"))
+
+OPS = {
+    "table": _table,
+    "equiv": _equiv,
+    "satisfiable": lambda args, job: truthtable.satisfiable(parsing.parse(_one(args)), job.get("engine", "table")),
+    "tautology": lambda args, job: truthtable.tautology(parsing.parse(_one(args)), job.get("engine", "table")),
+    "dnf": lambda args, job: normal_forms.to_dnf(_one(args), job.get("minimize", False)),
+    "cnf": lambda args, job: normal_forms.to_cnf(_one(args), job.get("minimize", False)),
+    "proof": _proof,
+    "count": lambda args, job: count.count_models(parsing.parse(_one(args))),
+    "simplify": lambda args, job: simplify.simplify_expression(_one(args)),
+}
+
+def parse_job(line):
+    """Reads a job from a JSON or tab-separated line."""
+    if line.lstrip().startswith("{"):
+        job = json.loads(line)
+        if not isinstance(job, dict):
+            raise ValueError("A job must be a JSON object.")
+    else:
+        fields = line.rstrip("\r\n").split("\t")
+        job = {"op": fields[0], "args": fields[1:]}
+    if not isinstance(job.get("op"), basestring) or job["op"] not in OPS:
+        raise ValueError("Unknown op %r." % job.get("op"))
+    args = job.get("args", [])
+    if not isinstance(args, list) or not all(isinstance(arg, basestring) for arg in args):
+        raise ValueError("args must be a list of strings.")
+    if job.get("engine", "table") not in truthtable.ENGINES:
+        raise ValueError("Unknown engine %r." % job["engine"])
+    return job
+
+def run_job(line):
+    """Runs the job on one line, returning its result as a JSON string.
+
+    Bad jobs and expressions give a result with an "error" rather than stopping the batch."""
+    result = {}
+    if stats.enabled:
+        stats.count("jobs")
+    try:
+        job = parse_job(line)
+        if "id" in job:
+            result["id"] = job["id"]
+        result["op"] = job["op"]
+        result["result"] = OPS[job["op"]](job.get("args", []), job)
+    except (IOError, ValueError, LogicError) as e:
+        result["error"] = str(e)
+    except Exception as e:
+        # Anything else (an engine running out of stack, say) is still this job's failure alone.
+        result["error"] = "%s: %s" % (type(e).__name__, e)
+    return json.dumps(result, sort_keys=True)
+
+def run(lines, stream, jobs=1):
+    """Runs a job for every non-blank line, writing results to the stream in the same order."""
+    lines = (line for line in lines if line.strip())
+    if jobs == 1:
+        for line in lines:
+            print(run_job(line), file=stream)
+        return
+    pool = multiprocessing.Pool(jobs)
+    try:
+        for result in pool.imap(run_job, lines, POOL_CHUNK):
+            print(result, file=stream)
+    finally:
+        pool.terminate()
+
+# Tests
+
+def _results(text, jobs=1):
+    out = StringIO()
+    run(StringIO(text), out, jobs)
+    return [json.loads(line) for line in out.getvalue().splitlines()]
+
+def test_json_jobs():
+    results = _results('{"op": "equiv", "args": ["(AvB)", "~(~A&~B)"], "id": 7}\n'
+                       '{"op": "tautology", "args": ["(Av~A)"], "engine": "sat"}\n'
+                       '\n'
+                       '{"op": "table", "args": ["(A&B)"]}\n')
+    assert_equal(results, [
+        {"id": 7, "op": "equiv", "result": True},
+        {"op": "tautology", "result": True},
+        {"op": "table", "result": {"atoms": ["A", "B"], "values": "1000"}},
+    ])
+
+def test_tab_separated_jobs():
+    results = _results("dnf\t(A&B)\nproof\t(A>B)\tA\tB\nsatisfiable\t(A&~A)\nsimplify\t(A&(AvB))\n")
+    assert_equal([r["result"] for r in results], ["((A & B))", True, False, "A"])
+
+def test_job_errors():
+    results = _results('frobnicate\tA\nequiv\tA\n{"op": "dnf", "args": ["(A&"]}\n{"op": "cnf"\n'
+                       '{"op": "satisfiable", "args": [5]}\n{"op": ["dnf"]}\n{"op": "table", "args": "A"}\n')
+    assert_equal(len(results), 7)
+    assert all("error" in r and "result" not in r for r in results)
+
+def test_unexpected_errors():
+    def fail(args, job):
+        raise RuntimeError("maximum recursion depth exceeded")
+    OPS["fail"] = fail
+    try:
+        results = _results("fail\tA\ndnf\t(A&B)\n")
+    finally:
+        del OPS["fail"]
+    assert_equal(results, [{"op": "fail", "error": "RuntimeError: maximum recursion depth exceeded"},
+                           {"op": "dnf", "result": "((A & B))"}])
+
+def test_pool_matches_sequential():
+    text = "".join("equiv\t(A%dvB)\t~(~A%d&~B)\n" % (i, i) for i in range(5)) + "cnf\t(AxB)\n"
+    assert_equal(_results(text, 2), _results(text))
@@ -0,0 +1,474 @@
+"""Reduced ordered binary decision diagrams.
+
+A BDD manager hash-conses its nodes in a unique table, so every boolean function over its
+variables has exactly one node: equivalence is node equality, tautology and satisfiability
+are comparisons against the terminals, and model counting is linear in the diagram's size.
+
+Nodes are ints indexing the manager's arrays. FALSE (0) and TRUE (1) are the terminals."""
+import sys
+import stats
+from nodes import AtomNode, NotNode, AndNode, OrNode, XorNode, IfNode, LogicError, postorder
+from parsing import parse
+from nose.tools import assert_equal, assert_true, assert_false
+
+FALSE = 0
+TRUE = 1
+# Slots in the operation cache. Colliding entries overwrite each other, which bounds its memory.
+CACHE_SIZE = 1 << 16
+# With reordering on, from_tree sifts once the unique table passes this many nodes, and again
+# each time it doubles. Sifting stops moving atoms after this many level swaps.
+SIFT_NODES = 1 << 17
+SIFT_SWAPS = 1 << 13
+# An atom stops moving in one direction once the diagram grows past this factor.
+SIFT_GROWTH = 1.2
+_TERMINAL_LEVEL = sys.maxint
+
+class BDD(object):
+    """A manager holding shared BDD nodes over an ordered list of atoms.
+
+    With reorder, from_tree sifts the order as the diagram grows. Only the nodes from_tree
+    returns survive that, so a manager whose nodes are built otherwise leaves it off."""
+
+    def __init__(self, order=(), reorder=False):
+        self.order = []
+        self.levels = {}
+        self._level = [_TERMINAL_LEVEL, _TERMINAL_LEVEL]
+        self._low = [FALSE, TRUE]
+        self._high = [FALSE, TRUE]
+        self._unique = {}
+        self._cache = [None] * CACHE_SIZE
+        self.cache_hits = self.cache_misses = 0
+        self.reorder = reorder
+        self.sift_at = SIFT_NODES
+        self._results = []
+        for atom in order:
+            self.add_atom(atom)
+
+    def add_atom(self, atom):
+        """Adds an atom below all existing ones in the variable order."""
+        if atom not in self.levels:
+            self.levels[atom] = len(self.order)
+            self.order.append(atom)
+
+    def __len__(self):
+        """Number of nodes created so far, including terminals."""
+        return len(self._level)
+
+    def mk(self, level, low, high):
+        """Returns the node testing the atom at `level`, hash-consed and with redundant tests removed."""
+        if low == high:
+            return low
+        key = (level, low, high)
+        node = self._unique.get(key)
+        if node is None:
+            node = len(self._level)
+            self._level.append(level)
+            self._low.append(low)
+            self._high.append(high)
+            self._unique[key] = node
+        return node
+
+    def atom(self, atom):
+        self.add_atom(atom)
+        return self.mk(self.levels[atom], FALSE, TRUE)
+
+    def _cofactors(self, node, level):
+        if self._level[node] == level:
+            return self._low[node], self._high[node]
+        return node, node
+
+    def ite(self, f, g, h):
+        """If-then-else: the function that is g where f is true, and h elsewhere.
+
+        Iterative, with an explicit stack, as the recursion would go one level per variable."""
+        stack = [(f, g, h)]
+        results = []
+        while stack:
+            call = stack.pop()
+            if len(call) == 4:
+                # Both cofactors are done: build the node and remember it.
+                level, key, slot = call[1:]
+                high = results.pop()
+                low = results.pop()
+                result = self.mk(level, low, high)
+                self._cache[slot] = (key, result)
+                results.append(result)
+                continue
+            f, g, h = call
+            if f == TRUE or g == h:
+                results.append(g)
+                continue
+            if f == FALSE:
+                results.append(h)
+                continue
+            if g == TRUE and h == FALSE:
+                results.append(f)
+                continue
+            slot = hash(call) & (CACHE_SIZE - 1)
+            entry = self._cache[slot]
+            if entry is not None and entry[0] == call:
+                self.cache_hits += 1
+                results.append(entry[1])
+                continue
+            self.cache_misses += 1
+            level = min(self._level[f], self._level[g], self._level[h])
+            f0, f1 = self._cofactors(f, level)
+            g0, g1 = self._cofactors(g, level)
+            h0, h1 = self._cofactors(h, level)
+            # The low cofactor is popped (and its result pushed) first.
+            stack.extend([(None, level, call, slot), (f1, g1, h1), (f0, g0, h0)])
+        return results[0]
+
+    def negate(self, f):
+        return self.ite(f, FALSE, TRUE)
+
+    def conjoin(self, f, g):
+        return self.ite(f, g, FALSE)
+
+    def disjoin(self, f, g):
+        return self.ite(f, TRUE, g)
+
+    def from_tree(self, tree):
+        """Builds the node for a parse tree. New atoms go to the bottom of the order, as first met."""
+        hits, misses = self.cache_hits, self.cache_misses
+        with stats.phase("bdd"):
+            result = self._from_tree(tree)
+        self._results.append(result)
+        if stats.enabled:
+            stats.count("bdd_cache_hits", self.cache_hits - hits)
+            stats.count("bdd_cache_misses", self.cache_misses - misses)
+        return result
+
+    def _from_tree(self, tree):
+        for node in postorder(tree):
+            if isinstance(node, AtomNode):
+                self.add_atom(node.l)
+        built = {}
+        for node in postorder(tree):
+            if isinstance(node, AtomNode):
+                built[id(node)] = self.atom(node.l)
+                continue
+            children = [built[id(child)] for child in node.children]
+            if isinstance(node, NotNode):
+                if len(children) != 1:
+                    raise LogicError("NOT is undefined for multiple children.")
+                result = self.negate(children[0])
+            elif isinstance(node, IfNode):
+                if len(children) != 2:
+                    raise LogicError("IF is only defined for exactly two children.")
+                result = self.ite(children[0], children[1], TRUE)
+            else:
+                # AND only needs every operand true, OR only some; XOR and IFF need both. Operands
+                # lowest in the order go first, so each step adds to the top of what's built so far.
+                some, every = FALSE, TRUE
+                for child in sorted(children, key=lambda child: -self._level[child]):
+                    if not isinstance(node, AndNode):
+                        some = self.disjoin(some, child)
+                    if not isinstance(node, OrNode):
+                        every = self.conjoin(every, child)
+                    self._grown(built.values() + [some, every])
+                if isinstance(node, AndNode):
+                    result = every
+                elif isinstance(node, OrNode):
+                    result = some
+                elif isinstance(node, XorNode):
+                    result = self.conjoin(some, self.negate(every))
+                else:
+                    result = self.disjoin(self.negate(some), every)
+            built[id(node)] = result
+            self._grown(built.values())
+        return built[id(tree)]
+
+    def _grown(self, roots):
+        # Called as the diagram grows, with the nodes still needed.
+        if self.reorder and len(self._unique) > self.sift_at:
+            self.sift(roots)
+            self.sift_at = max(2 * self.sift_at, 2 * len(self._unique))
+
+    def sift(self, roots):
+        """Reorders variables in place by sifting: each atom in turn, busiest first, is moved
+        through the order one level at a time and left wherever the diagram was smallest.
+
+        Nodes keep their functions, but only those reachable from the roots or from earlier
+        from_tree results are kept: others are dropped and mustn't be used afterwards."""
+        live = [node for node in self.reachable(list(roots) + self._results) if node > TRUE]
+        self._unique = dict(((self._level[node], self._low[node], self._high[node]), node) for node in live)
+        # References from live nodes, plus one for each root so that they're never dropped.
+        refs = dict((node, 0) for node in live)
+        for node in live:
+            for child in (self._low[node], self._high[node]):
+                if child > TRUE:
+                    refs[child] += 1
+        for root in list(roots) + self._results:
+            if root > TRUE:
+                refs[root] += 1
+        at_level = [set() for atom in self.order]
+        for node in live:
+            at_level[self._level[node]].add(node)
+        # refs holds exactly the live nodes, so its length is the diagram's size.
+        swaps = 0
+        for atom in sorted(self.order, key=lambda a: -len(at_level[self.levels[a]])):
+            if swaps >= SIFT_SWAPS:
+                break
+            start = position = self.levels[atom]
+            best, best_size = position, len(refs)
+            limit = best_size * SIFT_GROWTH
+            # Down to the bottom, up to the top, then back to the best position seen.
+            while position < len(self.order) - 1 and swaps < SIFT_SWAPS:
+                self._swap(position, at_level, refs)
+                position += 1
+                swaps += 1
+                size = len(refs)
+                if size < best_size:
+                    best, best_size = position, size
+                if size > limit:
+                    break
+            while position > 0 and swaps < SIFT_SWAPS:
+                self._swap(position - 1, at_level, refs)
+                position -= 1
+                swaps += 1
+                size = len(refs)
+                if size < best_size:
+                    best, best_size = position, size
+                if size > limit and position < start:
+                    break
+            while position < best:
+                self._swap(position, at_level, refs)
+                position += 1
+            while position > best:
+                self._swap(position - 1, at_level, refs)
+                position -= 1
+        # Cached results may be dropped nodes.
+        self._cache = [None] * CACHE_SIZE
+        if stats.enabled:
+            stats.count("bdd_swaps", swaps)
+
+    def _swap(self, level, at_level, refs):
+        """Swaps the atoms at `level` and the level below, rewriting the live nodes at both in place."""
+        lows, highs, levels, unique = self._low, self._high, self._level, self._unique
+        xs, ys = at_level[level], at_level[level + 1]
+        for node in xs | ys:
+            del unique[(levels[node], lows[node], highs[node])]
+        x, y = self.order[level], self.order[level + 1]
+        self.order[level], self.order[level + 1] = y, x
+        self.levels[x], self.levels[y] = level + 1, level
+        # Nodes testing x that don't depend on y just move down; those testing y move up.
+        depends, moved = [], set()
+        for node in xs:
+            if lows[node] in ys or highs[node] in ys:
+                depends.append(node)
+            else:
+                moved.add(node)
+                levels[node] = level + 1
+                unique[(level + 1, lows[node], highs[node])] = node
+        for node in ys:
+            levels[node] = level
+            unique[(level, lows[node], highs[node])] = node
+        at_level[level], at_level[level + 1] = ys.union(depends), moved
+
+        # Nodes testing x then y become nodes testing y then x, keeping their ids.
+        for node in depends:
+            f0, f1 = lows[node], highs[node]
+            f00, f01 = (lows[f0], highs[f0]) if f0 in ys else (f0, f0)
+            f10, f11 = (lows[f1], highs[f1]) if f1 in ys else (f1, f1)
+            children = []
+            for low, high in ((f00, f10), (f01, f11)):
+                # The live node testing x (now at level + 1) with these cofactors, referenced once more.
+                child = self.mk(level + 1, low, high)
+                if child > TRUE:
+                    if child not in refs:
+                        refs[child] = 0
+                        moved.add(child)
+                        for grandchild in (low, high):
+                            if grandchild > TRUE:
+                                refs[grandchild] += 1
+                    refs[child] += 1
+                children.append(child)
+            lows[node], highs[node] = children
+            unique[(level, children[0], children[1])] = node
+            self._release([f0, f1], at_level, refs)
+
+    def _release(self, nodes, at_level, refs):
+        """Drops a reference to each node, and drops nodes left with none (and so on down)."""
+        stack = [node for node in nodes if node > TRUE]
+        while stack:
+            node = stack.pop()
+            refs[node] -= 1
+            if refs[node] == 0:
+                del refs[node]
+                at_level[self._level[node]].discard(node)
+                del self._unique[(self._level[node], self._low[node], self._high[node])]
+                stack.extend(child for child in (self._low[node], self._high[node]) if child > TRUE)
+
+    def reachable(self, roots):
+        """Yields every node reachable from the roots (including terminals), children first."""
+        seen = set()
+        stack = [(root, False) for root in roots]
+        while stack:
+            node, expanded = stack.pop()
+            if node in seen:
+                continue
+            if expanded or node <= TRUE:
+                seen.add(node)
+                yield node
+            else:
+                stack.extend([(node, True), (self._high[node], False), (self._low[node], False)])
+
+    def size(self, f):
+        """Number of nodes in the diagram for f, including terminals."""
+        return sum(1 for node in self.reachable([f]))
+
+    def count(self, f, num_atoms=None):
+        """Counts the assignments to the first num_atoms atoms (default: all) satisfying f."""
+        if num_atoms is None:
+            num_atoms = len(self.order)
+        level = lambda node: min(self._level[node], num_atoms)
+        counts = {FALSE: 0, TRUE: 1}
+        for node in self.reachable([f]):
+            if node > TRUE:
+                low, high = self._low[node], self._high[node]
+                counts[node] = (counts[low] << (level(low) - level(node) - 1)) + \
+                    (counts[high] << (level(high) - level(node) - 1))
+        return counts[f] << level(f)
+
+    def any_model(self, f):
+        """Returns a partial assignment (dict of atom -> bool) satisfying f, or None if f is FALSE."""
+        if f == FALSE:
+            return None
+        model = {}
+        while f != TRUE:
+            atom = self.order[self._level[f]]
+            if self._low[f] != FALSE:
+                model[atom], f = False, self._low[f]
+            else:
+                model[atom], f = True, self._high[f]
+        return model
+
+    def first_model(self, f, atoms):
+        """Returns the assignment to the atoms satisfying f that comes first in their truth table,
+        or None if f is FALSE. Rows count up from all atoms true, the first atom changing fastest,
+        so the atoms are settled last to first, each true unless that leaves f unsatisfiable."""
+        if f == FALSE:
+            return None
+        model = {}
+        for atom in reversed(atoms):
+            with_atom = self.conjoin(f, self.atom(atom))
+            model[atom] = with_atom != FALSE
+            f = with_atom if model[atom] else self.conjoin(f, self.negate(self.atom(atom)))
+        return model
+
+def satisfiable(tree):
+    return BDD(reorder=True).from_tree(tree) != FALSE
+
+def tautology(tree):
+    return BDD(reorder=True).from_tree(tree) == TRUE
+
+def equivalent(tree1, tree2):
+    manager = BDD(reorder=True)
+    return manager.from_tree(tree1) == manager.from_tree(tree2)
+
+def distinguishing_model(tree1, tree2, atoms=None):
+    """Returns the first assignment to the atoms (by default both trees', sorted) in their truth
+    table on which two parse trees differ, or None if they're equivalent."""
+    if atoms is None:
+        atoms = sorted(tree1.atoms() | tree2.atoms())
+    manager = BDD(reorder=True)
+    f, g = manager.from_tree(tree1), manager.from_tree(tree2)
+    return manager.first_model(manager.ite(f, manager.negate(g), g), atoms)
+
+# Tests
+
+def test_canonical():
+    manager = BDD()
+    f = manager.from_tree(parse("(A&(BvC))"))
+    g = manager.from_tree(parse("((A&B)v(A&C))"))
+    assert_equal(f, g)
+    assert f != manager.from_tree(parse("(A&B)"))
+
+def test_terminals():
+    assert_true(tautology(parse("((A>B)=(~AvB))")))
+    assert_false(satisfiable(parse("(A&~A)")))
+    assert_true(satisfiable(parse("(AxB)")))
+    assert_false(tautology(parse("(AxB)")))
+
+def test_count():
+    manager = BDD()
+    f = manager.from_tree(parse("((AvB)&(CvD))"))
+    assert_equal(manager.count(f), 9)
+    assert_equal(manager.count(manager.from_tree(parse("(AxBxC)"))), 12)
+    assert_equal(manager.count(manager.from_tree(parse("(AxBxC)")), 3), 6)
+    assert_equal(manager.count(TRUE), 16)
+    assert_equal(manager.count(FALSE), 0)
+
+def test_any_model():
+    manager = BDD()
+    tree = parse("((A>B)&A&~C)")
+    model = manager.any_model(manager.from_tree(tree))
+    assert tree.eval(model)
+    assert_equal(manager.any_model(FALSE), None)
+
+def test_cache_bounded():
+    manager = BDD()
+    tree = parse("((A&B)v(C&D)v(E&F)v(G&H)v(I&J)v(K&L))")
+    manager.from_tree(tree)
+    assert len(manager._cache) == CACHE_SIZE
+    assert manager.cache_misses > 0
+
+def test_order():
+    # (A1&B1)v(A2&B2)v(A3&B3) is exponential with all As before all Bs, linear interleaved.
+    exp = parse("((A&B)v(C&D)v(E&F))")
+    apart, interleaved = BDD(["A", "C", "E", "B", "D", "F"]), BDD(["A", "B", "C", "D", "E", "F"])
+    f, g = apart.from_tree(exp), interleaved.from_tree(exp)
+    assert interleaved.size(g) < apart.size(f)
+    assert_equal(apart.count(f), interleaved.count(g))
+
+def test_sift():
+    exp = parse("((A&B)v(C&D)v(E&F))")
+    manager = BDD(["A", "C", "E", "B", "D", "F"])
+    f = manager.from_tree(exp)
+    before, count = manager.size(f), manager.count(f)
+    manager.sift([f])
+    assert manager.size(f) < before
+    assert_equal(manager.count(f), count)
+    # f still stands for the same function: building it again finds the same node.
+    assert_equal(manager.from_tree(exp), f)
+    assert_equal(manager.from_tree(parse("((B&A)v(D&C)v(F&E))")), f)
+
+def test_sift_while_building():
+    pairs = range(8)
+    exp = parse("(%s)" % " v ".join("(A%d & B%d)" % (i, i) for i in pairs))
+    order = ["A%d" % i for i in pairs] + ["B%d" % i for i in pairs]
+    fixed = BDD(order)
+    manager = BDD(order, reorder=True)
+    manager.sift_at = 16
+    f, g = fixed.from_tree(exp), manager.from_tree(exp)
+    assert manager.size(g) * 4 < fixed.size(f)
+    assert_equal(manager.count(g), fixed.count(f))
+    model = manager.any_model(g)
+    assert exp.eval(dict((atom, model.get(atom, False)) for atom in order))
+    # Sifting again while building something else keeps g, which from_tree returned.
+    manager.sift_at = 16
+    same = parse("~(%s)" % " & ".join("(~A%d v ~B%d)" % (i, i) for i in pairs))
+    assert_equal(manager.from_tree(same), g)
+
+def test_many_levels():
+    # A level per atom: deeper than Python's recursion limit.
+    wide = "(%s)" % " & ".join("X%d" % i for i in range(1500))
+    assert_true(satisfiable(parse(wide)))
+    assert_false(tautology(parse(wide)))
+    # Negating the chain walks all of it.
+    assert_false(satisfiable(parse("(%s & ~%s)" % (wide, wide))))
+    assert_true(satisfiable(parse("(%s)" % " x ".join("X%d" % i for i in range(1500)))))
+
+def test_equivalent():
+    assert equivalent(parse("(AvB)"), parse("~(~A&~B)"))
+    assert not equivalent(parse("(AvB)"), parse("(AxB)"))
+
+def test_distinguishing_model():
+    tree1, tree2 = parse("(A>B)"), parse("(B>A)")
+    model = distinguishing_model(tree1, tree2)
+    assert tree1.eval(model) != tree2.eval(model)
+    # They differ where exactly one of A and B is true; row 1 is the first such row.
+    assert_equal(model, {"A": False, "B": True})
+    assert_equal(distinguishing_model(tree1, tree2, ["A", "B", "C"]), {"A": False, "B": True, "C": True})
+    assert_equal(distinguishing_model(tree1, parse("(~AvB)")), None)
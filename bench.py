@@ -0,0 +1,251 @@
+"""Benchmarks: formula generators, and timings of each stage of carroll's pipeline on them.
+
+Every generator is deterministic (random ones take a seed), so results from different runs and
+different versions can be compared. run() returns a JSON-ready dict of timings and peak memory."""
+from __future__ import print_function
+import json
+import os
+import platform
+import random
+import resource
+import timeit
+import multiprocessing
+import parsing
+import codegen
+import simplify
+import truthtable
+import normal_forms
+import proofs
+from StringIO import StringIO
+from nose.tools import assert_equal
+
+# Stages that enumerate a whole truth table are skipped beyond this many atoms.
+TABLE_ATOMS = 20
+# Normal forms print one term per row, so they're skipped sooner.
+NORMAL_FORM_ATOMS = 14
+# Random rows evaluated with Node.eval (the tree-walking interpreter) and with compiled code.
+EVAL_ROWS = 256
+
+def atom_names(n):
+    return ["X%d" % i for i in xrange(1, n + 1)]
+
+def _join(op, terms):
+    return terms[0] if len(terms) == 1 else "(%s)" % op.join(terms)
+
+def clauses_to_expression(clauses, names):
+    """Writes DIMACS-style clauses (lists of signed 1-based ints) as a CNF expression."""
+    literal = lambda lit: ("~" if lit < 0 else "") + names[abs(lit) - 1]
+    return _join("&", [_join("v", [literal(lit) for lit in clause]) for clause in clauses])
+
+def random_kcnf(num_atoms, ratio=4.26, k=3, seed=0):
+    """A random k-CNF with round(ratio * num_atoms) clauses of k distinct atoms each.
+    Near the default ratio, random 3-CNFs are hardest for solvers."""
+    rng = random.Random(seed)
+    clauses = []
+    for i in xrange(int(round(ratio * num_atoms))):
+        atoms = rng.sample(xrange(1, num_atoms + 1), k)
+        clauses.append([atom if rng.random() < 0.5 else -atom for atom in atoms])
+    return clauses_to_expression(clauses, atom_names(num_atoms))
+
+def pigeonhole_clauses(holes):
+    """Clauses saying holes + 1 pigeons fit in `holes` holes, one per hole. Always unsatisfiable."""
+    var = lambda pigeon, hole: pigeon * holes + hole + 1
+    clauses = [[var(p, h) for h in range(holes)] for p in range(holes + 1)]
+    for h in range(holes):
+        for p in range(holes + 1):
+            for q in range(p + 1, holes + 1):
+                clauses.append([-var(p, h), -var(q, h)])
+    return clauses
+
+def pigeonhole(holes):
+    """The pigeonhole principle for holes + 1 pigeons, as an unsatisfiable CNF."""
+    return clauses_to_expression(pigeonhole_clauses(holes), atom_names(holes * (holes + 1)))
+
+def parity(num_atoms):
+    """A chain of two-input XORs: true when an odd number of atoms are true."""
+    names = atom_names(num_atoms)
+    exp = names[-1]
+    for name in reversed(names[:-1]):
+        exp = "(%sx%s)" % (name, exp)
+    return exp
+
+def deep(depth, num_atoms=8):
+    """Alternating ANDs and ORs nested `depth` deep, over a few atoms."""
+    names = atom_names(num_atoms)
+    exp = names[depth % num_atoms]
+    for i in xrange(depth - 1, -1, -1):
+        exp = "(%s%s%s)" % (names[i % num_atoms], "&" if i % 2 else "v", exp)
+    return exp
+
+def shared(depth, num_atoms=8):
+    """A chain of let definitions, each using the one before it twice: small text, and a
+    DAG of size `depth`, but a tree of size 2**depth if the sharing were lost."""
+    names = atom_names(num_atoms)
+    exp = "let P0 = %s in " % names[0]
+    for i in xrange(1, depth + 1):
+        exp += "let P%d = ((P%d x %s) v (P%d & %s)) in " % (i, i - 1, names[i % num_atoms], i - 1, names[(i + 1) % num_atoms])
+    return exp + "P%d" % depth
+
+def wide_and(num_atoms):
+    return _join("&", atom_names(num_atoms))
+
+def wide_or(num_atoms):
+    return _join("v", atom_names(num_atoms))
+
+# Each family's generator, and the sizes benchmarked by default. Sizes are atom counts,
+# except for pigeonhole (holes), deep (nesting depth) and shared (definitions).
+FAMILIES = {
+    "kcnf": (random_kcnf, [8, 12, 16]),
+    "pigeonhole": (pigeonhole, [2, 3, 4]),
+    "parity": (parity, [8, 12, 16]),
+    "deep": (deep, [100, 1000, 10000]),
+    "shared": (shared, [100, 1000, 10000]),
+    "wide_and": (wide_and, [8, 12, 16]),
+    "wide_or": (wide_or, [8, 12, 16]),
+}
+
+def _random_rows(atoms):
+    rng = random.Random(0)
+    return [[rng.random() < 0.5 for atom in atoms] for i in xrange(EVAL_ROWS)]
+
+def _eval_rows(tree, atoms, rows):
+    for row in rows:
+        tree.eval(dict(zip(atoms, row)))
+
+def _eval_compiled(tree, atoms, rows):
+    evaluate = codegen.compile_tree(tree, atoms)
+    for row in rows:
+        evaluate(*row)
+
+def _clear_caches():
+    """Empties the caches of parsed, simplified and compiled trees, so the next run starts cold."""
+    parsing._cache.clear()
+    codegen._cache.clear()
+    simplify.clear_caches()
+
+def stages(exp):
+    """Returns (name, function) for each stage worth timing on an expression."""
+    atoms = truthtable.find_atoms(exp)
+    # Stages after parse reuse this tree.
+    tree = parsing.parse(exp)
+    rows = _random_rows(atoms)
+    found = [("parse", lambda: parsing.parse(exp)), ("eval", lambda: _eval_rows(tree, atoms, rows)),
+             ("eval_compiled", lambda: _eval_compiled(tree, atoms, rows))]
+    if len(atoms) <= TABLE_ATOMS:
+        found.append(("table", lambda: truthtable.table_bits(tree, atoms)))
+        found.append(("write_table", lambda: truthtable.write_table(tree, atoms, "text", StringIO())))
+        found.append(("proof", lambda: proofs.valid_proof([exp, atoms[0]])))
+    if len(atoms) <= NORMAL_FORM_ATOMS:
+        found.append(("dnf", lambda: normal_forms.to_dnf(exp)))
+        found.append(("cnf", lambda: normal_forms.to_cnf(exp)))
+    for engine in ["sat", "bdd"]:
+        found.append(("satisfiable_" + engine, lambda engine=engine: truthtable.satisfiable(tree, engine)))
+    return found
+
+def _peak_kb(stage):
+    """Runs a stage, cold, in a forked process, and returns how far it raised that process's
+    peak resident memory above where it started (which, after a fork, is its own size)."""
+    # A plain fork, since run() may call this from a pool's worker, which can't start processes.
+    reader, writer = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(reader)
+            _clear_caches()
+            start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            try:
+                stage()
+            except RuntimeError:
+                pass
+            os.write(writer, str(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - start))
+        finally:
+            os._exit(0)
+    os.close(writer)
+    peak = os.read(reader, 64)
+    os.close(reader)
+    os.waitpid(pid, 0)
+    return int(peak) if peak else None
+
+def run_case(family, size, repeat=3):
+    """Times every stage on one generated formula.
+
+    seconds is the best of `repeat` cold runs, each after emptying the parse, simplify and
+    compile caches; warm_seconds the best of `repeat` runs with them as the last run left
+    them. peak_kb is the memory a cold run of the stage took, measured in its own process."""
+    generate = FAMILIES[family][0]
+    exp = generate(size)
+    case = {"family": family, "size": size, "length": len(exp),
+            "atoms": len(truthtable.find_atoms(exp)), "stages": {}}
+    for name, stage in stages(exp):
+        try:
+            result = {"seconds": min(timeit.repeat(stage, _clear_caches, number=1, repeat=repeat)),
+                      "warm_seconds": min(timeit.repeat(stage, number=1, repeat=repeat))}
+        except RuntimeError as e:
+            # Recursive stages can run out of stack on deep formulas; that's worth recording too.
+            result = {"error": str(e)}
+        result["peak_kb"] = _peak_kb(stage)
+        case["stages"][name] = result
+    return case
+
+def _run_case(args):
+    return run_case(*args)
+
+def run(families=None, sizes=None, repeat=3, isolate=True):
+    """Benchmarks each family at each size (or its default sizes). Returns a JSON-ready dict.
+
+    With isolate, each case runs in its own process, so no case starts with another's caches or heap."""
+    cases = [(family, size, repeat) for family in (families or sorted(FAMILIES))
+             for size in (sizes or FAMILIES[family][1])]
+    if isolate:
+        pool = multiprocessing.Pool(1, maxtasksperchild=1)
+        try:
+            results = pool.map(_run_case, cases, 1)
+        finally:
+            pool.terminate()
+    else:
+        results = [_run_case(case) for case in cases]
+    return {"python": platform.python_version(), "machine": platform.machine(), "cases": results}
+
+def write(results, stream):
+    json.dump(results, stream, indent=2, sort_keys=True)
+    print(file=stream)
+
+# Tests
+
+def test_generators_deterministic():
+    assert_equal(random_kcnf(10, seed=3), random_kcnf(10, seed=3))
+    assert random_kcnf(10, seed=3) != random_kcnf(10, seed=4)
+    assert_equal(len(truthtable.find_atoms(random_kcnf(10, ratio=3))), 10)
+
+def test_generator_semantics():
+    assert not truthtable.satisfiable(parsing.parse(pigeonhole(2)))
+    assert truthtable.satisfiable(parsing.parse(random_kcnf(6, ratio=1)))
+    tree = parsing.parse(parity(5))
+    assert_equal(bin(truthtable.table_bits(tree, atom_names(5))).count("1"), 16)
+    assert_equal(parity(3), "(X1x(X2xX3))")
+    assert_equal(deep(3, 2), "(X1v(X2&(X1vX2)))")
+    assert_equal(wide_or(3), "(X1vX2vX3)")
+    assert_equal(shared(1, 2), "let P0 = X1 in let P1 = ((P0 x X2) v (P0 & X1)) in P1")
+    assert_equal(clauses_to_expression([[1, -2], [2]], ["A", "B"]), "((Av~B)&B)")
+
+def test_run():
+    results = run(["parity", "wide_and"], [4], repeat=1, isolate=False)
+    assert_equal([case["family"] for case in results["cases"]], ["parity", "wide_and"])
+    stages = results["cases"][0]["stages"]
+    assert_equal(sorted(stages), ["cnf", "dnf", "eval", "eval_compiled", "parse", "proof", "satisfiable_bdd",
+                                  "satisfiable_sat", "table", "write_table"])
+    assert all(stage["seconds"] >= 0 and stage["warm_seconds"] >= 0 for stage in stages.values())
+    assert all(stage["peak_kb"] >= 0 for stage in stages.values())
+    out = StringIO()
+    write(results, out)
+    assert_equal(json.loads(out.getvalue()), results)
+
+def test_peak_kb():
+    assert _peak_kb(lambda: " " * (64 << 20)) >= 60 << 10
+    assert _peak_kb(lambda: None) < 8 << 10
+
+def test_cold_runs():
+    tree = parsing.parse(parity(8))
+    simplify.simplify(tree)
+    _clear_caches()
+    assert tree not in simplify._cache and tree not in codegen._cache
@@ -0,0 +1,192 @@
+"""An opt-in cache of results on disk, so repeated queries across runs are answered instantly.
+
+Results (truth table bits, normal forms, satisfiability, tautology and equivalence answers)
+live in a SQLite file, keyed by a digest of what was asked and of the expressions' canonical
+form: parsed, with the operands of commutative operators in a fixed order, and written back
+out with one symbol per operator. So "(B|A)", "(A v B)" and "(AvB)" share a result. When the
+file's results outgrow the size limit, the least recently used are evicted.
+
+The cache is off until enable() is called (the CLI's --cache and --cache-dir options)."""
+import os
+import json
+import sqlite3
+import hashlib
+import shutil
+import tempfile
+import parsing
+import simplify
+import symbols
+import stats
+from nodes import Node
+from nose.tools import assert_equal
+
+DEFAULT_DIR = os.path.join(os.path.expanduser("~"), ".cache", "carroll")
+DEFAULT_SIZE = 64 << 20
+FILENAME = "results.sqlite"
+# Tables are cached whole, so only while they fit in one chunk (see truthtable.CHUNK_ATOMS).
+TABLE_ATOMS = 20
+
+_SCHEMA = """CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    used INTEGER NOT NULL
+)"""
+# Uses are numbered in order, across every process sharing the file.
+_NEXT_USE = "SELECT COALESCE(MAX(used), 0) + 1 FROM results"
+
+class Cache(object):
+    """A SQLite file of JSON results, holding at most max_size bytes of them."""
+
+    def __init__(self, directory=DEFAULT_DIR, max_size=DEFAULT_SIZE):
+        self.path = os.path.join(directory, FILENAME)
+        self.max_size = max_size
+        self._connection = None
+        self._pid = None
+
+    def _connect(self):
+        # A connection can't be shared with forked worker processes, so each opens its own.
+        if self._connection is None or self._pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            self._connection = sqlite3.connect(self.path, timeout=30)
+            self._connection.execute(_SCHEMA)
+            self._connection.execute("CREATE INDEX IF NOT EXISTS results_used ON results (used)")
+            self._pid = os.getpid()
+        return self._connection
+
+    def get(self, key):
+        """Returns the result stored under a key, or None."""
+        db = self._connect()
+        row = db.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+        if stats.enabled:
+            stats.count("disk_cache_misses" if row is None else "disk_cache_hits")
+        if row is None:
+            return None
+        with db:
+            db.execute("UPDATE results SET used = (%s) WHERE key = ?" % _NEXT_USE, (key,))
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        """Stores a JSON-ready result, then evicts the least recently used results over the limit."""
+        text = json.dumps(value)
+        db = self._connect()
+        with db:
+            db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, (%s))" % _NEXT_USE, (key, text, len(key) + len(text)))
+            excess = db.execute("SELECT SUM(size) FROM results").fetchone()[0] - self.max_size
+            if excess > 0:
+                evicted = []
+                for old, size in db.execute("SELECT key, size FROM results ORDER BY used"):
+                    if excess <= 0:
+                        break
+                    evicted.append((old,))
+                    excess -= size
+                db.executemany("DELETE FROM results WHERE key = ?", evicted)
+                if stats.enabled:
+                    stats.count("disk_cache_evictions", len(evicted))
+
+    def size(self):
+        """The total size of the stored results, in bytes."""
+        return self._connect().execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+
+    def clear(self):
+        with self._connect() as db:
+            db.execute("DELETE FROM results")
+
+_store = None
+
+def enable(directory=DEFAULT_DIR, max_size=DEFAULT_SIZE):
+    global _store
+    _store = Cache(directory, max_size)
+
+def disable():
+    global _store
+    _store = None
+
+def enabled():
+    return _store is not None
+
+def canonical(tree):
+    """Writes a parse tree in canonical form: the same string for trees differing only in
+    whitespace, operator symbols, or the order of commutative operands. Shared wffs are
+    written once, so the form is no bigger than the DAG."""
+    return symbols.to_string(simplify.ordered(tree), shared=True)
+
+def key(kind, *parts):
+    """A digest of a kind of result and what it was computed from: parse trees, which are
+    written canonically, and anything else JSON-ready."""
+    parts = [canonical(part) if isinstance(part, Node) else part for part in parts]
+    return hashlib.sha1(json.dumps([kind] + parts)).hexdigest()
+
+def cached(kind, parts, compute, encode=None, decode=None):
+    """Returns compute(), or its stored result when the cache is on and has one for the kind and parts.
+
+    Results must be JSON-ready, or encode and decode must convert them to and from something that is."""
+    if _store is None:
+        return compute()
+    digest = key(kind, *parts)
+    # Stored in a list, so that a result of None can be told from a missing one.
+    found = _store.get(digest)
+    if found is not None:
+        return decode(found[0]) if decode else found[0]
+    result = compute()
+    _store.put(digest, [encode(result) if encode else result])
+    return result
+
+# Tests
+
+def _temporary(max_size=DEFAULT_SIZE):
+    directory = tempfile.mkdtemp()
+    return directory, Cache(os.path.join(directory, "sub"), max_size)
+
+def test_canonical_key():
+    same = ["(A v B)", "(B|A)", "( A v  B )"]
+    assert_equal(len(set(key("dnf", parsing.parse(exp)) for exp in same)), 1)
+    assert_equal(canonical(parsing.parse("((C^B)&(A>B)&~~A)")), "(~~A & (B & C) & (A > B))")
+    assert key("dnf", parsing.parse("(A>B)")) != key("dnf", parsing.parse("(B>A)"))
+    assert key("dnf", parsing.parse("(AvB)")) != key("cnf", parsing.parse("(AvB)"))
+
+def test_get_put():
+    directory, store = _temporary()
+    try:
+        assert_equal(store.get("k"), None)
+        store.put("k", {"bits": "ff"})
+        assert_equal(store.get("k"), {"bits": "ff"})
+        assert_equal(Cache(os.path.join(directory, "sub")).get("k"), {"bits": "ff"})
+        store.clear()
+        assert_equal(store.size(), 0)
+    finally:
+        shutil.rmtree(directory)
+
+def test_lru_eviction():
+    directory, store = _temporary(max_size=30)
+    try:
+        store.put("a", "x" * 8)
+        store.put("b", "x" * 8)
+        store.get("a")
+        store.put("c", "x" * 8)
+        assert_equal([store.get(k) is None for k in "abc"], [False, True, False])
+        assert store.size() <= 30
+    finally:
+        shutil.rmtree(directory)
+
+def test_cached():
+    directory = tempfile.mkdtemp()
+    calls = []
+    def compute():
+        calls.append(1)
+        return 255
+    try:
+        enable(directory)
+        assert_equal(cached("equiv", ["y"], lambda: None), None)
+        assert_equal(cached("equiv", ["y"], lambda: 1), None)
+        disable()
+        assert_equal(cached("table", ["x"], compute), 255)
+        enable(directory)
+        for i in range(3):
+            assert_equal(cached("table", ["x"], compute, lambda bits: "%x" % bits, lambda text: int(text, 16)), 255)
+        assert_equal(len(calls), 2)
+    finally:
+        disable()
+        shutil.rmtree(directory)
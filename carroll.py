@@ -1,56 +1,282 @@
 from __future__ import print_function
 import sys
+import itertools
+import cProfile
 
 import click
 
+import parsing
 import truthtable
 import normal_forms
 import proofs
+import stats
+import cache
+import batch as carroll_batch
+import bench as carroll_bench
+import classify as carroll_classify
+import count as carroll_count
+import dimacs as carroll_dimacs
+import models as carroll_models
+import server as carroll_server
+import simplify as carroll_simplify
+
+def _expand(value):
+    """Expressions given as @FILE are read from a file: a DIMACS CNF if its name ends in .cnf
+    (see dimacs), otherwise a definitions file (see parsing.read_definitions)."""
+    if not value.startswith("@"):
+        return value
+    with open(value[1:]) as f:
+        if value.endswith(".cnf"):
+            return carroll_dimacs.to_tree(carroll_dimacs.read(f))
+        return parsing.read_definitions(f)
+
+def _read_expression(ctx, param, value):
+    try:
+        return _expand(value)
+    except IOError as e:
+        raise click.BadParameter(str(e))
 
 @click.group()
-def cli():
+@click.option("--stats", "show_stats", is_flag=True, default=False, help="Print counters and phase timings to stderr afterwards.")
+@click.option("--stats-json", is_flag=True, default=False, help="Like --stats, but as a JSON object.")
+@click.option("--profile", type=click.Path(dir_okay=False, writable=True), help="Write a cProfile profile of the run to this file.")
+@click.option("--cache", "use_cache", is_flag=True, default=False, help="Keep results in a cache on disk, and reuse them in later runs.")
+@click.option("--cache-dir", type=click.Path(file_okay=False), help="Directory for the cache (implies --cache; default %s)." % cache.DEFAULT_DIR)
+@click.option("--cache-size", type=click.IntRange(1), default=cache.DEFAULT_SIZE >> 20, help="Most megabytes of results to keep; the least recently used go first.")
+@click.pass_context
+def cli(ctx, show_stats, stats_json, profile, use_cache, cache_dir, cache_size):
     """Carroll is a command line tool for analysing propositional logic (also known as boolean functions or expressions).
     """
-    pass
+    if show_stats or stats_json:
+        stats.enable()
+        ctx.call_on_close(lambda: stats.report(sys.stderr, stats_json))
+    if profile:
+        profiler = cProfile.Profile()
+        def save_profile():
+            profiler.disable()
+            profiler.dump_stats(profile)
+        ctx.call_on_close(save_profile)
+        profiler.enable()
+    if use_cache or cache_dir:
+        cache.enable(cache_dir or cache.DEFAULT_DIR, cache_size << 20)
 
 @cli.command()
-@click.argument("expression_1")
-@click.argument("expression_2")
-def equiv(expression_1, expression_2):
-    """Checks whether two expressions are logically equivalent."""
-    print(truthtable.equivalent(expression_1, expression_2))
+@click.argument("expression_1", callback=_read_expression)
+@click.argument("expression_2", callback=_read_expression)
+@click.option("--engine", type=click.Choice(truthtable.ENGINES), default="table", help="How to check equivalence.")
+@click.option("--jobs", type=click.IntRange(1), default=1, help="Worker processes for large truth tables.")
+def equiv(expression_1, expression_2, engine, jobs):
+    """Checks whether two expressions are logically equivalent. If not, shows an assignment where they differ."""
+    model = truthtable.distinguishing_model(expression_1, expression_2, engine, jobs)
+    print(model is None)
+    if model is not None:
+        print("Differs at:%s" % truthtable.truth_to_str(model).rstrip())
 
 @cli.command()
-@click.argument("expression")
+@click.argument("expression", callback=_read_expression)
 @click.option("--verbose", is_flag=True, default=False, help="Check for satisfiability, validity etc.")
-def table(expression, verbose):
+@click.option("--engine", type=click.Choice(truthtable.ENGINES), default="table", help="How to check satisfiability and validity.")
+@click.option("--format", "fmt", type=click.Choice(truthtable.FORMATS), default="text", help="Output format for the table.")
+@click.option("--jobs", type=click.IntRange(1), default=1, help="Worker processes for large truth tables.")
+@click.option("--gray", is_flag=True, default=False, help="Evaluate rows one at a time in Gray-code order, for expressions too big to evaluate bit-parallel.")
+@click.option("--save", type=click.Path(dir_okay=False, writable=True), help="Save the table, one bit per row, to this file (for lookup) instead of printing it.")
+def table(expression, verbose, engine, fmt, jobs, gray, save):
     """Outputs a truth table for a logical expression."""
-    truthtable.print_truth_table(expression, verbose)
+    if save is None:
+        truthtable.print_truth_table(expression, verbose, engine=engine, fmt=fmt, jobs=jobs, gray=gray)
+        return
+    try:
+        tree = parsing.parse(expression)
+    except IOError as e:
+        print("Parse error: %s" % e)
+        return
+    saved = truthtable.TruthTable.build(tree, sorted(tree.atoms()), jobs, save)
+    if verbose:
+        truthtable.show_sat_info(saved.satisfiable(), saved.tautology())
+    saved.close()
+
+@cli.command()
+@click.argument("table_file", type=click.Path(exists=True, dir_okay=False))
+@click.argument("assignment", required=False)
+def lookup(table_file, assignment):
+    """Reads a table saved by table --save. Prints the value of a row given like " A ~B  C",
+    or without one, how many rows are true."""
+    try:
+        saved = truthtable.TruthTable.load(table_file)
+    except IOError as e:
+        print("Error: %s" % e)
+        return
+    try:
+        if assignment is None:
+            print("Atoms:\t%s" % " ".join(saved.atoms))
+            print("True rows:\t%d of %d" % (saved.count(), len(saved)))
+            return
+        model = dict((literal.lstrip("~"), not literal.startswith("~")) for literal in assignment.split())
+        missing = [atom for atom in saved.atoms if atom not in model]
+        if missing:
+            print("Error: no value for %s" % ", ".join(missing))
+            return
+        print(saved.value(model))
+    finally:
+        saved.close()
 
 @cli.command()
-@click.argument("expression")
-def dnf(expression):
+@click.argument("expression", callback=_read_expression)
+@click.option("--minimize", is_flag=True, default=False, help="Find a small DNF instead of one term per true row.")
+@click.option("--jobs", type=click.IntRange(1), default=1, help="Worker processes for large truth tables.")
+def dnf(expression, minimize, jobs):
     """Converts an expression to disjunctive normal form."""
-    print(normal_forms.to_dnf(expression))
+    print(normal_forms.to_dnf(expression, minimize, jobs))
 
 @cli.command()
-@click.argument("expression")
-def cnf(expression):
+@click.argument("expression", callback=_read_expression)
+@click.option("--equisatisfiable", is_flag=True, default=False, help="Output a linear-size equisatisfiable CNF with auxiliary atoms.")
+@click.option("--minimize", is_flag=True, default=False, help="Find a small CNF instead of one clause per false row.")
+@click.option("--jobs", type=click.IntRange(1), default=1, help="Worker processes for large truth tables.")
+@click.option("--dimacs", is_flag=True, default=False, help="Output the clauses in DIMACS format, for SAT solvers.")
+def cnf(expression, equisatisfiable, minimize, jobs, dimacs):
     """Converts an expression to conjunctive normal form."""
-    print(normal_forms.to_cnf(expression))
+    if dimacs:
+        carroll_dimacs.write(carroll_dimacs.from_expression(expression, minimize, equisatisfiable, jobs), sys.stdout)
+    elif equisatisfiable:
+        print(normal_forms.to_equisatisfiable_cnf(expression))
+    else:
+        print(normal_forms.to_cnf(expression, minimize, jobs))
 
-@cli.command()
-def proof():
-    """Checks a proof for validity."""
-    exp = raw_input()
-    expressions = []
+def _check_proof(engine, jobs):
+    read = lambda: _expand(raw_input())
+    exp = read()
+    if not exp:
+        raise IOError("The proof is empty: it needs at least a conclusion.")
+    if engine not in proofs.ProofChecker.ENGINES:
+        expressions = []
+        while exp:
+            expressions.append(exp)
+            exp = read()
+        return proofs.valid_proof(expressions, engine, jobs)
+    checker = proofs.ProofChecker(engine, jobs)
+    # Each line is a premise unless it's the last, so it's only added once the next arrives.
+    last = None
     while exp:
-        expressions.append(exp)
-        exp = raw_input()
-    if proofs.valid_proof(expressions):
+        if last is not None:
+            checker.premise(last)
+        if checker.consistent and not checker.consistent_with(exp):
+            print("Inconsistent: no assignment satisfies every line so far.")
+        last = exp
+        exp = read()
+    return checker.entails(last)
+
+@cli.command()
+@click.option("--engine", type=click.Choice(truthtable.ENGINES), default="table", help="How to check validity.")
+@click.option("--jobs", type=click.IntRange(1), default=1, help="Worker processes for large truth tables.")
+def proof(engine, jobs):
+    """Checks a proof for validity.
+
+    With the table or bdd engine, each line is checked as it's entered, and a line that
+    contradicts the ones before it is reported straight away. A line may be @FILE, as for
+    other commands, to read a long premise from a file."""
+    try:
+        valid = _check_proof(engine, jobs)
+    except IOError as e:
+        print("Error: %s" % e)
+        return
+    if valid:
         print("Valid")
     else:
         print("Invalid")
 
+@cli.command()
+@click.argument("jobs_file", type=click.File("r"), default="-")
+@click.option("--jobs", type=click.IntRange(1), default=1, help="Worker processes to spread the jobs over.")
+def batch(jobs_file, jobs):
+    """Runs one job per line of a file (or stdin), printing one JSON result per line."""
+    carroll_batch.run(jobs_file, sys.stdout, jobs)
+
+@cli.command()
+@click.argument("expressions_file", type=click.File("r"), default="-")
+@click.option("--engine", type=click.Choice(truthtable.ENGINES), default="table", help="How to confirm equivalences the fingerprints can't settle.")
+@click.option("--jobs", type=click.IntRange(1), default=1, help="Worker processes for large truth tables.")
+@click.option("--implications", is_flag=True, default=False, help="Also print which classes imply which.")
+@click.option("--compatibility", is_flag=True, default=False, help="Also print which classes are satisfiable together.")
+def classify(expressions_file, engine, jobs, implications, compatibility):
+    """Sorts the expressions in a file (or stdin), one per line, into equivalence classes."""
+    numbers, trees = [], []
+    for number, line in enumerate(expressions_file, 1):
+        if line.strip():
+            try:
+                trees.append(parsing.parse(line.strip()))
+            except IOError as e:
+                print("Parse error on line %d: %s" % (number, e))
+                return
+            numbers.append(number)
+    if not trees:
+        return
+    found = carroll_classify.Classification(trees, engine, jobs)
+    for c, members in enumerate(found.classes, 1):
+        print("Class %d:\tlines %s" % (c, ", ".join(str(numbers[i]) for i in members)))
+    headings = [str(c) for c in range(1, len(found) + 1)]
+    for wanted, title, matrix in [(implications, "Implies (row implies column):", found.implication_matrix),
+                                  (compatibility, "Satisfiable together:", found.compatibility_matrix)]:
+        if wanted:
+            print(title)
+            print("\t" + "\t".join(headings))
+            for heading, row in zip(headings, matrix()):
+                print(heading + "\t" + "\t".join("1" if answer else "0" for answer in row))
+
+@cli.command()
+@click.option("--family", "families", multiple=True, type=click.Choice(sorted(carroll_bench.FAMILIES)), help="Formula family to benchmark (repeatable; default all).")
+@click.option("--size", "sizes", multiple=True, type=int, help="Size to generate (repeatable; default depends on the family).")
+@click.option("--repeat", type=click.IntRange(1), default=3, help="Runs per stage; the best time is kept.")
+@click.option("--output", type=click.File("w"), default="-", help="File for the JSON results.")
+def bench(families, sizes, repeat, output):
+    """Times parsing, evaluation, tables, normal forms and proofs on generated formulas."""
+    carroll_bench.write(carroll_bench.run(families, sizes, repeat), output)
+
+@cli.command()
+@click.argument("expression", callback=_read_expression)
+def count(expression):
+    """Counts the assignments satisfying an expression, without enumerating its truth table."""
+    try:
+        tree = parsing.parse(expression)
+    except IOError as e:
+        print("Parse error: %s" % e)
+        return
+    print("Models:\t%d of %d" % (carroll_count.count_models(tree), 1 << len(tree.atoms())))
+    print("Probability:\t%r" % carroll_count.probability(tree))
+
+@cli.command()
+@click.argument("expression", callback=_read_expression)
+@click.option("--cubes", is_flag=True, default=False, help="Print cubes, where atoms marked - may be true or false, instead of single assignments.")
+@click.option("--limit", type=click.IntRange(1), help="Stop after this many.")
+def models(expression, cubes, limit):
+    """Prints the assignments satisfying an expression, skipping the regions of its truth table
+    that can't, so it works for expressions with many atoms and few models."""
+    try:
+        tree = parsing.parse(expression)
+    except IOError as e:
+        print("Parse error: %s" % e)
+        return
+    atoms = sorted(tree.atoms())
+    found = (carroll_models.cubes if cubes else carroll_models.models)(tree, atoms)
+    prefix = {True: " ", False: "~", None: "-"}
+    for model in itertools.islice(found, limit):
+        print("".join([prefix[model.get(atom)] + atom + " " for atom in atoms]))
+
+@cli.command()
+@click.argument("expression", callback=_read_expression)
+def simplify(expression):
+    """Prints a simpler equivalent of an expression."""
+    try:
+        print(carroll_simplify.simplify_expression(expression))
+    except IOError as e:
+        print("Parse error: %s" % e)
+
+@cli.command()
+@click.option("--address", default=carroll_server.DEFAULT_ADDRESS, help="host:port to listen on, or a path for a Unix socket.")
+@click.option("--jobs", type=click.IntRange(1), default=1, help="Worker processes to run jobs in.")
+def serve(address, jobs):
+    """Answers batch jobs sent over a socket (see client.py) until interrupted."""
+    carroll_server.serve(address, jobs)
+
 if __name__ == "__main__":
     cli()
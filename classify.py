@@ -0,0 +1,133 @@
+"""Sorting many expressions into equivalence classes, without comparing every pair.
+
+Each expression gets a signature: its truth table over the atoms of all of them, when there are
+few enough atoms, or else its values on SIM_ROWS random rows. Equivalent expressions have the
+same signature, so only expressions with the same signature need comparing, and a whole table
+needs no comparing at all. Signatures also answer most implication and mutual satisfiability
+questions between classes: a random row where one class is true and another false rules out the
+implication, and one where both are true shows they can be satisfied together."""
+import random
+import codegen
+import parsing
+import truthtable
+from nodes import AndNode, IfNode
+from nose.tools import assert_equal
+
+# Signatures are whole truth tables up to this many atoms (8KB each), and random rows beyond.
+TABLE_ATOMS = 16
+# More random rows than equivalence checks use, since every class shares the same ones.
+SIM_ROWS = 256
+
+def signatures(trees, atoms):
+    """Returns a signature (an int, one bit per row) for each parse tree over the atoms, and
+    whether they're exact: whole truth tables rather than random rows."""
+    if len(atoms) <= TABLE_ATOMS:
+        return [truthtable.table_bits(tree, atoms) for tree in trees], True
+    rng = random.Random(truthtable.SIM_SEED)
+    masks = [rng.getrandbits(SIM_ROWS) for atom in atoms]
+    full = (1 << SIM_ROWS) - 1
+    return [codegen.compile_bits(tree, atoms)(masks, full) for tree in trees], False
+
+class Classification(object):
+    """Parse trees sorted into equivalence classes: lists of their indices, in order of first member.
+
+    Expressions are compared over all the trees' atoms, as truthtable.equivalent compares two."""
+
+    def __init__(self, trees, engine="table", jobs=1):
+        self.trees = trees
+        self.engine = engine
+        self.jobs = jobs
+        self.atoms = sorted(set().union(*[tree.atoms() for tree in trees]))
+        self.signatures, self.exact = signatures(trees, self.atoms)
+        self.classes = []
+        buckets = {}
+        for i, tree in enumerate(trees):
+            candidates = buckets.setdefault(self.signatures[i], [])
+            for members in candidates:
+                if self.exact or truthtable.equivalent(trees[members[0]], tree, engine, jobs):
+                    members.append(i)
+                    break
+            else:
+                candidates.append([i])
+                self.classes.append(candidates[-1])
+
+    def __len__(self):
+        return len(self.classes)
+
+    def _class(self, c):
+        first = self.classes[c][0]
+        return self.trees[first], self.signatures[first]
+
+    def implies(self, c1, c2):
+        """Checks whether the expressions of class c1 imply those of class c2."""
+        tree1, bits1 = self._class(c1)
+        tree2, bits2 = self._class(c2)
+        if self.exact or bits1 & ~bits2:
+            return not bits1 & ~bits2
+        return truthtable.tautology(IfNode(tree1, tree2), self.engine, self.jobs)
+
+    def compatible(self, c1, c2):
+        """Checks whether the expressions of classes c1 and c2 are satisfiable together."""
+        tree1, bits1 = self._class(c1)
+        tree2, bits2 = self._class(c2)
+        if self.exact or bits1 & bits2:
+            return bool(bits1 & bits2)
+        return truthtable.satisfiable(AndNode(tree1, tree2), self.engine, self.jobs)
+
+    def implication_matrix(self):
+        """Rows of whether each class implies each class."""
+        bits = [self.signatures[members[0]] for members in self.classes]
+        rows = [[not bits1 & ~bits2 for bits2 in bits] for bits1 in bits]
+        return self._confirm(rows, True, self.implies)
+
+    def compatibility_matrix(self):
+        """Rows of whether each class is satisfiable together with each class."""
+        bits = [self.signatures[members[0]] for members in self.classes]
+        rows = [[bool(bits1 & bits2) for bits2 in bits] for bits1 in bits]
+        return self._confirm(rows, False, self.compatible)
+
+    def _confirm(self, rows, unsure, check):
+        # Random rows leave answers of `unsure` unconfirmed; whole tables leave nothing to check.
+        if not self.exact:
+            for c1, row in enumerate(rows):
+                for c2, answer in enumerate(row):
+                    if answer == unsure:
+                        row[c2] = check(c1, c2)
+        return rows
+
+def classify(expressions, engine="table", jobs=1):
+    """Sorts proposition strings (or parse trees) into equivalence classes."""
+    return Classification([parsing.parse(exp) for exp in expressions], engine, jobs)
+
+# Tests
+
+EXPRESSIONS = ["(A&B)", "(B^A)", "(AvB)", "~(~A&~B)", "(A>B)", "(~AvB)", "(A&~A)", "C", "(B&A&(Cv~C))"]
+
+def test_classify():
+    for engine in truthtable.ENGINES:
+        assert_equal(classify(EXPRESSIONS, engine).classes, [[0, 1, 8], [2, 3], [4, 5], [6], [7]])
+
+def test_matrices():
+    found = classify(EXPRESSIONS)
+    assert_equal(found.implication_matrix()[0], [True, True, True, False, False])
+    assert_equal([row[3] for row in found.implication_matrix()], [False, False, False, True, False])
+    assert_equal(found.compatibility_matrix()[3], [False] * 5)
+    assert found.compatible(0, 4) and not found.implies(4, 0)
+
+def test_simulated_signatures():
+    # Too many atoms for whole tables: signatures are random rows, and buckets are checked.
+    wide = " & ".join("X%d" % i for i in range(20))
+    expressions = ["(%s & A)" % wide, "(A & %s)" % wide, "(%s & ~A)" % wide, "((%s) v A)" % wide]
+    for engine in ["sat", "bdd"]:
+        found = classify(expressions, engine)
+        assert not found.exact
+        assert_equal(found.classes, [[0, 1], [2], [3]])
+        assert_equal(found.implication_matrix(), [[True, False, True], [False, True, True], [False, False, True]])
+        assert_equal(found.compatibility_matrix()[0], [True, False, True])
+
+def test_many():
+    expressions = ["(X%d %s X%d)" % (i % 10, op, (i * 7) % 10) for i in range(500) for op in "&v>"]
+    found = classify(expressions)
+    assert len(found) < 100
+    for members in found.classes[:10]:
+        assert all(truthtable.equivalent(expressions[members[0]], expressions[i]) for i in members)
@@ -0,0 +1,64 @@
+"""A thin client for server.py: sends jobs, prints results.
+
+It imports only the standard library (no click, no nose, none of carroll), so a query costs
+little more than starting the interpreter. Run it as
+
+    python client.py [--address ADDRESS] OP ARG...
+
+to send one job, or with no OP to send every line of stdin as a job. Its tests are in server.py."""
+from __future__ import print_function
+import sys
+import socket
+import threading
+
+DEFAULT_ADDRESS = "127.0.0.1:1865"
+
+def parse_address(address):
+    """Returns the socket family and address for "host:port" or a Unix socket path."""
+    if "/" in address or ":" not in address:
+        return socket.AF_UNIX, address
+    host, port = address.rsplit(":", 1)
+    return socket.AF_INET, (host, int(port))
+
+def connect(address=DEFAULT_ADDRESS):
+    family, target = parse_address(address)
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.connect(target)
+    if family == socket.AF_INET:
+        # Jobs are small writes waiting on a reply, which Nagle's algorithm would delay.
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+def query(address, lines):
+    """Sends jobs (lines without newlines) to a server and returns its result lines. Blank lines are skipped."""
+    lines = [line for line in lines if line.strip()]
+    sock = connect(address)
+    def send():
+        sock.sendall("".join(line + "\n" for line in lines))
+        sock.shutdown(socket.SHUT_WR)
+    # Replies are read while jobs are still being sent: otherwise, once the replies fill the
+    # socket's buffers, the server waits for us to read and we wait for it to read.
+    writer = threading.Thread(target=send)
+    writer.daemon = True
+    writer.start()
+    try:
+        replies = sock.makefile("r")
+        results = [replies.readline().rstrip("\n") for line in lines]
+        writer.join()
+        return results
+    finally:
+        sock.close()
+
+def main(argv):
+    address = DEFAULT_ADDRESS
+    if argv[:1] == ["--address"]:
+        address, argv = argv[1], argv[2:]
+    if argv:
+        lines = ["\t".join(argv)]
+    else:
+        lines = [line.rstrip("\r\n") for line in sys.stdin]
+    for result in query(address, lines):
+        print(result)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,182 @@
+"""Compiles parse trees into native Python functions.
+
+Walking a tree of Nodes costs a method call per node and a model-dict lookup per atom.
+The functions generated here evaluate the same expression as straight Python code, and
+are cached per tree so a tree is only ever compiled once for each atom order."""
+import weakref
+import stats
+from nodes import LogicError, AtomNode, NotNode, AndNode, OrNode, XorNode, IfNode, IffNode, postorder
+from parsing import parse
+from nose.tools import assert_equal, assert_raises
+
+# Bool expressions nested deeper than this are hoisted into local variables, since
+# Python's own parser can't handle arbitrarily nested expressions.
+MAX_NESTING = 40
+
+_cache = weakref.WeakKeyDictionary()
+
+def _xor(values):
+    return any(values) and not all(values)
+
+def _iff(values):
+    return not any(values) or all(values)
+
+def _check_arity(node):
+    if isinstance(node, NotNode) and len(node.children) != 1:
+        raise LogicError("NOT is undefined for multiple children.")
+    if isinstance(node, IfNode) and len(node.children) != 2:
+        raise LogicError("IF is only defined for exactly two children.")
+
+def _bool_expression(node, args):
+    """Python source for a node in terms of its children's source, using short-circuit and/or."""
+    if isinstance(node, AndNode):
+        return "(%s)" % " and ".join(args)
+    if isinstance(node, OrNode):
+        return "(%s)" % " or ".join(args)
+    if isinstance(node, NotNode):
+        return "(not %s)" % args[0]
+    if isinstance(node, IfNode):
+        return "(not %s or %s)" % tuple(args)
+    if isinstance(node, XorNode):
+        if len(args) == 2:
+            return "((not %s) != (not %s))" % tuple(args)
+        return "_xor((%s,))" % ", ".join(args)
+    if isinstance(node, IffNode):
+        if len(args) == 2:
+            return "((not %s) == (not %s))" % tuple(args)
+        return "_iff((%s,))" % ", ".join(args)
+    raise LogicError("Can't compile %s" % type(node))
+
+def _bits_expression(node, args):
+    """Python source for a node in terms of its children's bitsets."""
+    if isinstance(node, AndNode):
+        return " & ".join(args)
+    if isinstance(node, OrNode):
+        return " | ".join(args)
+    if isinstance(node, NotNode):
+        return "full ^ %s" % args[0]
+    if isinstance(node, IfNode):
+        return "(full ^ %s) | %s" % tuple(args)
+    if isinstance(node, XorNode):
+        return "(%s) & ~(%s)" % (" | ".join(args), " & ".join(args))
+    if isinstance(node, IffNode):
+        return "(full ^ (%s)) | (%s)" % (" | ".join(args), " & ".join(args))
+    raise LogicError("Can't compile %s" % type(node))
+
+def _parent_counts(tree):
+    """Counts how many times each node (by id) is used as a child."""
+    counts = {}
+    for node in postorder(tree):
+        if not isinstance(node, AtomNode):
+            for child in node.children:
+                counts[id(child)] = counts.get(id(child), 0) + 1
+    return counts
+
+def _bool_source(tree, atoms):
+    positions = dict((atom, k) for k, atom in enumerate(atoms))
+    counts = _parent_counts(tree)
+    lines = ["def evaluate(*a):"]
+    exprs = {}
+    for node in postorder(tree):
+        if isinstance(node, AtomNode):
+            exprs[id(node)] = ("a[%d]" % positions[node.l], 0)
+            continue
+        _check_arity(node)
+        children = [exprs[id(child)] for child in node.children]
+        expr = _bool_expression(node, [source for source, depth in children])
+        depth = 1 + max(depth for source, depth in children)
+        # Shared subexpressions are evaluated once; deep ones are split up.
+        if depth > MAX_NESTING or counts.get(id(node), 0) > 1:
+            name = "t%d" % len(lines)
+            lines.append("    %s = %s" % (name, expr))
+            expr, depth = name, 0
+        exprs[id(node)] = (expr, depth)
+    lines.append("    return bool(%s)" % exprs[id(tree)][0])
+    return "\n".join(lines)
+
+def _bits_source(tree, atoms):
+    positions = dict((atom, k) for k, atom in enumerate(atoms))
+    lines = ["def evaluate(m, full):"]
+    names = {}
+    for node in postorder(tree):
+        if isinstance(node, AtomNode):
+            names[id(node)] = "m[%d]" % positions[node.l]
+            continue
+        _check_arity(node)
+        name = "t%d" % len(lines)
+        lines.append("    %s = %s" % (name, _bits_expression(node, [names[id(child)] for child in node.children])))
+        names[id(node)] = name
+    lines.append("    return %s" % names[id(tree)])
+    return "\n".join(lines)
+
+def _compile(tree, atoms, kind):
+    compiled = _cache.setdefault(tree, {})
+    key = (kind, tuple(atoms))
+    if stats.enabled:
+        stats.count("compile_cache_hits" if key in compiled else "compile_cache_misses")
+    if key not in compiled:
+        with stats.phase("compile"):
+            if kind == "bool":
+                source = _bool_source(tree, atoms)
+            else:
+                source = _bits_source(tree, atoms)
+            namespace = {"_xor": _xor, "_iff": _iff}
+            exec(compile(source, "<carroll %s evaluator>" % kind, "exec"), namespace)
+            compiled[key] = namespace["evaluate"]
+    return compiled[key]
+
+def compile_tree(tree, atoms):
+    """Compiles a parse tree into a function taking one positional bool per atom (in the given order)."""
+    return _compile(tree, atoms, "bool")
+
+def compile_bits(tree, atoms):
+    """Compiles a parse tree into a bit-parallel function of (masks, full).
+
+    Masks holds one bitset per atom (in the given order), full has a bit set for every row."""
+    return _compile(tree, atoms, "bits")
+
+# Tests
+
+def test_compile_tree():
+    f = compile_tree(parse("((A&B)>~C)"), ["A", "B", "C"])
+    assert f(True, True, False)
+    assert not f(True, True, True)
+    assert f(False, True, True)
+
+def test_compile_xor_iff():
+    for exp in ["(AxB)", "(AxBxC)", "(A=B)", "(A=B=C)"]:
+        tree = parse(exp)
+        f = compile_tree(tree, ["A", "B", "C"])
+        for i in range(8):
+            model = {"A": not i & 1, "B": not i & 2, "C": not i & 4}
+            assert_equal(f(model["A"], model["B"], model["C"]), tree.eval(model))
+
+def test_compile_bits():
+    # Rows: A is true in rows 0 and 2, B is true in rows 0 and 1.
+    masks, full = [0b0101, 0b0011], 0b1111
+    a, b = AtomNode("A"), AtomNode("B")
+    expected = {AndNode(a, b): 0b0001, OrNode(a, b): 0b0111, NotNode(a): 0b1010,
+                IfNode(a, b): 0b1011, XorNode(a, b): 0b0110, IffNode(a, b): 0b1001}
+    for tree, bits in expected.items():
+        assert_equal(compile_bits(tree, ["A", "B"])(masks, full), bits)
+    tree = parse("((AxBxC)=(A>B)=(A&~C))")
+    masks, full = [0b01010101, 0b00110011, 0b00001111], 0b11111111
+    bits = compile_bits(tree, ["A", "B", "C"])(masks, full)
+    for i in range(8):
+        model = dict((atom, bool(mask >> i & 1)) for atom, mask in zip("ABC", masks))
+        assert_equal(bool(bits >> i & 1), tree.eval(model))
+
+def test_compile_cached():
+    tree = parse("(A&B)")
+    assert compile_tree(tree, ["A", "B"]) is compile_tree(tree, ["A", "B"])
+    assert compile_tree(tree, ["A", "B"]) is not compile_tree(tree, ["B", "A"])
+
+def test_compile_deep():
+    tree = AtomNode("A")
+    for i in range(3000):
+        tree = NotNode(tree)
+    assert not compile_tree(tree, ["A"])(False)
+    assert_equal(compile_bits(tree, ["A"])([0b01], 0b11), 0b01)
+
+def test_compile_invalid():
+    assert_raises(LogicError, compile_tree, NotNode(AtomNode("A"), AtomNode("B")), ["A", "B"])
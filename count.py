@@ -0,0 +1,202 @@
+"""Exact model counting (#SAT) on parse trees, without enumerating truth table rows.
+
+A DPLL-style counter: it conditions the tree on an atom's two values and counts both halves,
+splitting ANDs and ORs whose operands share no atoms into independent parts along the way.
+Nodes are hash-consed, so a subformula met again in another branch is a cache hit."""
+from __future__ import division
+import stats
+import parsing
+import truthtable
+from simplify import fold, condition
+from nodes import AtomNode, NotNode, AndNode, OrNode, XorNode, IffNode
+from nose.tools import assert_equal, assert_raises
+
+def _atoms(f):
+    return frozenset() if f is True or f is False else f.atoms()
+
+def _components(children):
+    """Groups children so that no two groups share an atom (merging atoms' groups by union-find)."""
+    parent = {}
+    def root(atom):
+        while parent[atom] != atom:
+            parent[atom] = parent[parent[atom]]
+            atom = parent[atom]
+        return atom
+    for child in children:
+        atoms = iter(child.atoms())
+        first = next(atoms)
+        parent.setdefault(first, first)
+        for atom in atoms:
+            parent.setdefault(atom, atom)
+            parent[root(atom)] = root(first)
+    groups, order = {}, []
+    for child in children:
+        key = root(next(iter(child.atoms())))
+        if key not in groups:
+            groups[key] = []
+            order.append(key)
+        groups[key].append(child)
+    return [groups[key] for key in order]
+
+def _literal(node):
+    """Returns (atom, value) if the node is an atom or a negated atom, else None."""
+    if isinstance(node, AtomNode):
+        return node.l, True
+    if isinstance(node, NotNode) and isinstance(node.l, AtomNode):
+        return node.l.l, False
+    return None
+
+def _branch_atom(f):
+    """The atom appearing in the most distinct subformulas."""
+    uses = {}
+    stack, seen = [f], set()
+    while stack:
+        node = stack.pop()
+        if id(node) in seen or isinstance(node, AtomNode):
+            continue
+        seen.add(id(node))
+        for child in node.children:
+            if isinstance(child, AtomNode):
+                uses[child.l] = uses.get(child.l, 0) + 1
+            else:
+                stack.append(child)
+    return max(sorted(uses), key=lambda atom: uses[atom])
+
+class Counter(object):
+    """Counts models of formulas, remembering the count of every subformula it meets.
+
+    Iterative, with an explicit stack of the subformulas still to count, so that the depth of
+    the search (up to an atom per level) isn't limited by Python's recursion limit."""
+
+    def __init__(self):
+        self.cache = {}
+
+    def _known(self, f):
+        if f is True or isinstance(f, AtomNode):
+            return 1
+        if f is False:
+            return 0
+        return self.cache.get(f)
+
+    def count(self, f):
+        """Counts the assignments to f's own atoms that satisfy f (a Node, True or False)."""
+        plans = {}
+        stack = [f]
+        while stack:
+            g = stack[-1]
+            if self._known(g) is not None:
+                stack.pop()
+                continue
+            if g not in plans:
+                plans[g] = self._plan(g)
+                if stats.enabled:
+                    stats.count("count_cache_hits", sum(1 for sub in plans[g][0] if sub in self.cache))
+            subs, combine = plans[g]
+            pending = [sub for sub in subs if self._known(sub) is None]
+            if pending:
+                stack.extend(pending)
+                continue
+            self.cache[g] = combine([self._known(sub) for sub in subs])
+            del plans[g]
+            stack.pop()
+        return self._known(f)
+
+    def _plan(self, f):
+        """Returns the subformulas f's count is made from, and a function making it from theirs."""
+        num_atoms = len(f.atoms())
+        everything = 1 << num_atoms
+        if isinstance(f, NotNode):
+            return [f.l], lambda counts: everything - counts[0]
+        parts = _components(f.children)
+        if len(parts) > 1 and isinstance(f, (AndNode, OrNode)):
+            parts = [fold(type(f), part) for part in parts]
+        elif len(parts) > 1 and len(parts) == len(f.children):
+            parts = list(f.children)
+        else:
+            parts = None
+        if parts:
+            # Independent parts: count where all of them are true, and where all are false.
+            def combine(counts):
+                trues, falses = 1, 1
+                for part, models in zip(parts, counts):
+                    trues *= models
+                    falses *= (1 << len(part.atoms())) - models
+                if isinstance(f, AndNode):
+                    return trues
+                if isinstance(f, OrNode):
+                    return everything - falses
+                if isinstance(f, XorNode):
+                    return everything - trues - falses
+                if isinstance(f, IffNode):
+                    return trues + falses
+                # IF is false only where its first part is true and its second false.
+                return everything - counts[0] * ((1 << len(parts[1].atoms())) - counts[1])
+            return parts, combine
+        if isinstance(f, AndNode):
+            units = {}
+            for child in f.children:
+                literal = _literal(child)
+                if literal is not None:
+                    atom, value = literal
+                    if units.get(atom, value) != value:
+                        return [], lambda counts: 0
+                    units[atom] = value
+            if units:
+                return self._extended([condition(f, units)], num_atoms - len(units))
+        if stats.enabled:
+            stats.count("count_decisions")
+        atom = _branch_atom(f)
+        return self._extended([condition(f, {atom: value}) for value in (True, False)], num_atoms - 1)
+
+    def _extended(self, subs, num_atoms):
+        """A plan summing the subformulas' counts, each extended to num_atoms atoms (a superset of its own)."""
+        return subs, lambda counts: sum(models << (num_atoms - len(_atoms(sub))) for sub, models in zip(subs, counts))
+
+def count_models(tree, atoms=None):
+    """Counts the assignments to the atoms (default: the tree's own) that satisfy a parse tree."""
+    if atoms is None:
+        atoms = tree.atoms()
+    extra = set(atoms) - tree.atoms()
+    if tree.atoms() - set(atoms):
+        raise ValueError("Atoms must include all of the tree's atoms.")
+    return Counter().count(tree) << len(extra)
+
+def probability(tree):
+    """The chance that the tree is true under a uniformly random assignment to its atoms."""
+    return count_models(tree) / (1 << len(tree.atoms()))
+
+# Tests
+
+def _table_count(exp):
+    tree = parsing.parse(exp)
+    atoms = sorted(tree.atoms())
+    return bin(truthtable.table_bits(tree, atoms)).count("1")
+
+def test_count_matches_table():
+    import bench
+    expressions = ["(A&B)", "(AvB)", "(AxBxC)", "(A=B=C)", "(A>B)", "(A&~A)", "((A&B)v(C&D)v(A&C))",
+                   "((AvB)&(CvD)&(~Av~C))", bench.parity(7), bench.pigeonhole(2), bench.deep(40, 5)]
+    expressions += [bench.random_kcnf(10, ratio=ratio, seed=seed) for ratio in (2, 4) for seed in range(3)]
+    for exp in expressions:
+        assert_equal(count_models(parsing.parse(exp)), _table_count(exp))
+
+def test_count_large():
+    import bench
+    pairs = "(" + "&".join("(A%dvB%d)" % (i, i) for i in range(100)) + ")"
+    assert_equal(count_models(parsing.parse(pairs)), 3 ** 100)
+    chain = "(" + "&".join("(X%d>X%d)" % (i, i + 1) for i in range(80)) + ")"
+    assert_equal(count_models(parsing.parse(chain)), 82)
+    assert_equal(count_models(parsing.parse(bench.wide_or(300))), (1 << 300) - 1)
+    assert_equal(probability(parsing.parse(bench.parity(120))), 0.5)
+
+def test_count_deep():
+    import bench
+    # Over a thousand decision levels and nested NOTs: more than Python's recursion limit.
+    chain = "(" + "&".join("(X%d>X%d)" % (i, i + 1) for i in range(1001)) + ")"
+    assert_equal(count_models(parsing.parse(chain)), 1003)
+    assert_equal(count_models(parsing.parse(bench.parity(1500))), 1 << 1499)
+    assert_equal(count_models(parsing.parse("~" * 3000 + "A")), 1)
+
+def test_count_over_atoms():
+    assert_equal(count_models(parsing.parse("(A&B)"), ["A", "B", "C"]), 2)
+    assert_raises(ValueError, count_models, parsing.parse("(A&B)"), ["A"])
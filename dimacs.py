@@ -0,0 +1,204 @@
+"""Reading and writing CNFs in DIMACS format, as used by SAT solvers and their benchmarks.
+
+A file is a "p cnf VARIABLES CLAUSES" header and then clauses of nonzero ints (a negative one
+is a negated variable), each ended by a 0; lines starting with c are comments. Carroll writes
+a comment "c atom N NAME" for each variable standing for an atom, and reads them back."""
+from __future__ import print_function
+import array
+import parsing
+import truthtable
+import normal_forms
+import minimize
+from nodes import AtomNode, NotNode, AndNode, OrNode
+from StringIO import StringIO
+from nose.tools import assert_equal, assert_raises
+
+# Variables without a name from an "atom" comment are named X1, X2, ... (as in bench).
+NAME_PREFIX = "X"
+
+class CNF(object):
+    """Clauses held as one flat array of literals, each clause followed by a 0 as in DIMACS,
+    so that hundreds of thousands of them take a few bytes per literal and no object each."""
+
+    def __init__(self, num_vars=0, names=None):
+        self.num_vars = num_vars
+        self.names = dict(names or {})
+        self.literals = array.array("i")
+        self.num_clauses = 0
+
+    def add(self, clause):
+        self.literals.extend(clause)
+        self.literals.append(0)
+        self.num_vars = max([self.num_vars] + [abs(literal) for literal in clause])
+        self.num_clauses += 1
+
+    def __len__(self):
+        return self.num_clauses
+
+    def __iter__(self):
+        """Yields each clause as a list of literals."""
+        clause = []
+        for literal in self.literals:
+            if literal:
+                clause.append(literal)
+            else:
+                yield clause
+                clause = []
+
+def read(stream):
+    """Reads a DIMACS CNF from a file (or any iterable of lines), line by line."""
+    cnf = CNF()
+    literals = cnf.literals
+    header = None
+    for number, line in enumerate(stream, 1):
+        fields = line.split()
+        if not fields:
+            continue
+        if fields[0] == "c":
+            if len(fields) == 4 and fields[1] == "atom" and fields[2].isdigit() and parsing.is_atom(fields[3]):
+                cnf.names[int(fields[2])] = fields[3]
+            continue
+        if fields[0] == "p":
+            if header is not None or len(fields) != 4 or fields[1] != "cnf":
+                raise IOError("Line %d: expected one header like p cnf 3 2." % number)
+            try:
+                header = int(fields[2]), int(fields[3])
+            except ValueError:
+                raise IOError("Line %d: expected one header like p cnf 3 2." % number)
+            continue
+        if fields[0] == "%":
+            # Some benchmark collections end their files with "%" and a stray "0".
+            break
+        if header is None:
+            raise IOError("Line %d: clauses before the p cnf header." % number)
+        try:
+            literals.extend(map(int, fields))
+        except ValueError:
+            raise IOError("Line %d: clauses must be whole numbers." % number)
+    if header is None:
+        raise IOError("No p cnf header.")
+    if literals and literals[-1] != 0:
+        literals.append(0)
+    cnf.num_clauses = literals.count(0)
+    cnf.num_vars = max([header[0], max(literals or [0]), -min(literals or [0])])
+    if cnf.num_clauses != header[1]:
+        raise IOError("The header promises %d clauses, but there are %d." % (header[1], cnf.num_clauses))
+    return cnf
+
+def write(cnf, stream):
+    """Writes a CNF in DIMACS format, with a comment naming each atom's variable."""
+    for var in sorted(cnf.names):
+        print("c atom %d %s" % (var, cnf.names[var]), file=stream)
+    print("p cnf %d %d" % (cnf.num_vars, cnf.num_clauses), file=stream)
+    lines = []
+    for clause in cnf:
+        lines.append(" ".join(map(str, clause + [0])))
+        if len(lines) == truthtable.BUFFER_ROWS:
+            stream.write("\n".join(lines) + "\n")
+            lines = []
+    if lines:
+        stream.write("\n".join(lines) + "\n")
+
+def to_tree(cnf):
+    """Builds the parse tree of a CNF directly, without writing and parsing an expression."""
+    atoms = {}
+    taken = set(cnf.names.values())
+    def atom(var):
+        if var not in atoms:
+            name = cnf.names.get(var)
+            if name is None:
+                name = "%s%d" % (NAME_PREFIX, var)
+                while name in taken:
+                    name += "_"
+            atoms[var] = AtomNode(name)
+        return atoms[var]
+    def literal(lit):
+        return atom(lit) if lit > 0 else NotNode(atom(-lit))
+    clauses = []
+    for clause in cnf:
+        literals = [literal(lit) for lit in clause]
+        if not literals:
+            # The empty clause: false.
+            first = atom(1)
+            literals = [AndNode(first, NotNode(first))]
+        clauses.append(literals[0] if len(literals) == 1 else OrNode(*literals))
+    if not clauses:
+        # No clauses: true.
+        first = atom(1)
+        return OrNode(first, NotNode(first))
+    return clauses[0] if len(clauses) == 1 else AndNode(*clauses)
+
+def from_expression(expression, minimal=False, equisatisfiable=False, jobs=1):
+    """Converts an expression to a CNF: the same clauses as normal_forms.to_cnf (or, with
+    equisatisfiable, to_equisatisfiable_cnf), numbering the atoms 1, 2, ... in sorted order."""
+    tree = parsing.parse(expression)
+    if equisatisfiable:
+        clauses, variables = normal_forms.tseitin(tree)
+        cnf = CNF(names=dict((var, atom) for atom, var in variables.items()))
+        for clause in clauses:
+            cnf.add(clause)
+        # Auxiliary variables are named as in to_equisatisfiable_cnf.
+        for var in xrange(len(variables) + 1, cnf.num_vars + 1):
+            cnf.names[var] = "%s%d" % (normal_forms.AUX_PREFIX, var - len(variables))
+        return cnf
+    atoms = sorted(tree.atoms())
+    cnf = CNF(len(atoms), dict((k + 1, atom) for k, atom in enumerate(atoms)))
+    # Each clause rules out some false rows: it's false exactly where its literals all are.
+    if minimal:
+        bits = truthtable.table_bits(tree, atoms, jobs) ^ ((1 << (1 << len(atoms))) - 1)
+        rows = [minimize.cube_literals(cube, atoms) for cube in minimize.minimize(bits, len(atoms))]
+    else:
+        rows = truthtable.models_from_chunks(truthtable.bit_chunks(tree, atoms, jobs), atoms, False)
+    for row in rows:
+        cnf.add([-(k + 1) if row[atom] else k + 1 for k, atom in enumerate(atoms) if atom in row])
+    return cnf
+
+# Tests
+
+EXAMPLE = """c An example
+c atom 2 B
+p cnf 3 3
+1 -2 0
+2 3
+ -1 0
+-3 0
+"""
+
+def test_read():
+    cnf = read(StringIO(EXAMPLE))
+    assert_equal((cnf.num_vars, len(cnf)), (3, 3))
+    assert_equal(list(cnf), [[1, -2], [2, 3, -1], [-3]])
+    assert_equal(to_tree(cnf), parsing.parse("((X1 v ~B) & (B v X3 v ~X1) & ~X3)"))
+    assert_equal(list(read(StringIO("p cnf 2 2\n1 2 0\n-1 0\n%\n0\n"))), [[1, 2], [-1]])
+    assert_equal(list(read(StringIO("p cnf 1 2\n0\n1"))), [[], [1]])
+
+def test_read_errors():
+    for text in ["1 2 0\n", "p cnf 2\n1 0\n", "p cnf 2 1\n1 a 0\n", "p cnf 2 2\n1 0\n", "c nothing\n"]:
+        assert_raises(IOError, read, StringIO(text))
+
+def test_write_round_trip():
+    cnf = read(StringIO(EXAMPLE))
+    out = StringIO()
+    write(cnf, out)
+    assert_equal(out.getvalue(), "c atom 2 B\np cnf 3 3\n1 -2 0\n2 3 -1 0\n-3 0\n")
+    assert_equal(list(read(StringIO(out.getvalue()))), list(cnf))
+
+def test_from_expression():
+    for exp in ["((A&B)v(CxD))", "(A>B)", "(Av~A)", "(A&~A)"]:
+        for minimal in [False, True]:
+            tree = to_tree(from_expression(exp, minimal))
+            assert truthtable.equivalent(exp, tree)
+    cnf = from_expression("(A&B)")
+    assert_equal((list(cnf), cnf.names), ([[1, -2], [-1, 2], [1, 2]], {1: "A", 2: "B"}))
+    cnf = from_expression("((AxB)&(B=C))", equisatisfiable=True)
+    assert_equal(len(cnf.names), cnf.num_vars)
+    assert all(atom in "ABC" or atom.startswith("_") for atom in to_tree(cnf).atoms())
+    assert truthtable.satisfiable(to_tree(cnf))
+    cnf = read(["c atom 1 X2", "p cnf 2 1", "1 2 0"])
+    assert_equal(to_tree(cnf), parsing.parse("(X2 v X2_)"))
+
+def test_large():
+    lines = ["p cnf 1000 200000"] + ["%d -%d 0" % (i % 1000 + 1, (i * 7) % 1000 + 1) for i in xrange(200000)]
+    cnf = read(lines)
+    assert_equal((cnf.num_vars, len(cnf)), (1000, 200000))
+    assert_equal(cnf.literals.itemsize * len(cnf.literals), 4 * 600000)
@@ -0,0 +1,157 @@
+"""Row-by-row truth tables in Gray-code order, re-evaluating only what each step changes.
+
+Consecutive rows in Gray-code order differ in exactly one atom. The Evaluator keeps every
+node's value (and, for n-ary nodes, how many children are true) and, when an atom flips,
+updates just the ancestors whose value actually changes. A row costs time proportional to
+the part of the tree above the flipped atom, and memory stays proportional to the tree,
+however many rows a chunk of the table has."""
+import heapq
+import truthtable
+import parsing
+from nodes import AtomNode, NotNode, AndNode, OrNode, XorNode, IfNode, IffNode, LogicError, postorder
+from nose.tools import assert_equal
+
+_KINDS = {AndNode: "and", OrNode: "or", XorNode: "xor", IffNode: "iff", NotNode: "not", IfNode: "if", AtomNode: "atom"}
+
+class Evaluator(object):
+    """Holds the value of every node of a tree under a current assignment, starting with every atom true."""
+
+    def __init__(self, tree, atoms):
+        nodes = list(postorder(tree))
+        index = dict((id(node), i) for i, node in enumerate(nodes))
+        self.kinds = [_KINDS[type(node)] for node in nodes]
+        self.children = [[] if isinstance(node, AtomNode) else [index[id(child)] for child in node.children]
+                         for node in nodes]
+        # One entry per occurrence, so a node used twice by the same parent counts twice.
+        self.parents = [[] for node in nodes]
+        for i, children in enumerate(self.children):
+            for child in children:
+                self.parents[child].append(i)
+        atom_nodes = dict((node.l, i) for i, node in enumerate(nodes) if isinstance(node, AtomNode))
+        self.atom_nodes = [atom_nodes.get(atom) for atom in atoms]
+        self.values = [False] * len(nodes)
+        self.trues = [0] * len(nodes)
+        self._queued = [False] * len(nodes)
+        for i, node in enumerate(nodes):
+            if isinstance(node, NotNode) and len(node.children) != 1:
+                raise LogicError("NOT is undefined for multiple children.")
+            if isinstance(node, IfNode) and len(node.children) != 2:
+                raise LogicError("IF is only defined for exactly two children.")
+            self.trues[i] = sum(1 for child in self.children[i] if self.values[child])
+            self.values[i] = True if isinstance(node, AtomNode) else self._compute(i)
+        self.heights = [0] * len(nodes)
+        for i, children in enumerate(self.children):
+            if children:
+                self.heights[i] = 1 + max(self.heights[child] for child in children)
+        self.root = len(nodes) - 1
+
+    def _compute(self, i):
+        kind, trues, size = self.kinds[i], self.trues[i], len(self.children[i])
+        if kind == "and":
+            return trues == size
+        if kind == "or":
+            return trues > 0
+        if kind == "not":
+            return trues == 0
+        if kind == "xor":
+            return 0 < trues < size
+        if kind == "iff":
+            return trues == 0 or trues == size
+        if kind == "if":
+            left, right = self.children[i]
+            return not self.values[left] or self.values[right]
+        return self.values[i]
+
+    @property
+    def value(self):
+        return self.values[self.root]
+
+    def flip(self, k):
+        """Negates the k-th atom and updates the nodes above it, lowest first, each at most once."""
+        node = self.atom_nodes[k]
+        if node is None:
+            return
+        values, queued = self.values, self._queued
+        values[node] = not values[node]
+        # Nodes waiting to be recomputed, by height. A node's children are all lower than it,
+        # so by the time a height is reached, every node at it has all its updates.
+        pending, heights = {}, []
+        self._notify(node, pending, heights)
+        while heights:
+            for i in pending.pop(heapq.heappop(heights)):
+                queued[i] = False
+                value = self._compute(i)
+                if value != values[i]:
+                    values[i] = value
+                    self._notify(i, pending, heights)
+
+    def _notify(self, child, pending, heights):
+        delta = 1 if self.values[child] else -1
+        for parent in self.parents[child]:
+            self.trues[parent] += delta
+            if not self._queued[parent]:
+                self._queued[parent] = True
+                height = self.heights[parent]
+                if height not in pending:
+                    pending[height] = []
+                    heapq.heappush(heights, height)
+                pending[height].append(parent)
+
+def gray_chunks(tree, atoms):
+    """Yields the same chunks as truthtable.bit_chunks, evaluating one row at a time in Gray-code order."""
+    evaluator = Evaluator(tree, atoms)
+    width = truthtable.chunk_width(atoms)
+    low = width.bit_length() - 1
+    state = 0
+    for chunk in xrange(1 << (len(atoms) - low)):
+        # Move the high atoms to this chunk's values (usually one or two flips).
+        changed = (state >> low) ^ chunk
+        while changed:
+            bit = changed & -changed
+            changed ^= bit
+            evaluator.flip(low + bit.bit_length() - 1)
+        state = (chunk << low) | (state & (width - 1))
+        rows = bytearray("0" * width)
+        for j in xrange(width):
+            if j:
+                # Step j of a Gray code flips the bit at j's lowest set bit.
+                k = (j & -j).bit_length() - 1
+                state ^= 1 << k
+                evaluator.flip(k)
+            if evaluator.values[evaluator.root]:
+                rows[state & (width - 1)] = "1"
+        yield int(str(rows)[::-1], 2)
+
+# Tests
+
+def test_evaluator_matches_eval():
+    tree = parsing.parse("((A&B)v~(A&B)v(CxDxA)v(A=B=C)v(D>A))")
+    atoms = ["A", "B", "C", "D"]
+    evaluator = Evaluator(tree, atoms)
+    model = dict((atom, True) for atom in atoms)
+    assert_equal(evaluator.value, tree.eval(model))
+    for k in [0, 2, 1, 3, 0, 0, 2, 3, 1]:
+        evaluator.flip(k)
+        model[atoms[k]] = not model[atoms[k]]
+        for i, node in enumerate(postorder(tree)):
+            assert_equal(evaluator.values[i], node.eval(model))
+
+def test_repeated_children():
+    a = parsing.parse("A")
+    tree = AndNode(a, a, NotNode(parsing.parse("B")))
+    assert_equal(list(gray_chunks(tree, ["A", "B"])), list(truthtable.bit_chunks(tree, ["A", "B"])))
+
+def test_gray_chunks_match():
+    for exp in ["((A&B)v(CxD)v~(E=F))", "(A>(B>(C>(D>E))))", "(A&~A)", "(AvBvC)"]:
+        tree = parsing.parse(exp)
+        atoms = sorted(tree.atoms())
+        assert_equal(list(gray_chunks(tree, atoms)), list(truthtable.bit_chunks(tree, atoms)))
+
+def test_gray_chunks_chunked():
+    saved, truthtable.CHUNK_ATOMS = truthtable.CHUNK_ATOMS, 2
+    try:
+        tree = parsing.parse("((A&B)x(C>D)x(EvA))")
+        atoms = ["A", "B", "C", "D", "E"]
+        assert_equal(list(gray_chunks(tree, atoms)), list(truthtable.bit_chunks(tree, atoms)))
+    finally:
+        truthtable.CHUNK_ATOMS = saved
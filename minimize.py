@@ -0,0 +1,253 @@
+"""Two-level logic minimisation.
+
+Finds small sum-of-products covers of a boolean function, given as a truth table bitset (see
+truthtable). Up to EXACT_ATOMS atoms this is Quine-McCluskey followed by Petrick's method;
+beyond that it's an Espresso-style expand/irredundant/reduce loop on bitsets.
+
+A cube is a pair of ints (value, care) over atom positions: bit k of care says whether the
+k-th atom appears in the cube, and bit k of value says whether it appears un-negated."""
+import truthtable
+import parsing
+from nose.tools import assert_equal, assert_items_equal
+
+EXACT_ATOMS = 10
+# Petrick's method gives up after this many partial covers, and falls back to a greedy choice.
+PETRICK_LIMIT = 2000
+# How many reduce/expand/irredundant rounds the heuristic tries without improving.
+HEURISTIC_ROUNDS = 3
+
+def minimize(bits, num_atoms):
+    """Returns a near-minimal list of cubes covering exactly the rows set in a truth table bitset."""
+    if num_atoms <= EXACT_ATOMS:
+        return exact(bits, num_atoms)
+    return heuristic(bits, num_atoms)
+
+def cost(cover):
+    """Cubes first, then literals."""
+    return (len(cover), sum(bin(care).count("1") for value, care in cover))
+
+def _minterms(bits, num_atoms):
+    """Converts set rows into cube values: bit k of a row's index is 0 when atom k is true."""
+    flip = (1 << num_atoms) - 1
+    values = truthtable.row_values(bits, 1 << num_atoms)
+    return [i ^ flip for i in xrange(len(values)) if values[i] == "1"]
+
+def prime_implicants(minterms, num_atoms):
+    """Quine-McCluskey: merges cubes differing in one literal until no more merges are possible."""
+    current = set((value, (1 << num_atoms) - 1) for value in minterms)
+    primes = set()
+    while current:
+        merged = set()
+        used = set()
+        for value, care in current:
+            remaining = care
+            while remaining:
+                bit = remaining & -remaining
+                remaining ^= bit
+                # Only merge from the cube where the literal is negated, so each pair is found once.
+                if value & bit:
+                    continue
+                partner = (value | bit, care)
+                if partner in current:
+                    merged.add((value, care ^ bit))
+                    used.add((value, care))
+                    used.add(partner)
+        primes |= current - used
+        current = merged
+    return primes
+
+def _covers(cube, minterm):
+    value, care = cube
+    return minterm & care == value
+
+def exact(bits, num_atoms):
+    """Quine-McCluskey prime implicants, essential primes, then Petrick's method for the rest."""
+    minterms = _minterms(bits, num_atoms)
+    primes = sorted(prime_implicants(minterms, num_atoms))
+    chart = dict((m, [p for p in primes if _covers(p, m)]) for m in minterms)
+    chosen = set(chart[m][0] for m in minterms if len(chart[m]) == 1)
+    remaining = [m for m in minterms if not any(_covers(p, m) for p in chosen)]
+    return sorted(chosen) + sorted(petrick([chart[m] for m in remaining]))
+
+def petrick(clauses):
+    """Picks the cheapest set of cubes containing at least one cube from each clause."""
+    clauses = set(frozenset(clause) for clause in clauses)
+    products = set([frozenset()])
+    for clause in sorted(clauses, key=len):
+        expanded = set()
+        for product in products:
+            if product & clause:
+                expanded.add(product)
+            else:
+                expanded.update(product | frozenset([cube]) for cube in clause)
+        # Absorption: drop any product that contains another.
+        products = set(p for p in expanded if not any(q < p for q in expanded))
+        if len(products) > PETRICK_LIMIT:
+            return greedy_cover(clauses)
+    return min(products, key=lambda product: cost(product))
+
+def greedy_cover(clauses):
+    """Repeatedly picks the cube hitting the most unhit clauses (fewest literals on ties)."""
+    clauses = list(clauses)
+    chosen = set()
+    while clauses:
+        counts = {}
+        for clause in clauses:
+            for cube in clause:
+                counts[cube] = counts.get(cube, 0) + 1
+        best = max(sorted(counts), key=lambda cube: (counts[cube], -bin(cube[1]).count("1")))
+        chosen.add(best)
+        clauses = [clause for clause in clauses if best not in clause]
+    return chosen
+
+class _Tables(object):
+    """Bitsets of the rows where each literal holds."""
+
+    def __init__(self, num_atoms):
+        masks, self.full = truthtable.atom_masks(range(num_atoms))
+        self.positive = [masks[k] for k in range(num_atoms)]
+        self.num_atoms = num_atoms
+
+    def rows(self, cube):
+        value, care = cube
+        rows = self.full
+        for k in xrange(self.num_atoms):
+            if care >> k & 1:
+                rows &= self.positive[k] if value >> k & 1 else self.full ^ self.positive[k]
+        return rows
+
+    def supercube(self, rows):
+        """The smallest cube containing all the given rows."""
+        value = care = 0
+        for k in xrange(self.num_atoms):
+            if rows & self.positive[k] == rows:
+                value |= 1 << k
+                care |= 1 << k
+            elif rows & self.positive[k] == 0:
+                care |= 1 << k
+        return value, care
+
+    def expand(self, cube, rows, off, order):
+        """Drops literals, in the given atom order, while the cube stays clear of the off-set."""
+        value, care = cube
+        for k in order:
+            if not care >> k & 1:
+                continue
+            # Atom k is true in rows whose index has bit k clear; dropping it adds the mirror rows.
+            shift = 1 << k
+            wider = rows | (rows << shift if value >> k & 1 else rows >> shift)
+            if wider & off == 0:
+                rows = wider
+                value &= ~shift
+                care ^= shift
+        return (value, care), rows
+
+def irredundant(cover, rows):
+    """Drops cubes whose rows are all covered by the other cubes."""
+    suffix = [0] * (len(cover) + 1)
+    for i in xrange(len(cover) - 1, -1, -1):
+        suffix[i] = suffix[i + 1] | rows[i]
+    kept, kept_rows, prefix = [], [], 0
+    for i in xrange(len(cover)):
+        if rows[i] & ~(prefix | suffix[i + 1]):
+            kept.append(cover[i])
+            kept_rows.append(rows[i])
+            prefix |= rows[i]
+    return kept, kept_rows
+
+def heuristic(bits, num_atoms):
+    """Espresso-style minimisation: expand to primes, drop redundant cubes, then repeatedly
+    reduce each cube to the rows only it covers and re-expand it in a different direction."""
+    tables = _Tables(num_atoms)
+    off = tables.full ^ bits
+    order = range(num_atoms)
+
+    cover, rows = [], []
+    uncovered = bits
+    flip = (1 << num_atoms) - 1
+    while uncovered:
+        index = (uncovered & -uncovered).bit_length() - 1
+        cube, cube_rows = tables.expand((index ^ flip, flip), 1 << index, off, order)
+        cover.append(cube)
+        rows.append(cube_rows)
+        uncovered &= ~cube_rows
+    cover, rows = irredundant(cover, rows)
+
+    best = list(cover)
+    stale = 0
+    while stale < HEURISTIC_ROUNDS and cover:
+        order = order[1:] + order[:1]
+        suffix = [0] * (len(cover) + 1)
+        for i in xrange(len(cover) - 1, -1, -1):
+            suffix[i] = suffix[i + 1] | rows[i]
+        reduced, reduced_rows, prefix = [], [], 0
+        for i in xrange(len(cover)):
+            unique = rows[i] & ~(prefix | suffix[i + 1])
+            if unique:
+                cube = tables.supercube(unique)
+                cube, cube_rows = tables.expand(cube, tables.rows(cube), off, order)
+            else:
+                cube, cube_rows = cover[i], 0
+            reduced.append(cube)
+            reduced_rows.append(cube_rows)
+            prefix |= cube_rows
+        cover, rows = irredundant(reduced, reduced_rows)
+        if cost(cover) < cost(best):
+            best, stale = list(cover), 0
+        else:
+            stale += 1
+    return sorted(best)
+
+def cube_literals(cube, atoms):
+    """Converts a cube into a partial model: a dict of atom -> bool for the atoms it mentions."""
+    value, care = cube
+    return dict((atom, bool(value >> k & 1)) for k, atom in enumerate(atoms) if care >> k & 1)
+
+# Tests
+
+def _check_cover(exp, minimal_cubes=None):
+    tree = parsing.parse(exp)
+    atoms = sorted(tree.atoms())
+    bits = truthtable.table_bits(tree, atoms)
+    for method in [exact, heuristic]:
+        cover = method(bits, len(atoms))
+        tables = _Tables(len(atoms))
+        union = 0
+        for cube in cover:
+            union |= tables.rows(cube)
+        assert_equal(union, bits)
+        if minimal_cubes is not None:
+            assert_equal(len(cover), minimal_cubes)
+
+def test_prime_implicants():
+    # f(A, B) = A v B: primes are A and B.
+    assert_items_equal(prime_implicants([0b11, 0b01, 0b10], 2), [(0b01, 0b01), (0b10, 0b10)])
+
+def test_exact_covers():
+    _check_cover("(AvB)", 2)
+    _check_cover("(A&(BvC))", 2)
+    _check_cover("((A&B)v(~A&C)v(B&C))", 2)
+    # Carroll's n-ary XOR means "some but not all".
+    _check_cover("(AxBxC)", 3)
+    _check_cover("(A&~A)", 0)
+    _check_cover("(Av~A)", 1)
+
+def test_heuristic_covers():
+    _check_cover("((A>B)&(C=D)&(EvF))")
+    _check_cover("((A&B&C)v(D&E)v(~A&~F)v(BxG))")
+
+def test_heuristic_large():
+    exp = "((A&B)v(C&D)v(E&F)v(G&H)v(I&J)v(K&L)v(M&N)v(O&P))"
+    tree = parsing.parse(exp)
+    atoms = sorted(tree.atoms())
+    cover = heuristic(truthtable.table_bits(tree, atoms), len(atoms))
+    assert_equal(cost(cover), (8, 16))
+
+def test_petrick():
+    a, b, c = (0b01, 0b01), (0b10, 0b10), (0b11, 0b11)
+    assert_equal(petrick([[a, b], [b, c]]), frozenset([b]))
+    assert_equal(petrick([[a, c], [c], [b, c]]), frozenset([c]))
+    assert_equal(greedy_cover([[a, b], [b, c]]), set([b]))
+
+def test_cube_literals():
+    assert_equal(cube_literals((0b001, 0b101), ["A", "B", "C"]), {"A": True, "C": False})
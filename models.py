@@ -0,0 +1,100 @@
+"""Enumerating the satisfying assignments of a parse tree (All-SAT) without walking every row.
+
+The search branches on one atom at a time, and after each choice simplify.condition evaluates
+the tree on the partial assignment: atoms not yet chosen are unknown, so the result is True
+(every completion is a model), False (none is: the whole subcube is skipped) or the part of
+the tree still undecided. Work is proportional to the models found and the branches tried,
+not to 2**atoms, so sparse formulas over many atoms are cheap."""
+import parsing
+import truthtable
+import simplify
+from simplify import condition
+from nodes import NotNode
+from nose.tools import assert_equal
+
+def _search(tree, atoms, value, every_atom):
+    """Yields (partial assignment, atoms left unassigned) for each region of the table where
+    the tree has the value. With every_atom, atoms are chosen last to first whether or not the
+    tree still depends on them, which yields the regions in table order. Otherwise the first
+    atom the rest of the tree depends on is chosen, and the others are left unassigned."""
+    root = simplify.simplify(tree if value else NotNode(tree))
+    stack = [(root, {})]
+    while stack:
+        f, partial = stack.pop()
+        if f is False:
+            continue
+        if f is True:
+            yield partial, [atom for atom in atoms if atom not in partial]
+            continue
+        if every_atom:
+            atom = atoms[len(atoms) - 1 - len(partial)]
+        else:
+            depends = f.atoms()
+            atom = next(atom for atom in atoms if atom in depends)
+        # False is pushed first so that True, which comes first in table order, is popped first.
+        for choice in (False, True):
+            branch = dict(partial)
+            branch[atom] = choice
+            stack.append((condition(f, {atom: choice}), branch))
+
+def models(tree, atoms=None, value=True):
+    """Lazily generates the truth assignments (dicts over the atoms) where the tree has the value,
+    in truth table order, as truthtable.models_from_chunks would. Atoms default to the tree's, sorted."""
+    if atoms is None:
+        atoms = sorted(tree.atoms())
+    for partial, free in _search(tree, atoms, value, True):
+        for index in xrange(1 << len(free)):
+            model = truthtable.model_of(index, free)
+            model.update(partial)
+            yield model
+
+def cubes(tree, atoms=None, value=True):
+    """Lazily generates cubes covering exactly the assignments where the tree has the value, without
+    overlapping: partial assignments, each of whose completions (over the atoms) is such an assignment.
+
+    Atoms the rest of the tree doesn't depend on are left out, so a cube may cover many rows."""
+    if atoms is None:
+        atoms = sorted(tree.atoms())
+    for partial, free in _search(tree, atoms, value, False):
+        yield partial
+
+# Tests
+
+def _table_models(tree, atoms, value=True):
+    return list(truthtable.models_from_chunks(truthtable.bit_chunks(tree, atoms), atoms, value))
+
+def test_models_match_table():
+    import bench
+    for exp in ["(A&(BvC))", "((AxBxC)v~(D=A))", "(A&~A)", "(Av~A)", "(A>(B>(C>D)))", bench.parity(6)]:
+        tree = parsing.parse(exp)
+        for atoms in [sorted(tree.atoms()), truthtable.find_atoms(exp)]:
+            for value in [True, False]:
+                assert_equal(list(models(tree, atoms, value)), _table_models(tree, atoms, value))
+
+def test_extra_atoms():
+    tree = parsing.parse("(A&B)")
+    assert_equal(list(models(tree, ["A", "B", "C"])), [{"A": True, "B": True, "C": True}, {"A": True, "B": True, "C": False}])
+
+def test_cubes():
+    tree = parsing.parse("((A&B)v(C&D&E))")
+    found = list(cubes(tree))
+    covered = set()
+    for cube in found:
+        free = [atom for atom in "ABCDE" if atom not in cube]
+        for index in xrange(1 << len(free)):
+            model = truthtable.model_of(index, free)
+            model.update(cube)
+            key = tuple(sorted(model.items()))
+            assert key not in covered
+            covered.add(key)
+    assert_equal(len(covered), len(_table_models(tree, sorted(tree.atoms()))))
+    assert {"A": True, "B": True} in found
+    assert_equal(list(cubes(parsing.parse("(Av~A)"))), [{}])
+    assert_equal(list(cubes(parsing.parse("(A&~A)"))), [])
+
+def test_sparse_many_atoms():
+    import bench
+    # 2**60 rows, two models: only the branches towards them are explored.
+    exp = "(" + "&".join("(X%d=X%d)" % (i, i + 1) for i in range(1, 60)) + ")"
+    assert_equal(len(list(models(parsing.parse(exp)))), 2)
+    assert_equal(sum(1 for cube in cubes(parsing.parse(bench.wide_or(60)), value=False)), 1)
@@ -1,25 +1,68 @@
 from nose.tools import assert_raises, with_setup
-import string
+import pickle
+import re
+import weakref
 
 T = True
 F = False
 
+# Atoms are capitalised identifiers like A, X12 or REQ_OK, or lowercase identifiers of at least
+# two characters like req_ok (so that v and x stay operators).
+ATOM_PATTERN = r"[A-Z][A-Z0-9_]*|[a-z_][a-z0-9_]+"
+_ATOM = re.compile(r"(%s)$" % ATOM_PATTERN)
+
 class LogicError(Exception):
     pass
 
 class Node(object):
     """Base class for logic nodes.
 
-    A node forms an expression tree for a sentence of symbolic logic."""
+    A node forms an expression tree for a sentence of symbolic logic.
+
+    Nodes are immutable and hash-consed: constructing a node equal to one that already
+    exists returns the existing object, so equal subtrees are shared, `is` is structural
+    equality, and a node is a cheap key for memoizing anything computed per subtree."""
+
+    __slots__ = ("children", "_atoms", "_hash", "__weakref__")
+    _interned = weakref.WeakValueDictionary()
+
+    def __new__(cls, *children):
+        key = (cls, children)
+        node = Node._interned.get(key)
+        if node is None:
+            node = object.__new__(cls)
+            node.check_valid(children)
+            node.children = children
+            node._atoms = node.find_atoms()
+            node._hash = hash(key)
+            Node._interned[key] = node
+        return node
 
     def __init__(self, *children):
-        self.check_valid(children)
-        self.children = children
+        """Nodes are built (or looked up) in __new__."""
+        pass
+
+    def __hash__(self):
+        return self._hash
+
+    def __reduce__(self):
+        return (type(self), self.children)
 
     def eval(self, model):
         """Evaluates the logic tree rooted at this node against a supplied model.
 
-        Model is an assignment of truth values to atoms (dict of string -> bool)."""
+        Model is an assignment of truth values to atoms (dict of string -> bool). Iterative, and
+        a node shared by several parents (as let makes) is evaluated once."""
+        values = {}
+        for node in postorder(self):
+            if isinstance(node, AtomNode):
+                values[id(node)] = model[node.l]
+            else:
+                values[id(node)] = node.combine([values[id(child)] for child in node.children])
+        return values[id(self)]
+
+    def combine(self, values):
+        """This node's value, given its children's values in order."""
         raise NotImplementedError
 
     def check_valid(self, children):
@@ -35,10 +78,13 @@ class Node(object):
 
     def atoms(self):
         """Return a set of characters which are atoms in this expression."""
-        children_atoms = set()
-        for child in self.children:
-            children_atoms = children_atoms | child.atoms()
-        return children_atoms
+        return self._atoms
+
+    def find_atoms(self):
+        """Computes atoms() when the node is built, from the children's already-computed sets."""
+        if len(self.children) == 1:
+            return self.l.atoms()
+        return frozenset().union(*[child.atoms() for child in self.children])
 
     @property
     def l(self):
@@ -52,50 +98,98 @@ class Node(object):
             return None
 
 class AndNode(Node):
-    def eval(self, model):
-        return all([n.eval(model) for n in self.children])
+    __slots__ = ()
+    def combine(self, values):
+        return all(values)
 
 class OrNode(Node):
-    def eval(self, model):
-        return any([n.eval(model) for n in self.children])
+    __slots__ = ()
+    def combine(self, values):
+        return any(values)
 
 class NotNode(Node):
-    def eval(self, model):
-        if len(self.children) != 1:
+    __slots__ = ()
+    def combine(self, values):
+        if len(values) != 1:
             raise LogicError("NOT is undefined for multiple children.")
-        return not self.l.eval(model)
+        return not values[0]
 
 class IfNode(Node):
-    def eval(self, model):
-        if len(self.children) != 2:
+    __slots__ = ()
+    def combine(self, values):
+        if len(values) != 2:
             raise LogicError("IF is only defined for exactly two children.")
-        return not self.children[0].eval(model) or self.children[1].eval(model)
+        return not values[0] or values[1]
 
 class XorNode(Node):
-    def eval(self, model):
-        children_values = [n.eval(model) for n in self.children]
-        return any(children_values) and not all(children_values)
+    __slots__ = ()
+    def combine(self, values):
+        return any(values) and not all(values)
 
 class IffNode(Node):
-    def eval(self, model):
-        children_values = [n.eval(model) for n in self.children]
-        return not any(children_values) or all(children_values)
+    __slots__ = ()
+    def combine(self, values):
+        return not any(values) or all(values)
 
 
 class AtomNode(Node):
     """These nodes will always form the leaves of a logic tree.
 
     They are the only node whose children are strings, not other nodes."""
+    __slots__ = ()
     def eval(self, model):
         return model[self.l]
     def check_valid_specific(self, children):
         if len(children) != 1:
             raise LogicError("Can't have multiple atomic propositions in one atom %s" % str(children))
-        if children[0] not in string.uppercase:
-            raise LogicError("Atoms must be capital letters (your atom is %s)" % str(children[0]))
+        if not isinstance(children[0], basestring) or not _ATOM.match(children[0]):
+            raise LogicError("Atoms must be identifiers like A, X12 or req_ok (your atom is %s)" % str(children[0]))
         pass
-    def atoms(self):
-        return set(self.l)
+    def find_atoms(self):
+        return frozenset([self.l])
+
+
+def postorder(tree):
+    """Yields every distinct node of a tree exactly once, children before their parents.
+
+    Iterative rather than recursive, so it copes with trees of any depth."""
+    seen = set()
+    stack = [(tree, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if id(node) in seen:
+            continue
+        if expanded or isinstance(node, AtomNode):
+            seen.add(id(node))
+            yield node
+        else:
+            stack.append((node, True))
+            for child in reversed(node.children):
+                stack.append((child, False))
+
+
+def flatten(tree):
+    """Lists a tree's distinct nodes in postorder, as (class, children) pairs where children are
+    indices of earlier entries (or an atom's name). Unlike pickling a tree, this doesn't recurse."""
+    index = {}
+    items = []
+    for node in postorder(tree):
+        if isinstance(node, AtomNode):
+            items.append((AtomNode, node.children))
+        else:
+            items.append((type(node), tuple(index[id(child)] for child in node.children)))
+        index[id(node)] = len(items) - 1
+    return items
+
+def unflatten(items):
+    """Rebuilds the tree listed by flatten."""
+    built = []
+    for cls, children in items:
+        if cls is AtomNode:
+            built.append(AtomNode(*children))
+        else:
+            built.append(cls(*[built[i] for i in children]))
+    return built[-1]
 
 
 def setup_tf_nodes():
@@ -205,6 +299,13 @@ def test_single_atom():
 def test_atoms_uppercase():
     assert_raises(LogicError, AtomNode, "a")
 
+def test_atoms_identifiers():
+    AtomNode("X123")
+    AtomNode("req_ok")
+    assert_raises(LogicError, AtomNode, "v")
+    assert_raises(LogicError, AtomNode, "A B")
+    assert_raises(LogicError, AtomNode, "1A")
+
 def test_check_valid():
     assert_raises(LogicError, AtomNode)
 
@@ -218,4 +319,59 @@ def test_find_atoms():
     c = AtomNode("C")
     d = AtomNode("D")
     n = AndNode(XorNode(a, a), OrNode(b, IffNode(c, d)))
-    assert n.atoms() == {"A", "B", "C", "D"}
\ No newline at end of file
+    assert n.atoms() == {"A", "B", "C", "D"}
+
+def test_postorder():
+    a, b = AtomNode("A"), AtomNode("B")
+    left = AndNode(a, b)
+    n = OrNode(left, NotNode(a))
+    assert list(postorder(n)) == [a, b, left, n.r, n]
+
+def test_postorder_deep():
+    n = AtomNode("A")
+    for i in range(5000):
+        n = NotNode(n)
+    assert len(list(postorder(n))) == 5001
+
+def test_hash_consing():
+    assert AtomNode("A") is AtomNode("A")
+    assert AndNode(AtomNode("A"), NotNode(AtomNode("B"))) is AndNode(AtomNode("A"), NotNode(AtomNode("B")))
+    assert AndNode(AtomNode("A"), AtomNode("B")) is not AndNode(AtomNode("B"), AtomNode("A"))
+    assert AndNode(AtomNode("A"), AtomNode("B")) is not OrNode(AtomNode("A"), AtomNode("B"))
+
+def test_slots():
+    n = AndNode(AtomNode("A"), AtomNode("B"))
+    assert not hasattr(n, "__dict__")
+    assert_raises(AttributeError, setattr, n, "foo", 1)
+
+def test_atoms_cached():
+    n = OrNode(AtomNode("A"), AndNode(AtomNode("B"), AtomNode("A")))
+    assert n.atoms() is n.atoms()
+    assert n.atoms() == {"A", "B"}
+
+def test_pickle_interned():
+    n = IfNode(AtomNode("A"), XorNode(AtomNode("B"), AtomNode("C")))
+    assert pickle.loads(pickle.dumps(n, 2)) is n
+    assert pickle.loads(pickle.dumps(n)) is n
+
+def test_flatten():
+    a, b = AtomNode("A"), AtomNode("B")
+    n = OrNode(AndNode(a, b), NotNode(a))
+    assert flatten(n) == [(AtomNode, ("A",)), (AtomNode, ("B",)), (AndNode, (0, 1)), (NotNode, (0,)), (OrNode, (2, 3))]
+    assert unflatten(flatten(n)) is n
+    deep = a
+    for i in range(10000):
+        deep = NotNode(deep)
+    assert unflatten(pickle.loads(pickle.dumps(flatten(deep), 2))) is deep
+
+def test_eval_shared_and_deep():
+    # Each level uses the one below twice: 2**200 paths, but 201 distinct nodes.
+    a = AtomNode("A")
+    n = a
+    for i in range(200):
+        n = IffNode(n, n)
+    assert n.eval({"A": False})
+    deep = a
+    for i in range(10001):
+        deep = NotNode(deep)
+    assert deep.eval({"A": False})
@@ -1,25 +1,195 @@
 import truthtable
+import parsing
 import functools
-from nose.tools import assert_equals, assert_items_equal
-
-def to_dnf(expression):
-    """Converts a proposition string into a DNF string."""
-    table = truthtable.truth_table(expression)
-    output = "("
-    for row in table:
-        if row.value:
-            output += "(%s) v " % and_clause(row.model)
-    output = output[:-3] + ")"
-    return output
-
-def to_cnf(expression):
-    table = truthtable.truth_table(expression)
-    output = "("
-    for row in table:
-        if not row.value:
-            output += "(%s) & " % or_clause(row.model)
-    output = output[:-3] + ")"
-    return output
+import sat
+import minimize
+import cache
+import models
+from nodes import AtomNode, NotNode, AndNode, OrNode, XorNode, IfNode, IffNode, LogicError, postorder
+from nose.tools import assert_equals, assert_items_equal, assert_true
+
+# Auxiliary variables in equisatisfiable CNF strings are named _1, _2, ...
+AUX_PREFIX = "_"
+
+def to_dnf(expression, minimal=False, jobs=1):
+    """Converts a proposition string into a DNF string.
+
+    With minimal, the DNF uses as few (and as short) terms as minimize can find,
+    instead of one term per true row. With jobs > 1, large truth tables are computed in parallel.
+    Results are kept in the disk cache, when it's on."""
+    return _cached_form("dnf", expression, minimal, lambda: _to_dnf(expression, minimal, jobs))
+
+def _to_dnf(expression, minimal, jobs):
+    if minimal:
+        return _minimal_form(expression, True, jobs)
+    return dnf_from_models(_models(expression, True, jobs))
+
+def to_cnf(expression, minimal=False, jobs=1):
+    """Converts a proposition string into a CNF string, optionally minimised like to_dnf."""
+    return _cached_form("cnf", expression, minimal, lambda: _to_cnf(expression, minimal, jobs))
+
+def _to_cnf(expression, minimal, jobs):
+    if minimal:
+        return _minimal_form(expression, False, jobs)
+    return cnf_from_models(_models(expression, False, jobs))
+
+def dnf_from_models(assignments):
+    """Writes a DNF with one term per truth assignment, e.g. those models.models generates.
+    Cubes from models.cubes work too, giving a DNF with a term per cube."""
+    # Joined once at the end: adding to a unicode string (as click passes) copies it each time.
+    output = ["("]
+    for model in assignments:
+        output.append("(%s) v " % and_clause(model))
+    return "".join(output)[:-3] + ")"
+
+def cnf_from_models(assignments):
+    """Writes a CNF with one clause ruling out each truth assignment, e.g. the false ones
+    models.models generates with value False."""
+    output = ["("]
+    for model in assignments:
+        output.append("(%s) & " % or_clause(model))
+    return "".join(output)[:-3] + ")"
+
+def _cached_form(kind, expression, minimal, compute):
+    if not cache.enabled():
+        return compute()
+    # Rows (and so terms) are in the order of the expression's atoms, which is part of the key.
+    tree = parsing.parse(expression)
+    return cache.cached(kind, [tree, truthtable.find_atoms(expression), minimal], compute, decode=str)
+
+def _models(expression, value, jobs=1):
+    """Generates the truth assignments of the truth table rows whose value is `value`.
+
+    Tables bigger than a chunk come from an All-SAT search, which skips the regions of rows
+    without that value instead of evaluating them: the same models in the same order."""
+    tree = parsing.parse(expression)
+    atoms = truthtable.find_atoms(expression)
+    if len(atoms) > truthtable.CHUNK_ATOMS:
+        return models.models(tree, atoms, value)
+    return truthtable.models_from_chunks(truthtable.bit_chunks(tree, atoms, jobs), atoms, value)
+
+def _minimal_form(expression, dnf, jobs=1):
+    """Minimises the true rows into DNF terms, or the false rows into CNF clauses."""
+    tree = parsing.parse(expression)
+    atoms = truthtable.find_atoms(expression)
+    bits = truthtable.table_bits(tree, atoms, jobs)
+    if not dnf:
+        bits ^= (1 << (1 << len(atoms))) - 1
+    cover = minimize.minimize(bits, len(atoms))
+    first = min(atoms)
+    if not cover:
+        # No true rows for a DNF (or no false rows for a CNF).
+        return "((%s %s ~%s))" % (first, "&" if dnf else "v", first)
+    if cover == [(0, 0)]:
+        # Every row is true for a DNF (or false for a CNF).
+        return "((%s) %s (~%s))" % (first, "v" if dnf else "&", first)
+    clause = and_clause if dnf else or_clause
+    terms = [clause(minimize.cube_literals(cube, atoms)) for cube in cover]
+    terms.sort(key=lambda term: (term.count(" "), term))
+    return "(%s)" % (" v " if dnf else " & ").join(["(%s)" % term for term in terms])
+
+def to_equisatisfiable_cnf(expression):
+    """Converts a proposition string into an equisatisfiable CNF string, linear in the expression's size.
+
+    Auxiliary atoms stand for subexpressions, so the result is satisfiable exactly when the
+    expression is, and its models agree with the expression's on the original atoms."""
+    clauses, variables = tseitin(parsing.parse(expression))
+    names = dict((var, atom) for atom, var in variables.items())
+    name = lambda var: names.get(var, "%s%d" % (AUX_PREFIX, var - len(variables)))
+    output = ["("]
+    for clause in clauses:
+        literals = [("~" if lit < 0 else "") + name(abs(lit)) for lit in clause]
+        output.append("(%s) & " % " v ".join(literals))
+    return "".join(output)[:-3] + ")"
+
+def tseitin(tree, polarity=True):
+    """Converts a parse tree into an equisatisfiable CNF, as clauses of DIMACS literals (lists of ints).
+
+    Returns (clauses, variables), where variables maps each atom to its variable number. Atoms get
+    1..n in sorted order; auxiliary variables numbered after them stand for subexpressions.
+    With polarity (Plaisted-Greenbaum), each auxiliary only gets the implications its
+    occurrences need, rather than a full equivalence."""
+    clauses, root, variables = encode(tree, polarity)
+    clauses.append([root])
+    return clauses, variables
+
+def encode(tree, polarity=True):
+    """Tseitin-encodes a parse tree in one pass. Returns (clauses, root, variables).
+
+    Root is the literal standing for the whole tree; it isn't asserted by the clauses."""
+    nodes = list(postorder(tree))
+    variables = dict((atom, i + 1) for i, atom in enumerate(sorted(tree.atoms())))
+    counter = [len(variables)]
+    clauses = []
+
+    # Which ways each subtree is used: True if it must imply its definition, False if it
+    # must be implied by it. Parents come before children in reversed postorder.
+    both = set([True, False])
+    uses = {id(tree): set([True])}
+    for node in reversed(nodes):
+        if isinstance(node, AtomNode):
+            continue
+        mine = uses[id(node)] if polarity else both
+        flipped = set(not use for use in mine)
+        for i, child in enumerate(node.children):
+            if isinstance(node, (XorNode, IffNode)):
+                child_uses = both
+            elif isinstance(node, NotNode) or (isinstance(node, IfNode) and i == 0):
+                child_uses = flipped
+            else:
+                child_uses = mine
+            uses.setdefault(id(child), set()).update(child_uses)
+
+    def define_and(children, pos, neg):
+        counter[0] += 1
+        x = counter[0]
+        if pos:
+            clauses.extend([-x, c] for c in children)
+        if neg:
+            clauses.append([x] + [-c for c in children])
+        return x
+    def define_or(children, pos, neg):
+        return -define_and([-c for c in children], neg, pos)
+    def define_xor(children, pos, neg):
+        if len(children) == 2:
+            a, b = children
+            counter[0] += 1
+            x = counter[0]
+            if pos:
+                clauses.extend([[-x, a, b], [-x, -a, -b]])
+            if neg:
+                clauses.extend([[x, -a, b], [x, a, -b]])
+            return x
+        some = define_or(children, pos, neg)
+        every = define_and(children, neg, pos)
+        return define_and([some, -every], pos, neg)
+
+    literals = {}
+    for node in nodes:
+        if isinstance(node, AtomNode):
+            literals[id(node)] = variables[node.l]
+            continue
+        children = [literals[id(child)] for child in node.children]
+        mine = uses[id(node)] if polarity else both
+        pos, neg = True in mine, False in mine
+        if isinstance(node, NotNode):
+            if len(children) != 1:
+                raise LogicError("NOT is undefined for multiple children.")
+            literal = -children[0]
+        elif isinstance(node, AndNode):
+            literal = define_and(children, pos, neg)
+        elif isinstance(node, OrNode):
+            literal = define_or(children, pos, neg)
+        elif isinstance(node, IfNode):
+            if len(children) != 2:
+                raise LogicError("IF is only defined for exactly two children.")
+            literal = define_or([-children[0], children[1]], pos, neg)
+        elif isinstance(node, XorNode):
+            literal = define_xor(children, pos, neg)
+        else:
+            literal = -define_xor(children, neg, pos)
+        literals[id(node)] = literal
+    return clauses, literals[id(tree)], variables
 
 def model_to_clause(model, truth, symbol):
     l = []
@@ -61,3 +231,70 @@ def test_longer_cnf():
     # We strip out the opening/closing brackets, and compare the clauses
     # so the strangely-ordered CNF conversion doesn't ruin our test.
     assert_items_equal(expected_cnf[1:-1].split(" & "), actual[1:-1].split(" & "))
+
+def _projected_models(clauses, variables):
+    """Finds every model of the clauses, projected onto the atoms, by blocking each one found."""
+    solver = sat.Solver()
+    for clause in clauses:
+        solver.add_clause(clause)
+    models = []
+    while solver.solve():
+        model = dict((atom, solver.value(var) is True) for atom, var in variables.items())
+        models.append(model)
+        solver.add_clause([-var if model[atom] else var for atom, var in variables.items()])
+    return models
+
+def test_tseitin_models():
+    for exp in ["(A&(BvC))", "((A>B)x(C=~A))", "(AxBxC)", "~(A=B=C)", "((A&B)v(A&B)v~C)"]:
+        tree = parsing.parse(exp)
+        expected = [row.model for row in truthtable.from_tree(tree) if row.value]
+        for polarity in [True, False]:
+            clauses, variables = tseitin(tree, polarity)
+            assert_items_equal(expected, _projected_models(clauses, variables))
+
+def test_tseitin_unsatisfiable():
+    clauses, variables = tseitin(parsing.parse("((A>B)&A&~B)"))
+    solver = sat.Solver()
+    for clause in clauses:
+        solver.add_clause(clause)
+    assert not solver.solve()
+
+def test_tseitin_linear():
+    exp = "(" + " & ".join(["(%sx%s)" % pair for pair in zip("ABCDEFGHIJKLM", "NOPQRSTUVWXYZ")]) + ")"
+    clauses, variables = tseitin(parsing.parse(exp))
+    assert len(clauses) <= 2 * 13 + 13 + 2
+    assert_equals(len(variables), 26)
+
+def test_tseitin_atom():
+    assert_equals(tseitin(parsing.parse("~A")), ([[-1]], {"A": 1}))
+
+def test_equisatisfiable_cnf():
+    assert_equals(to_equisatisfiable_cnf("(A&B)"), "((~_1 v A) & (~_1 v B) & (_1))")
+
+def test_minimal_dnf():
+    assert_equals(to_dnf("(A & (B | C))", minimal=True), "((A & B) v (A & C))")
+    assert_equals(to_dnf("((A&B)v(A&~B))", minimal=True), "((A))")
+    assert_equals(to_dnf("(A&~A)", minimal=True), "((A & ~A))")
+    assert_equals(to_dnf("(Av~A)", minimal=True), "((A) v (~A))")
+
+def test_minimal_cnf():
+    assert_equals(to_cnf("(~A & (B v C))", minimal=True), "((~A) & (B v C))")
+    assert_equals(to_cnf("(Av~A)", minimal=True), "((A v ~A))")
+
+def test_minimal_forms_equivalent():
+    for exp in ["((A>B)x(C=~D))", "((A&B&C)v(~A&D)v(B=D))"]:
+        assert truthtable.equivalent(exp, to_dnf(exp, minimal=True))
+        assert truthtable.equivalent(exp, to_cnf(exp, minimal=True))
+
+def test_forms_from_models():
+    tree = parsing.parse("(A & (B | C))")
+    atoms = truthtable.find_atoms("(A & (B | C))")
+    assert_equals(dnf_from_models(models.models(tree, atoms)), to_dnf("(A & (B | C))"))
+    assert_equals(dnf_from_models(models.cubes(tree)), "((A & B) v (A & ~B & C))")
+    assert_equals(cnf_from_models(models.models(tree, atoms, False)), to_cnf("(A & (B | C))"))
+
+def test_sparse_forms():
+    # 24 atoms: more than a chunk, so the rows come from models rather than the table.
+    exp = "(" + " & ".join("X%d" % i for i in range(1, 24)) + " & (Y v ~Y))"
+    assert_equals(to_dnf(exp).count(" v "), 1)
+    assert_true(to_dnf(exp).startswith("((X1 & X10 & X11"))
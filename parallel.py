@@ -0,0 +1,128 @@
+"""Truth table enumeration spread over a pool of worker processes.
+
+The rows of a table are split into sub-cubes on its last (slowest-varying) atoms. Each worker
+receives the tree once, compiles it, and then evaluates whole sub-cubes bit-parallel, so
+only sub-cube numbers go out and bitsets (or single verdicts) come back."""
+import multiprocessing
+import truthtable
+import codegen
+import parsing
+from nodes import flatten, unflatten
+from nose.tools import assert_equal
+
+# Tables over fewer atoms than this are quicker to compute than to farm out.
+MIN_ATOMS = 16
+# Sub-cubes handed out per worker, so uneven sub-cubes still balance out.
+UNITS_PER_JOB = 4
+
+_worker = {}
+
+def _init_worker(items, atoms, unit_atoms):
+    tree = unflatten(items)
+    masks, full = truthtable.atom_masks(atoms[:unit_atoms])
+    _worker["evaluate"] = codegen.compile_bits(tree, atoms)
+    _worker["masks"] = [masks[atom] for atom in atoms[:unit_atoms]] + [0] * (len(atoms) - unit_atoms)
+    _worker["full"] = full
+    _worker["unit_atoms"] = unit_atoms
+
+def _unit_bits(unit):
+    """Evaluates the rows of one sub-cube: atoms past unit_atoms are fixed by the unit's number."""
+    masks, full, unit_atoms = _worker["masks"], _worker["full"], _worker["unit_atoms"]
+    for k in xrange(len(masks) - unit_atoms):
+        masks[unit_atoms + k] = 0 if unit >> k & 1 else full
+    return _worker["evaluate"](masks, full)
+
+def _first_row(unit, bits):
+    if not bits:
+        return None
+    return (unit << _worker["unit_atoms"]) + (bits & -bits).bit_length() - 1
+
+def _unit_first_true(unit):
+    return _first_row(unit, _unit_bits(unit))
+
+def _unit_first_false(unit):
+    return _first_row(unit, _unit_bits(unit) ^ _worker["full"])
+
+def use_pool(atoms, jobs):
+    """Whether a table over these atoms is worth spreading over `jobs` processes."""
+    return jobs > 1 and len(atoms) >= MIN_ATOMS
+
+def _unit_atoms(atoms, jobs):
+    """How many atoms vary inside each sub-cube: enough sub-cubes to keep every worker busy,
+    but never more rows per sub-cube than one of truthtable's chunks."""
+    split = 0
+    while (1 << split) < jobs * UNITS_PER_JOB and split < len(atoms):
+        split += 1
+    return min(len(atoms) - split, truthtable.CHUNK_ATOMS)
+
+def _pool(tree, atoms, jobs, unit_atoms):
+    # Compile here first: a worker whose initializer raises is just replaced, forever.
+    codegen.compile_bits(tree, atoms)
+    return multiprocessing.Pool(jobs, _init_worker, (flatten(tree), atoms, unit_atoms))
+
+def bit_chunks(tree, atoms, jobs):
+    """Like truthtable.bit_chunks, computed by `jobs` worker processes. Chunks come out in order."""
+    unit_atoms = _unit_atoms(atoms, jobs)
+    pool = _pool(tree, atoms, jobs, unit_atoms)
+    try:
+        per_chunk = truthtable.chunk_width(atoms) >> unit_atoms
+        bits, filled = 0, 0
+        for unit in pool.imap(_unit_bits, xrange(1 << (len(atoms) - unit_atoms))):
+            bits |= unit << (filled << unit_atoms)
+            filled += 1
+            if filled == per_chunk:
+                yield bits
+                bits, filled = 0, 0
+    finally:
+        pool.terminate()
+
+def find_row(tree, atoms, jobs, value=True, first=False):
+    """Returns the index of some row of the table whose value is `value`, or None if there isn't one.
+    With first, it's the first such row, though sub-cubes then have to be looked at in order.
+
+    Every worker is stopped as soon as the row is found."""
+    unit_atoms = _unit_atoms(atoms, jobs)
+    pool = _pool(tree, atoms, jobs, unit_atoms)
+    check = _unit_first_true if value else _unit_first_false
+    try:
+        results = (pool.imap if first else pool.imap_unordered)(check, xrange(1 << (len(atoms) - unit_atoms)))
+        for index in results:
+            if index is not None:
+                return index
+        return None
+    finally:
+        pool.terminate()
+
+def satisfiable(tree, atoms, jobs):
+    return find_row(tree, atoms, jobs, True) is not None
+
+def tautology(tree, atoms, jobs):
+    return find_row(tree, atoms, jobs, False) is None
+
+# Tests
+
+def test_unit_atoms():
+    atoms = ["A%d" % i for i in range(30)]
+    assert_equal(_unit_atoms(atoms, 4), truthtable.CHUNK_ATOMS)
+    assert_equal(_unit_atoms(atoms[:18], 4), 14)
+    assert_equal(_unit_atoms(atoms[:3], 4), 0)
+
+def test_parallel_chunks_match():
+    tree = parsing.parse("((A&B)v(CxD)v(E>F)v~G)")
+    atoms = list("ABCDEFG")
+    assert_equal(list(bit_chunks(tree, atoms, 2)), list(truthtable.bit_chunks(tree, atoms)))
+
+def test_parallel_decisions():
+    atoms = ["A", "B", "C", "D", "E"]
+    assert satisfiable(parsing.parse("(A&B&C&D&E)"), atoms, 2)
+    assert not satisfiable(parsing.parse("(A&B&C&D&~A&E)"), atoms, 2)
+    assert tautology(parsing.parse("((A&B)v~(A&B)v(C&D&E))"), atoms, 2)
+    assert not tautology(parsing.parse("(AvBvCvDvE)"), atoms, 2)
+
+def test_find_row():
+    atoms = ["A", "B", "C", "D", "E"]
+    # Only the last row, where every atom is false, is false.
+    assert_equal(find_row(parsing.parse("(AvBvCvDvE)"), atoms, 2, False), 31)
+    assert_equal(find_row(parsing.parse("(A&B&C&D&~E)"), atoms, 2, True), 16)
+    # False in the first two sub-cubes and true in the rest, so any of those could answer first.
+    assert_equal(find_row(parsing.parse("~(D&E)"), atoms, 2, True, True), 8)
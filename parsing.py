@@ -1,49 +1,146 @@
-import string
-import symbols
-from collections import deque
+import re
+import stats
 from nose.tools import assert_equals, assert_raises, assert_is_instance
 from symbols import meaning_of
-from nodes import AtomNode, NotNode, AndNode, OrNode, XorNode, IfNode, IffNode
+from nodes import Node, AtomNode, NotNode, AndNode, OrNode, XorNode, IfNode, IffNode, ATOM_PATTERN, postorder
+
+# Whitespace, an atom, or any other single character.
+_TOKEN = re.compile(r"\s+|(%s)|(.)" % ATOM_PATTERN)
+_ATOM = re.compile(r"(%s)$" % ATOM_PATTERN)
+_BINARY = (AndNode, OrNode, XorNode, IfNode, IffNode)
+# Parsed expressions remembered by parse. Nodes are immutable and shared, so cached trees are safe to reuse.
+CACHE_SIZE = 4096
+_cache = {}
+# "let NAME = WFF in WFF" names a wff for use in the second one. The name stands for the same
+# node wherever it's used, so the parse is a DAG in which the shared wff appears (and is
+# evaluated) once, however many times it's used.
+LET = "let"
+IN = "in"
+KEYWORDS = (LET, IN)
+
+def tokenize(exp):
+    """Splits a logical expression (supplied as a string) into a list of atoms and symbols."""
+    return [atom or symbol for atom, symbol in _TOKEN.findall(exp) if atom or symbol]
+
+def is_atom(token):
+    return _ATOM.match(token) is not None
 
 def parse(exp):
-    """Starts parsing a logical expression (supplied as a string). Returns a tree of Nodes."""
-    exp = exp.replace(" ", "")
-    d = deque(exp)
-    tree = _parse(d)
-    if d:
-        raise IOError("Unconsumed tokens %s" % "".join(d))
-    else:
-        return tree
+    """Parses a logical expression (supplied as a string). Returns a tree of Nodes.
+
+    Uses an explicit stack rather than recursion, so nesting depth is only limited by memory.
+    Up to CACHE_SIZE parsed expressions are remembered (the cache empties when full),
+    so repeats aren't parsed again. A tree that's already built (a Node) is returned as it is,
+    so anything taking an expression also takes a tree (such as one read by dimacs)."""
+    if isinstance(exp, Node):
+        return exp
+    tree = _cache.get(exp)
+    if stats.enabled:
+        stats.count("parse_cache_misses" if tree is None else "parse_cache_hits")
+    if tree is None:
+        if len(_cache) >= CACHE_SIZE:
+            _cache.clear()
+        with stats.phase("parse"):
+            tree = _cache[exp] = _parse(exp)
+    return tree
 
 def _parse(exp):
-    """Recursive-descent parsing algorithm for logic expressions. Returns a tree of Nodes."""
-
-    if not exp:
-        raise IOError("Empty string is not a wff.")
-
-    char = exp.popleft()
-
-    # Atom node case
-    if meaning_of(char) == AtomNode:
-        return AtomNode(char)
-
-    # Single-operand node case (i.e. NOT node)
-    elif meaning_of(char) == NotNode:
-        return NotNode(_parse(exp))
-
-    # Multiple-operand node case (e.g. AND, NOT)
-    elif char == "(":
-        l = _parse(exp)
-        _op = exp[0]
-        more = []
-        while exp and exp[0] == _op:
-            op = exp.popleft()
-            more.append(_parse(exp))
-        if not exp or exp.popleft() != ")":
-            raise IOError("Missing )")
-        return meaning_of(op)(l, *more)
-    else:
-        raise IOError("%s can't start a wff." % char)
+    tokens = tokenize(exp)
+    pos, end = 0, len(tokens)
+    # The nodes that defined names currently stand for, innermost definition last.
+    scopes = {}
+    # One entry per enclosing operator still being parsed: None for a NOT, a
+    # [children, operator symbol] pair for an open bracket, or a (LET or IN, name)
+    # pair for a definition whose value or body is being parsed.
+    stack = []
+    while True:
+        if pos == end:
+            raise IOError("Empty string is not a wff.")
+        token = tokens[pos]
+        pos += 1
+        if meaning_of(token) == NotNode:
+            stack.append(None)
+            continue
+        elif token == "(":
+            stack.append([[], None])
+            continue
+        elif token == LET:
+            if pos + 1 >= end or not is_atom(tokens[pos]) or tokens[pos] in KEYWORDS or tokens[pos + 1] != "=":
+                raise IOError("Expected a name and = after let.")
+            stack.append((LET, tokens[pos]))
+            pos += 2
+            continue
+        elif token in KEYWORDS:
+            raise IOError("%s can't start a wff." % token)
+        elif is_atom(token):
+            node = scopes[token][-1] if scopes.get(token) else AtomNode(token)
+        else:
+            raise IOError("%s can't start a wff." % token)
+
+        # A wff just ended: attach it to the operators waiting for it.
+        while stack:
+            frame = stack[-1]
+            if frame is None:
+                stack.pop()
+                node = NotNode(node)
+                continue
+            if isinstance(frame, tuple):
+                keyword, name = frame
+                if keyword == IN:
+                    # The body of a definition ended, and with it the definition's scope.
+                    stack.pop()
+                    scopes[name].pop()
+                    continue
+                if pos == end or tokens[pos] != IN:
+                    raise IOError("Missing in after the definition of %s." % name)
+                pos += 1
+                stack[-1] = (IN, name)
+                scopes.setdefault(name, []).append(node)
+                break
+            children, op = frame
+            children.append(node)
+            following = tokens[pos] if pos < end else None
+            if op is None and meaning_of(following) in _BINARY:
+                frame[1] = following
+                pos += 1
+                break
+            elif op is not None and following == op:
+                pos += 1
+                break
+            elif op is not None and following == ")":
+                pos += 1
+                stack.pop()
+                node = meaning_of(op)(*children)
+            elif following == ")":
+                raise IOError("Missing operator before )")
+            else:
+                raise IOError("Missing )")
+        else:
+            if pos < end:
+                raise IOError("Unconsumed tokens %s" % "".join(tokens[pos:]))
+            return node
+
+def read_definitions(lines):
+    """Reads a definitions file: lines of the form "NAME = WFF", each able to use the names
+    defined before it, and then a wff. Blank lines and lines starting with # are skipped.
+
+    Returns the same as a let expression, which is what parse and the rest of carroll take."""
+    definitions = []
+    exp = None
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if exp is not None:
+            raise IOError("Line %d: nothing may follow the wff." % number)
+        tokens = tokenize(line)
+        if len(tokens) > 2 and is_atom(tokens[0]) and tokens[1] == "=":
+            definitions.append("%s %s = %s %s" % (LET, tokens[0], line.split("=", 1)[1].strip(), IN))
+        else:
+            exp = line
+    if exp is None:
+        raise IOError("A definitions file must end with a wff.")
+    return " ".join(definitions + [exp])
 
 def test_error_parse():
     assert_raises(IOError, parse, "")
@@ -148,4 +245,59 @@ def test_parse_xor():
     n = parse("(AxB)")
     assert_is_instance(n, XorNode)
     assert_is_instance(n.l, AtomNode)
-    assert_is_instance(n.r, AtomNode)
\ No newline at end of file
+    assert_is_instance(n.r, AtomNode)
+
+def test_tokenize():
+    assert_equals(tokenize("(A v B)"), ["(", "A", "v", "B", ")"])
+    assert_equals(tokenize("(X12&~req_ok)"), ["(", "X12", "&", "~", "req_ok", ")"])
+    assert_equals(tokenize("(AxB)"), ["(", "A", "x", "B", ")"])
+
+def test_multicharacter_atoms():
+    n = parse("(X123 v (req_ok & ~FLAG_2))")
+    assert_is_instance(n, OrNode)
+    assert_equals(n.l.l, "X123")
+    assert_equals(n.atoms(), {"X123", "req_ok", "FLAG_2"})
+    assert_raises(IOError, parse, "(req_okvB)")
+
+def test_deep_parse():
+    n = parse("~" * 100000 + "A")
+    depth = 0
+    while isinstance(n, NotNode):
+        n = n.l
+        depth += 1
+    assert_equals(depth, 100000)
+    parse("(A>" * 5000 + "B" + ")" * 5000)
+
+def test_single_operand_brackets():
+    assert_raises(IOError, parse, "(A)")
+    assert_raises(IOError, parse, "(A)B)")
+
+def test_let():
+    n = parse("let P = (A&B) in ((P>C)&(P v D))")
+    assert_equals(n, parse("(((A&B)>C)&((A&B)vD))"))
+    assert n.l.l is n.r.l
+    assert_equals(parse("let P = A in let Q = (PvB) in let P = ~Q in (P&Q)"), parse("(~(AvB)&(AvB))"))
+    # A name is only defined in the body, after which it's an atom again.
+    assert_equals(parse("(let P = A in (P&B) v P)"), parse("((A&B)vP)"))
+    assert_equals(parse("let P = ~P in P"), parse("~P"))
+    for bad in ["let P in A", "let P = A", "let P = A P", "let = A in A", "(A&let)", "let in = A in A", "in"]:
+        assert_raises(IOError, parse, bad)
+
+def test_let_sharing():
+    # 40 levels of doubling: the text is small but the tree it stands for has 2**40 leaves.
+    n = parse("let P0 = A in " + "".join("let P%d = (P%d & ~P%d) in " % (i + 1, i, i) for i in range(40)) + "P40")
+    assert_equals(sum(1 for node in postorder(n)), 81)
+
+def test_read_definitions():
+    lines = ["# A half adder", "S = (AxB)", "", "C = (A&B)", "(S>~C)"]
+    assert_equals(read_definitions(lines), "let S = (AxB) in let C = (A&B) in (S>~C)")
+    assert_equals(parse(read_definitions(lines)), parse("((AxB)>~(A&B))"))
+    assert_equals(read_definitions(["P = (A=B)", "P"]), "let P = (A=B) in P")
+    assert_raises(IOError, read_definitions, ["P = A"])
+    assert_raises(IOError, read_definitions, ["A", "B"])
+
+def test_parse_cache():
+    tree = parse("(A&(BvC))")
+    assert parse("(A&(BvC))") is tree
+    assert_raises(IOError, parse, "(A&")
+    assert "(A&" not in _cache
@@ -1,7 +1,9 @@
 from parsing import parse
 import truthtable
+import bdd
+import stats
 from nodes import AndNode, IfNode, AtomNode
-from nose.tools import assert_is_instance
+from nose.tools import assert_is_instance, assert_equal
 
 def serialize_argument_trees(expressions):
     """
@@ -13,15 +15,95 @@ def serialize_argument_trees(expressions):
     argument = IfNode(premises, expressions[-1])
     return argument
 
-def valid_proof(expressions):
+def valid_proof(expressions, engine="table", jobs=1):
     """
     Takes in a list of parse tree expressions [A, B, C, ... Z].
     Outputs one parse tree ((A&B&C&...) -> Z).
     Last expression is the conclusion, all others are premises.
+    Engine is one of truthtable.ENGINES; jobs is how many processes the table engine may use.
     """
     trees = [parse(e) for e in expressions]
     argument = serialize_argument_trees(trees)
-    return all([row.value for row in truthtable.from_tree(argument)])
+    with stats.phase("proof"):
+        return truthtable.tautology(argument, engine, jobs)
+
+class ProofChecker(object):
+    """
+    Checks an argument incrementally, as its lines are entered.
+    Keeps the set of assignments satisfying every premise so far, narrowing it with each
+    premise, so checking a conclusion against the premises is a single intersection.
+    The set is a truth table bitset (engine "table") or a decision diagram (engine "bdd").
+    """
+
+    ENGINES = ["table", "bdd"]
+
+    def __init__(self, engine="table", jobs=1):
+        if engine not in self.ENGINES:
+            raise ValueError("ProofChecker engine must be one of %s." % ", ".join(self.ENGINES))
+        self.engine = engine
+        self.jobs = jobs
+        self.atoms = []
+        self.premises = []
+        if engine == "bdd":
+            self._manager = bdd.BDD()
+            self._models = bdd.TRUE
+        else:
+            # A table over no atoms has one row, and with no premises yet it's a model.
+            self._models = 1
+        self._last = None
+
+    def _function(self, exp):
+        """Parses an expression and returns its truth table bitset or BDD node over self.atoms."""
+        if self._last is not None and self._last[0] == exp and self._last[2] == len(self.atoms):
+            return self._last[1]
+        tree = parse(exp)
+        if self.engine == "bdd":
+            function = self._manager.from_tree(tree)
+        else:
+            new_atoms = sorted(tree.atoms() - set(self.atoms))
+            if new_atoms:
+                self._models = self._extend(self._models, len(self.atoms), len(self.atoms) + len(new_atoms))
+                self.atoms.extend(new_atoms)
+            function = truthtable.table_bits(tree, self.atoms, self.jobs)
+        self._last = (exp, function, len(self.atoms))
+        return function
+
+    @staticmethod
+    def _extend(bits, old, new):
+        """Widens a table from `old` atoms to `new`: rows for each new atom repeat the existing rows."""
+        for k in xrange(old, new):
+            bits |= bits << (1 << k)
+        return bits
+
+    def premise(self, exp):
+        """Adds a premise. Returns whether the premises so far are still consistent."""
+        function = self._function(exp)
+        if stats.enabled:
+            stats.count("premises")
+        if self.engine == "bdd":
+            self._models = self._manager.conjoin(self._models, function)
+        else:
+            self._models &= function
+        self.premises.append(exp)
+        return self.consistent
+
+    @property
+    def consistent(self):
+        return self._models != (bdd.FALSE if self.engine == "bdd" else 0)
+
+    def entails(self, exp):
+        """Checks whether an expression follows from the premises so far."""
+        function = self._function(exp)
+        if self.engine == "bdd":
+            return self._manager.conjoin(self._models, self._manager.negate(function)) == bdd.FALSE
+        return self._models & ~function == 0
+
+    def consistent_with(self, exp):
+        """Checks whether an expression can hold together with the premises so far."""
+        function = self._function(exp)
+        if self.engine == "bdd":
+            return self._manager.conjoin(self._models, function) != bdd.FALSE
+        return self._models & function != 0
 
 def test_serialize_argtree_simple():
     expressions = ["A", "(A>B)", "B"]
@@ -42,3 +124,37 @@ def test_valid_proof():
 def test_invalid_proof():
     expressions = ["A", "(AxB)", "B"]
     assert not valid_proof(expressions)
+
+def test_proof_engines():
+    for engine in truthtable.ENGINES:
+        assert valid_proof(["(A>B)", "(B>C)", "(A>C)"], engine)
+        assert not valid_proof(["(A>B)", "(B>C)", "(C>A)"], engine)
+
+def test_checker_agrees_with_valid_proof():
+    arguments = [["A", "(A>B)", "B"], ["A", "(AxB)", "B"], ["(A>B)", "(B>C)", "(A>C)"],
+                 ["(A>B)", "(B>C)", "(C>A)"], ["(PvQ)", "~P", "Q"], ["(P&Q)", "R"]]
+    for engine in ProofChecker.ENGINES:
+        for expressions in arguments:
+            checker = ProofChecker(engine)
+            for premise in expressions[:-1]:
+                checker.premise(premise)
+            assert_equal(checker.entails(expressions[-1]), valid_proof(expressions))
+
+def test_checker_inconsistent():
+    for engine in ProofChecker.ENGINES:
+        checker = ProofChecker(engine)
+        assert checker.premise("(A>B)")
+        assert checker.consistent_with("A")
+        assert checker.premise("A")
+        assert not checker.consistent_with("~B")
+        assert not checker.premise("(~B&C)")
+        assert checker.entails("D")
+
+def test_checker_extend():
+    assert_equal(ProofChecker._extend(0b0001, 2, 3), 0b00010001)
+    checker = ProofChecker()
+    checker.premise("(A&B)")
+    checker.premise("(C=A)")
+    assert_equal(checker.atoms, ["A", "B", "C"])
+    assert checker.entails("(C&B)")
+    assert not checker.entails("D")
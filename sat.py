@@ -0,0 +1,500 @@
+"""A conflict-driven clause-learning SAT solver.
+
+Deciding satisfiability by enumerating a truth table is exponential even when a single
+assignment would settle the question. The solver here searches for one instead, using
+two watched literals per clause, VSIDS branching, first-UIP clause learning, phase
+saving and Luby restarts.
+
+Clauses use DIMACS-style literals: variables are numbered from 1, and -v is the negation of v."""
+import random
+import normal_forms
+import stats
+from nodes import NotNode
+from parsing import parse
+from nose.tools import assert_equal, assert_true, assert_false
+
+# Conflicts before the first restart; later restarts follow the Luby sequence.
+RESTART_BASE = 100
+VAR_DECAY = 0.95
+# Learnt clauses kept, as a fraction of the problem clauses, before the longest are dropped.
+LEARNT_RATIO = 0.5
+LEARNT_GROWTH = 1.1
+
+def luby(i):
+    """Returns the i-th element (from 1) of the Luby sequence 1, 1, 2, 1, 1, 2, 4, ..."""
+    k = 1
+    while (1 << k) - 1 < i:
+        k += 1
+    while (1 << k) - 1 != i:
+        i -= (1 << (k - 1)) - 1
+        k = 1
+        while (1 << k) - 1 < i:
+            k += 1
+    return 1 << (k - 1)
+
+class VarHeap(object):
+    """A binary max-heap of variables ordered by activity, which can update a variable in place."""
+
+    def __init__(self, activity):
+        self.activity = activity
+        self.heap = []
+        self.position = {}
+
+    def __contains__(self, var):
+        return var in self.position
+
+    def __len__(self):
+        return len(self.heap)
+
+    def push(self, var):
+        if var not in self.position:
+            self.position[var] = len(self.heap)
+            self.heap.append(var)
+        self.increase(var)
+
+    def increase(self, var):
+        """Restores heap order after var's activity went up."""
+        heap, position, activity = self.heap, self.position, self.activity
+        i = position[var]
+        while i > 0:
+            parent = (i - 1) >> 1
+            if activity[heap[parent]] >= activity[var]:
+                break
+            heap[i] = heap[parent]
+            position[heap[i]] = i
+            i = parent
+        heap[i] = var
+        position[var] = i
+
+    def pop(self):
+        heap, position, activity = self.heap, self.position, self.activity
+        top = heap[0]
+        del position[top]
+        last = heap.pop()
+        if heap:
+            i, n = 0, len(heap)
+            while True:
+                child = 2 * i + 1
+                if child >= n:
+                    break
+                if child + 1 < n and activity[heap[child + 1]] > activity[heap[child]]:
+                    child += 1
+                if activity[heap[child]] <= activity[last]:
+                    break
+                heap[i] = heap[child]
+                position[heap[i]] = i
+                i = child
+            heap[i] = last
+            position[last] = i
+        return top
+
+class Solver(object):
+    """A CDCL solver over clauses of DIMACS literals.
+
+    Internally literal v is 2*v and literal -v is 2*v+1, so lit ^ 1 negates a literal."""
+
+    def __init__(self, num_vars=0):
+        self.num_vars = 0
+        self.clauses = []
+        self.learnts = []
+        self.watches = [[], []]
+        self.values = [None, None]      # per internal literal: True, False or None
+        self.level = [0]
+        self.reason = [None]
+        self.activity = [0.0]
+        self.polarity = [False]
+        self.trail = []
+        self.trail_lim = []
+        self.qhead = 0
+        self.order = VarHeap(self.activity)
+        self.increment = 1.0
+        self.ok = True
+        self.conflicts = 0
+        self.assumptions = []
+        for i in xrange(num_vars):
+            self.new_var()
+
+    def new_var(self):
+        """Adds a variable and returns its (DIMACS) number."""
+        self.num_vars += 1
+        self.watches.extend([[], []])
+        self.values.extend([None, None])
+        self.level.append(0)
+        self.reason.append(None)
+        self.activity.append(0.0)
+        self.polarity.append(False)
+        self.order.push(self.num_vars)
+        return self.num_vars
+
+    def add_clause(self, literals):
+        """Adds a clause (an iterable of DIMACS literals). Returns False if the solver became unsatisfiable."""
+        if not self.ok:
+            return False
+        self._cancel_until(0)
+        clause = set()
+        for literal in literals:
+            var = abs(literal)
+            while var > self.num_vars:
+                self.new_var()
+            lit = 2 * var + (literal < 0)
+            if lit ^ 1 in clause or self.values[lit] is True:
+                return True
+            if self.values[lit] is None:
+                clause.add(lit)
+        clause = list(clause)
+        if not clause:
+            self.ok = False
+        elif len(clause) == 1:
+            self._enqueue(clause[0], None)
+            self.ok = self._propagate() is None
+        else:
+            self._attach(clause)
+            self.clauses.append(clause)
+        return self.ok
+
+    def solve(self, assumptions=()):
+        """Searches for a satisfying assignment. Returns True if one exists, False otherwise.
+
+        Assumptions (DIMACS literals) must hold too, but only for this call: they're the first
+        decisions, so a False caused by them leaves the solver usable."""
+        if not self.ok:
+            return False
+        self._cancel_until(0)
+        self.assumptions = []
+        for literal in assumptions:
+            while abs(literal) > self.num_vars:
+                self.new_var()
+            self.assumptions.append(2 * abs(literal) + (literal < 0))
+        restarts = 0
+        max_learnts = max(len(self.clauses) * LEARNT_RATIO, 1000)
+        while True:
+            restarts += 1
+            status = self._search(luby(restarts) * RESTART_BASE)
+            if status is not None:
+                return status
+            if len(self.learnts) > max_learnts:
+                self._reduce_learnts()
+            max_learnts *= LEARNT_GROWTH
+
+    def value(self, var):
+        """Returns a variable's value in the current assignment (None if unassigned)."""
+        return self.values[2 * var]
+
+    def model(self):
+        """Returns the satisfying assignment found by solve(), as a dict of var -> bool."""
+        return dict((var, self.values[2 * var] is True) for var in xrange(1, self.num_vars + 1))
+
+    def _attach(self, clause):
+        self.watches[clause[0]].append(clause)
+        self.watches[clause[1]].append(clause)
+
+    def _enqueue(self, lit, reason):
+        var = lit >> 1
+        self.values[lit] = True
+        self.values[lit ^ 1] = False
+        self.level[var] = len(self.trail_lim)
+        self.reason[var] = reason
+        self.trail.append(lit)
+
+    def _propagate(self):
+        """Propagates all enqueued assignments. Returns a conflicting clause, or None."""
+        values, watches, trail = self.values, self.watches, self.trail
+        while self.qhead < len(trail):
+            false_lit = trail[self.qhead] ^ 1
+            self.qhead += 1
+            watching = watches[false_lit]
+            # Clauses that keep watching false_lit are compacted to the front of the list.
+            i = j = 0
+            n = len(watching)
+            while i < n:
+                clause = watching[i]
+                i += 1
+                first = clause[0]
+                if first == false_lit:
+                    first = clause[0] = clause[1]
+                    clause[1] = false_lit
+                if values[first] is True:
+                    watching[j] = clause
+                    j += 1
+                    continue
+                for k in xrange(2, len(clause)):
+                    lit = clause[k]
+                    if values[lit] is not False:
+                        clause[1] = lit
+                        clause[k] = false_lit
+                        watches[lit].append(clause)
+                        break
+                else:
+                    watching[j] = clause
+                    j += 1
+                    if values[first] is False:
+                        while i < n:
+                            watching[j] = watching[i]
+                            i += 1
+                            j += 1
+                        del watching[j:]
+                        self.qhead = len(trail)
+                        return clause
+                    self._enqueue(first, clause)
+            del watching[j:]
+        return None
+
+    def _bump(self, var):
+        activity = self.activity
+        activity[var] += self.increment
+        if activity[var] > 1e100:
+            # Rescaling keeps the order, so the heap stays valid.
+            for v in xrange(len(activity)):
+                activity[v] *= 1e-100
+            self.increment *= 1e-100
+        if var in self.order:
+            self.order.increase(var)
+
+    def _analyze(self, conflict):
+        """First-UIP conflict analysis. Returns the learnt clause and the level to backjump to."""
+        seen = set()
+        learnt = [None]
+        current = len(self.trail_lim)
+        counter = 0
+        lit = None
+        index = len(self.trail) - 1
+        clause = conflict
+        while True:
+            for q in (clause if lit is None else clause[1:]):
+                var = q >> 1
+                if var not in seen and self.level[var] > 0:
+                    seen.add(var)
+                    self._bump(var)
+                    if self.level[var] == current:
+                        counter += 1
+                    else:
+                        learnt.append(q)
+            while self.trail[index] >> 1 not in seen:
+                index -= 1
+            lit = self.trail[index]
+            index -= 1
+            clause = self.reason[lit >> 1]
+            counter -= 1
+            if counter == 0:
+                break
+        learnt[0] = lit ^ 1
+
+        # Drop literals implied by the rest of the clause.
+        learnt = [learnt[0]] + [q for q in learnt[1:] if not self._redundant(q, seen)]
+
+        backjump = 0
+        if len(learnt) > 1:
+            best = max(xrange(1, len(learnt)), key=lambda k: self.level[learnt[k] >> 1])
+            learnt[1], learnt[best] = learnt[best], learnt[1]
+            backjump = self.level[learnt[1] >> 1]
+        return learnt, backjump
+
+    def _redundant(self, lit, seen):
+        reason = self.reason[lit >> 1]
+        if reason is None:
+            return False
+        return all(q >> 1 in seen or self.level[q >> 1] == 0 for q in reason[1:])
+
+    def _reduce_learnts(self):
+        """Forgets the longer half of the learnt clauses. Only called at decision level 0."""
+        self.learnts.sort(key=len)
+        keep = len(self.learnts) // 2
+        dropped = set(id(clause) for clause in self.learnts[keep:] if len(clause) > 2)
+        self.learnts = [clause for clause in self.learnts if id(clause) not in dropped]
+        self.watches = [[clause for clause in watching if id(clause) not in dropped] for watching in self.watches]
+
+    def _cancel_until(self, level):
+        if len(self.trail_lim) > level:
+            start = self.trail_lim[level]
+            for lit in self.trail[start:]:
+                var = lit >> 1
+                self.polarity[var] = lit & 1 == 0
+                self.values[lit] = self.values[lit ^ 1] = None
+                self.reason[var] = None
+                self.order.push(var)
+            del self.trail[start:]
+            del self.trail_lim[level:]
+            self.qhead = len(self.trail)
+
+    def _pick_branch(self):
+        while self.order:
+            var = self.order.pop()
+            if self.values[2 * var] is None:
+                return 2 * var + (not self.polarity[var])
+        return None
+
+    def _search(self, max_conflicts):
+        """Runs CDCL until a result or max_conflicts conflicts. Returns True, False, or None to restart."""
+        conflicts = 0
+        while True:
+            conflict = self._propagate()
+            if conflict is not None:
+                self.conflicts += 1
+                conflicts += 1
+                if not self.trail_lim:
+                    self.ok = False
+                    return False
+                learnt, backjump = self._analyze(conflict)
+                self._cancel_until(backjump)
+                if len(learnt) == 1:
+                    self._enqueue(learnt[0], None)
+                else:
+                    self._attach(learnt)
+                    self.learnts.append(learnt)
+                    self._enqueue(learnt[0], learnt)
+                self.increment /= VAR_DECAY
+            elif conflicts >= max_conflicts:
+                self._cancel_until(0)
+                return None
+            else:
+                # Assumptions already true get an empty decision level, to keep one per assumption.
+                lit = None
+                while lit is None and len(self.trail_lim) < len(self.assumptions):
+                    lit = self.assumptions[len(self.trail_lim)]
+                    if self.values[lit] is False:
+                        return False
+                    if self.values[lit] is True:
+                        self.trail_lim.append(len(self.trail))
+                        lit = None
+                if lit is None:
+                    lit = self._pick_branch()
+                if lit is None:
+                    return True
+                self.trail_lim.append(len(self.trail))
+                self._enqueue(lit, None)
+
+def solve(tree):
+    """Finds a model of a parse tree. Returns a dict of atom -> bool, or None if it's unsatisfiable."""
+    clauses, variables = normal_forms.tseitin(tree)
+    solver = Solver()
+    for clause in clauses:
+        solver.add_clause(clause)
+    with stats.phase("sat"):
+        found = solver.solve()
+    if stats.enabled:
+        stats.count("sat_conflicts", solver.conflicts)
+    if not found:
+        return None
+    return dict((atom, solver.value(var) is True) for atom, var in variables.items())
+
+def first_model(tree, atoms):
+    """Finds the model of a parse tree that comes first in its truth table over the atoms, which
+    must include the tree's. Returns a dict of atom -> bool, or None if it's unsatisfiable.
+
+    Rows count up from all atoms true, the first atom changing fastest, so the atoms are
+    settled last to first, each true unless that leaves no model."""
+    clauses, variables = normal_forms.tseitin(tree)
+    solver = Solver()
+    for clause in clauses:
+        solver.add_clause(clause)
+    with stats.phase("sat"):
+        if not solver.solve():
+            return None
+        model = solver.model()
+        settled = []
+        for atom in reversed(atoms):
+            var = variables.get(atom)
+            if var is None:
+                continue
+            if not model[var] and solver.solve(settled + [var]):
+                model = solver.model()
+            settled.append(var if model[var] else -var)
+    if stats.enabled:
+        stats.count("sat_conflicts", solver.conflicts)
+    return dict((atom, atom not in variables or model[variables[atom]]) for atom in atoms)
+
+def satisfiable(tree):
+    return solve(tree) is not None
+
+def counterexample(tree):
+    """Finds a model falsifying a parse tree. Returns a dict of atom -> bool, or None if it's a tautology."""
+    return solve(NotNode(tree))
+
+def tautology(tree):
+    return counterexample(tree) is None
+
+# Tests
+
+def brute_force(clauses, num_vars):
+    for i in xrange(1 << num_vars):
+        if all(any((lit > 0) == bool(i >> (abs(lit) - 1) & 1) for lit in c) for c in clauses):
+            return True
+    return False
+
+def test_luby():
+    assert_equal([luby(i) for i in range(1, 16)], [1, 1, 2, 1, 1, 2, 4, 1, 1, 2, 1, 1, 2, 4, 8])
+
+def test_solver_simple():
+    solver = Solver()
+    solver.add_clause([1, 2])
+    solver.add_clause([-1, 2])
+    solver.add_clause([-2, 3])
+    assert_true(solver.solve())
+    model = solver.model()
+    assert model[2] and model[3]
+
+def test_solver_unsat():
+    solver = Solver()
+    for clause in [[1, 2], [-1, 2], [1, -2], [-1, -2]]:
+        solver.add_clause(clause)
+    assert_false(solver.solve())
+
+def test_solver_empty_clause():
+    solver = Solver()
+    assert_false(solver.add_clause([]))
+    assert_false(solver.solve())
+
+def test_pigeonhole():
+    import bench
+    for holes in range(1, 6):
+        solver = Solver()
+        for clause in bench.pigeonhole_clauses(holes):
+            solver.add_clause(clause)
+        assert_false(solver.solve())
+
+def test_random_3sat():
+    rng = random.Random(7)
+    for trial in range(60):
+        num_vars = 10
+        clauses = [[rng.choice([-1, 1]) * rng.randint(1, num_vars) for k in range(3)] for c in range(43)]
+        solver = Solver(num_vars)
+        for clause in clauses:
+            solver.add_clause(clause)
+        result = solver.solve()
+        assert_equal(result, brute_force(clauses, num_vars))
+        if result:
+            model = solver.model()
+            assert all(any(model[abs(lit)] == (lit > 0) for lit in c) for c in clauses)
+
+def test_solve_tree():
+    tree = parse("((A>B)&(B>C)&A)")
+    model = solve(tree)
+    assert tree.eval(model)
+    assert_equal(solve(parse("(A&~A)")), None)
+
+def test_assumptions():
+    solver = Solver()
+    for clause in [[1, 2], [-1, 3], [-2, 3]]:
+        solver.add_clause(clause)
+    assert_false(solver.solve([-3]))
+    assert_true(solver.solve([1, -2]))
+    assert_equal([solver.model()[var] for var in (1, 2, 3)], [True, False, True])
+    # A failed assumption doesn't make the clauses themselves unsatisfiable.
+    assert_true(solver.solve())
+    assert_false(solver.solve([-1, -2]))
+    assert_true(solver.solve([2]))
+
+def test_first_model():
+    tree = parse("((A&B&C)x(AvBvC))")
+    atoms = ["A", "B", "C", "D"]
+    # Row 0 has every atom true; the first model is row 1.
+    assert_equal(first_model(tree, atoms), {"A": False, "B": True, "C": True, "D": True})
+    assert_equal(first_model(parse("(~A&~C)"), atoms), {"A": False, "B": True, "C": False, "D": True})
+    assert_equal(first_model(parse("(A&~A)"), atoms), None)
+
+def test_tautology_and_counterexample():
+    assert tautology(parse("((A&(A>B))>B)"))
+    assert tautology(parse("((AxB)=~(A=B))"))
+    tree = parse("((A&(AxB))>B)")
+    assert not tautology(tree)
+    assert not tree.eval(counterexample(tree))
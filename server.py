@@ -0,0 +1,149 @@
+"""A long-running server answering batch jobs over a socket, so each query skips interpreter
+start-up and imports, and finds the parse and simplify caches already warm.
+
+The protocol is batch's: the client sends one job per line (JSON or tab-separated) and gets
+one JSON result per line, in order. A connection may send any number of jobs. Addresses are
+"host:port" for TCP, or a path for a Unix socket. See client.py for a client that imports
+nothing from carroll."""
+from __future__ import print_function
+import os
+import socket
+import threading
+import SocketServer
+import multiprocessing
+import json
+import batch
+import client
+from nose.tools import assert_equal
+
+DEFAULT_ADDRESS = client.DEFAULT_ADDRESS
+
+class _Handler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        # readline rather than iterating, which reads ahead and would leave a waiting client waiting.
+        line = self.rfile.readline()
+        while line:
+            if line.strip():
+                try:
+                    result = self.server.run_job(line)
+                except Exception as e:
+                    # Whatever went wrong, the job gets an answer and the connection lives on.
+                    result = json.dumps({"error": "%s: %s" % (type(e).__name__, e)})
+                self.wfile.write(result + "\n")
+                self.wfile.flush()
+            line = self.rfile.readline()
+
+class _Jobs:
+    """Runs jobs in the server process (one at a time, sharing its caches) or in a pool of workers."""
+
+    def setup_jobs(self, jobs):
+        self.pool = multiprocessing.Pool(jobs) if jobs > 1 else None
+        self.lock = threading.Lock()
+
+    def run_job(self, line):
+        if self.pool is not None:
+            return self.pool.apply(batch.run_job, (line,))
+        with self.lock:
+            return batch.run_job(line)
+
+    def server_close(self):
+        SocketServer.BaseServer.server_close(self)
+        if self.pool is not None:
+            self.pool.terminate()
+
+class TCPServer(_Jobs, SocketServer.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class UnixServer(_Jobs, SocketServer.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def server_close(self):
+        _Jobs.server_close(self)
+        os.remove(self.server_address)
+
+def make_server(address=DEFAULT_ADDRESS, jobs=1):
+    """Binds a server to an address, running jobs in `jobs` worker processes if more than one."""
+    family, target = client.parse_address(address)
+    server = (UnixServer if family == socket.AF_UNIX else TCPServer)(target, _Handler)
+    server.setup_jobs(jobs)
+    return server
+
+def serve(address=DEFAULT_ADDRESS, jobs=1):
+    """Answers jobs until interrupted."""
+    server = make_server(address, jobs)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+# Tests
+
+def _serving(address, jobs=1):
+    server = make_server(address, jobs)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+def _stop(server):
+    server.shutdown()
+    server.server_close()
+
+def test_tcp_server():
+    server = _serving("127.0.0.1:0")
+    try:
+        address = "%s:%d" % server.server_address
+        lines = ['{"op": "equiv", "args": ["(AvB)", "~(~A&~B)"], "id": 1}', "dnf\t(A&B)", "", "frobnicate\tA"]
+        results = [json.loads(result) for result in client.query(address, lines)]
+        assert_equal(results[:2], [{"id": 1, "op": "equiv", "result": True}, {"op": "dnf", "result": "((A & B))"}])
+        assert "error" in results[2]
+        assert_equal(json.loads(client.query(address, ["tautology\t(Av~A)"])[0])["result"], True)
+    finally:
+        _stop(server)
+
+def test_bad_jobs():
+    server = _serving("127.0.0.1:0")
+    run_job = server.run_job
+    def failing(line):
+        if line.startswith("fail"):
+            raise RuntimeError("worker died")
+        return run_job(line)
+    server.run_job = failing
+    try:
+        address = "%s:%d" % server.server_address
+        results = [json.loads(result) for result in client.query(address, ['{"op": "satisfiable", "args": [5]}', "fail", "dnf\t(A&B)"])]
+        assert "error" in results[0]
+        assert_equal(results[1:], [{"error": "RuntimeError: worker died"}, {"op": "dnf", "result": "((A & B))"}])
+    finally:
+        _stop(server)
+
+def test_many_large_jobs():
+    # Far more replies than the sockets' buffers hold, so the client must read while it sends.
+    server = _serving("127.0.0.1:0")
+    try:
+        address = "%s:%d" % server.server_address
+        lines = ["table\t(A&B&C&D&E&F&G&H&I&J&K&L&M)" + " " * 8000] * 2000
+        results = client.query(address, lines)
+        assert_equal(len(results), 2000)
+        assert_equal(json.loads(results[-1])["result"]["values"], "1" + "0" * 8191)
+    finally:
+        _stop(server)
+
+def test_unix_server():
+    import tempfile
+    import shutil
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "carroll.sock")
+        server = _serving(path)
+        try:
+            assert_equal(json.loads(client.query(path, ["proof\t(A>B)\tA\tB"])[0])["result"], True)
+        finally:
+            _stop(server)
+        assert not os.path.exists(path)
+    finally:
+        shutil.rmtree(directory)
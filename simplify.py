@@ -0,0 +1,329 @@
+"""Simplification of parse trees by rewriting, before any (exponential) work is done on them.
+
+simplify() rewrites a tree bottom-up, to a fixpoint at every node: nested ANDs and ORs are
+flattened, duplicate operands dropped, complementary ones (A and ~A) collapsed, double
+negations removed, absorbed terms (A v (A & B)) dropped and constants propagated. Results
+are cached per node, and nodes are shared, so every distinct subtree is simplified only once.
+
+Simplified trees may collapse to a constant, which is returned as True or False."""
+import weakref
+import parsing
+import symbols
+from nodes import Node, AtomNode, NotNode, AndNode, OrNode, XorNode, IfNode, IffNode, LogicError
+from nose.tools import assert_equal, assert_raises
+
+_cache = weakref.WeakKeyDictionary()
+_keys = weakref.WeakKeyDictionary()
+_ordered = weakref.WeakKeyDictionary()
+# Stands in the caches for a node that is its own result: a weak key's value mustn't refer to
+# the key, or the entry (and the node's whole subtree) would never be freed.
+_SAME = object()
+# Absorption between compound operands (A&B absorbing A&B&C) compares every pair of
+# operands, so it's only tried for nodes with at most this many.
+ABSORPTION_LIMIT = 256
+_ORDER = {AtomNode: 0, NotNode: 1, AndNode: 2, OrNode: 3, XorNode: 4, IfNode: 5, IffNode: 6}
+
+def fold(cls, children):
+    """Builds a node from children that may include the constants True and False,
+    folding the constants away. Returns a Node, True or False."""
+    trues = any(child is True for child in children)
+    falses = any(child is False for child in children)
+    rest = [child for child in children if child is not True and child is not False]
+    if cls is AndNode:
+        if falses:
+            return False
+        return True if not rest else rest[0] if len(rest) == 1 else AndNode(*rest)
+    if cls is OrNode:
+        if trues:
+            return True
+        return False if not rest else rest[0] if len(rest) == 1 else OrNode(*rest)
+    if cls is NotNode:
+        if len(children) != 1:
+            raise LogicError("NOT is undefined for multiple children.")
+        return not children[0] if not rest else NotNode(rest[0])
+    if cls is IfNode:
+        if len(children) != 2:
+            raise LogicError("IF is only defined for exactly two children.")
+        left, right = children
+        if left is False or right is True:
+            return True
+        if left is True:
+            return right
+        if right is False:
+            return NotNode(left)
+        return IfNode(left, right)
+    # XOR is "some but not all", IFF is "none or all".
+    if trues and falses:
+        return cls is XorNode
+    if trues:
+        every = fold(AndNode, rest)
+        return fold(NotNode, [every]) if cls is XorNode else every
+    if falses:
+        some = fold(OrNode, rest)
+        return some if cls is XorNode else fold(NotNode, [some])
+    return cls(*rest)
+
+def condition(tree, assignment):
+    """Substitutes truth values for some atoms (a dict of atom -> bool) and simplifies.
+
+    Returns a Node, or True or False if the tree's value is settled. Subtrees without any of
+    the assigned atoms are reused as they are."""
+    done = {}
+    stack = [tree]
+    while stack:
+        node = stack[-1]
+        if id(node) in done:
+            stack.pop()
+            continue
+        if isinstance(node, AtomNode):
+            done[id(node)] = assignment.get(node.l, node)
+        elif node.atoms().isdisjoint(assignment):
+            done[id(node)] = node
+        else:
+            pending = [child for child in node.children if id(child) not in done]
+            if pending:
+                stack.extend(pending)
+                continue
+            done[id(node)] = fold(type(node), [done[id(child)] for child in node.children])
+        stack.pop()
+    return done[id(tree)]
+
+def _check_arity(cls, children):
+    if cls is NotNode and len(children) != 1:
+        raise LogicError("NOT is undefined for multiple children.")
+    if cls is IfNode and len(children) != 2:
+        raise LogicError("IF is only defined for exactly two children.")
+
+def clear_caches():
+    """Forgets every simplified tree, ordered tree and sort key."""
+    global _cache, _keys, _ordered
+    # New dicts rather than clear(): clearing frees results that may hold the last reference
+    # to other keys, whose removal callbacks would then find their entries already gone.
+    _cache = weakref.WeakKeyDictionary()
+    _keys = weakref.WeakKeyDictionary()
+    _ordered = weakref.WeakKeyDictionary()
+
+def _memoized(memo, node):
+    value = memo[node]
+    return node if value is _SAME else value
+
+def _bottom_up(tree, memo, compute):
+    """Fills in memo[node] = compute(node) for every node of the tree, children first, and
+    returns the tree's. Doesn't descend below nodes already in memo, so extending a memoized
+    tree is cheap."""
+    stack = [tree]
+    while stack:
+        node = stack[-1]
+        if node in memo:
+            stack.pop()
+            continue
+        if not isinstance(node, AtomNode):
+            missing = [child for child in node.children if child not in memo]
+            if missing:
+                stack.extend(missing)
+                continue
+        value = compute(node)
+        memo[node] = _SAME if value is node else value
+        stack.pop()
+    return _memoized(memo, tree)
+
+def _key(node):
+    if isinstance(node, AtomNode):
+        return (0, node.l)
+    return (_ORDER[type(node)],) + tuple(_keys[child] for child in node.children)
+
+def sort_key(node):
+    """A key putting nodes in a fixed order: atoms by name, then by operator and operands.
+    Keys share their operands' keys, so they take memory in proportion to the tree."""
+    key = _keys.get(node)
+    return key if key is not None else _bottom_up(node, _keys, _key)
+
+def _order_operands(node):
+    if isinstance(node, AtomNode):
+        return node
+    children = [_memoized(_ordered, child) for child in node.children]
+    if not isinstance(node, (NotNode, IfNode)):
+        children.sort(key=sort_key)
+    return type(node)(*children)
+
+def ordered(tree):
+    """The same tree with the operands of every commutative operator in sort_key order.
+    Unlike simplify, it keeps every node, so trees differing only in operand order give the same tree."""
+    return _bottom_up(tree, _ordered, _order_operands)
+
+def _absorbed(operands, dual):
+    """Operands of an AND (or OR) made redundant by another operand: a dual OR (or AND)
+    whose operands include all of the other's."""
+    if not any(isinstance(op, dual) for op in operands):
+        return ()
+    parts = [frozenset(op.children) if isinstance(op, dual) else frozenset([op]) for op in operands]
+    absorbed = set()
+    present = set(operands)
+    for i, op in enumerate(operands):
+        if isinstance(op, dual):
+            if len(operands) <= ABSORPTION_LIMIT:
+                if any(j != i and j not in absorbed and parts[j] < parts[i] for j in xrange(len(operands))):
+                    absorbed.add(i)
+            elif any(child in present for child in op.children):
+                absorbed.add(i)
+    return absorbed
+
+def _complement_of(node, others, cls=None):
+    """Whether node is the negation of one of the others, or (when cls is the AND or OR the others
+    are operands of) the negation of a cls node whose operands are all among them."""
+    if not isinstance(node, NotNode):
+        return False
+    negated = node.l
+    return negated in others or (type(negated) is cls and all(child in others for child in negated.children))
+
+def _rewrite(cls, children):
+    """Applies the rules once to a node made of simplified children (or constants)."""
+    _check_arity(cls, children)
+    if cls is NotNode:
+        child = children[0]
+        if isinstance(child, NotNode):
+            return child.l
+        return fold(cls, children)
+    if cls is IfNode:
+        left, right = children
+        if left is right:
+            return True
+        # (A > ~A) is ~A, and (~A > A) is A.
+        if _complement_of(right, [left]) or _complement_of(left, [right]):
+            return right
+        return fold(cls, children)
+
+    operands = []
+    for child in children:
+        if cls in (AndNode, OrNode) and type(child) is cls:
+            operands.extend(child.children)
+        else:
+            operands.append(child)
+    unique, seen = [], set()
+    for operand in operands:
+        if operand is True or operand is False or operand not in seen:
+            unique.append(operand)
+            seen.add(operand)
+    # Every operator here is commutative, so operands go in a fixed order.
+    constants = [operand for operand in unique if operand is True or operand is False]
+    unique = constants + sorted((operand for operand in unique if not (operand is True or operand is False)), key=sort_key)
+    if any(_complement_of(operand, seen, cls if cls in (AndNode, OrNode) else None) for operand in unique):
+        # Some operand is true and some false: AND fails, OR and XOR hold, IFF fails.
+        return cls in (OrNode, XorNode)
+    if cls is AndNode or cls is OrNode:
+        # Absorption: A & (A v B) is A, and A v (A & B) is A.
+        operands = [operand for operand in unique if not (operand is True or operand is False)]
+        absorbed = _absorbed(operands, OrNode if cls is AndNode else AndNode)
+        unique = constants + [operand for i, operand in enumerate(operands) if i not in absorbed]
+    elif len(unique) == 1:
+        # Every operand is the same: XOR ("some but not all") fails, IFF ("none or all") holds.
+        return cls is IffNode
+    return fold(cls, unique)
+
+def _simplify_node(node):
+    if isinstance(node, AtomNode):
+        return node
+    result = _rewrite(type(node), [_memoized(_cache, child) for child in node.children])
+    if type(result) is type(node) and type(node) in (AndNode, OrNode):
+        # One pass over simplified operands leaves an AND or OR with nothing more to give.
+        _cache[result] = _SAME
+    elif isinstance(result, Node) and result is not node:
+        # Rewriting made a new node: its children are done, but it may have more to give.
+        result = simplify(result)
+    return result
+
+def simplify(tree):
+    """Returns an equivalent tree that's no bigger, or True or False if the tree is constant."""
+    return _bottom_up(tree, _cache, _simplify_node)
+
+def simplify_expression(exp):
+    """Simplifies a proposition string. Constant results are written as (A & ~A) or (A v ~A)."""
+    tree = parsing.parse(exp)
+    result = simplify(tree)
+    if result is True or result is False:
+        first = min(tree.atoms())
+        return "(%s %s ~%s)" % (first, "v" if result else "&", first)
+    # Wffs shared through let (or in a tree given as it is) stay shared, rather than being written out at every use.
+    return symbols.to_string(result, shared=not isinstance(exp, basestring) or parsing.LET in parsing.tokenize(exp))
+
+# Tests
+
+def test_condition():
+    tree = parsing.parse("((A&B)v(CxDxE)v~(F=G))")
+    assert_equal(condition(tree, {"A": True, "B": True}), True)
+    assert_equal(condition(tree, {"A": False, "E": False, "C": True}), True)
+    assert_equal(condition(tree, {"B": False, "F": True, "G": True}), parsing.parse("(CxDxE)"))
+    assert_equal(condition(parsing.parse("(A>B)"), {"B": False}), parsing.parse("~A"))
+    assert_equal(condition(parsing.parse("(A=B=C)"), {"A": True}), parsing.parse("(B&C)"))
+    assert_equal(condition(parsing.parse("(AxBxC)"), {"A": False}), parsing.parse("(BvC)"))
+
+
+def _check(exp, expected):
+    assert_equal(simplify_expression(exp), expected)
+
+def test_double_negation():
+    _check("~~A", "A")
+    _check("~~~(A&B)", "~(A & B)")
+    _check("~" * 10001 + "A", "~A")
+
+def test_flatten_and_duplicates():
+    _check("((A&B)&(C&(A&D)))", "(A & B & C & D)")
+    _check("((AvB)v(BvA))", "(A v B)")
+    _check("(AxA)", "(A & ~A)")
+    _check("(A=A=A)", "(A v ~A)")
+
+def test_complements():
+    _check("(A&B&~A)", "(A & ~A)")
+    _check("((AvB)v~(BvA)v~C)", "(A v ~A)")
+    _check("(C&(Av~A))", "C")
+    _check("(C&(A&~A))", "(A & ~A)")
+    _check("((AvB)x~(AvB)xC)", "(A v ~A)")
+
+def test_absorption():
+    _check("(A&(AvB))", "A")
+    _check("(Av(A&B)v(B&C))", "(A v (B & C))")
+    _check("((A&B)v(C&(A&B)&D))", "(A & B)")
+
+def test_operand_order():
+    _check("((BvA)&~(AvB))", "(A & ~A)")
+    _check("(C&B&(BvA))", "(B & C)")
+    assert sort_key(parsing.parse("A")) < sort_key(parsing.parse("B")) < sort_key(parsing.parse("~A"))
+
+def test_ordered():
+    assert_equal(ordered(parsing.parse("((CvB)&~(BxA)&(B>A))")), parsing.parse("(~(AxB)&(BvC)&(B>A))"))
+    assert_equal(ordered(parsing.parse("(A&A)")), parsing.parse("(A&A)"))
+
+def test_if():
+    _check("(A>A)", "(A v ~A)")
+    _check("(A>~A)", "~A")
+    _check("((A&~A)>B)", "(A v ~A)")
+    _check("((Bv~B)>(A&C))", "(A & C)")
+
+def test_simplify_preserves_function():
+    import truthtable
+    for exp in ["((A&B)v(A&(BvC))v~~(C&~C))", "((AxB)=(~A&(BvB)))", "((A>B)&(B>A)&(Av(A&C)))"]:
+        tree = parsing.parse(exp)
+        atoms = sorted(tree.atoms())
+        result = simplify(tree)
+        expected = truthtable.table_bits(tree, atoms)
+        if result is True or result is False:
+            assert_equal(expected, (1 << (1 << len(atoms))) - 1 if result else 0)
+        else:
+            assert_equal(truthtable.table_bits(result, atoms), expected)
+
+def test_caches_let_go():
+    import gc
+    import truthtable
+    gc.collect()
+    before = len(Node._interned)
+    for i in range(300):
+        tree = parsing._parse("((X%d&(Y%dvZ))v~~(W>X%d))" % (i, i, i))
+        ordered(tree)
+        truthtable.satisfiable(tree)
+    del tree
+    gc.collect()
+    assert_equal(len(Node._interned), before)
+    assert len(_cache) <= before
+
+def test_arity_errors():
+    assert_raises(LogicError, simplify, NotNode(parsing.parse("A"), parsing.parse("B")))
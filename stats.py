@@ -0,0 +1,97 @@
+"""Counters and phase timers for finding where a run spends its time.
+
+Instrumented code checks `stats.enabled` before recording anything, so when stats are off
+(the default) each call site costs one attribute lookup and nothing is stored."""
+from __future__ import print_function
+import json
+import time
+from StringIO import StringIO
+from nose.tools import assert_equal
+
+enabled = False
+counters = {}
+timers = {}
+
+def enable():
+    global enabled
+    enabled = True
+    reset()
+
+def disable():
+    global enabled
+    enabled = False
+
+def reset():
+    counters.clear()
+    timers.clear()
+
+def count(name, n=1):
+    counters[name] = counters.get(name, 0) + n
+
+class _Phase(object):
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+
+    def __exit__(self, *exc_info):
+        timers[self.name] = timers.get(self.name, 0.0) + time.time() - self.start
+
+class _NoPhase(object):
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+_NO_PHASE = _NoPhase()
+
+def phase(name):
+    """A context manager adding the time spent inside it to a named timer. Phases may nest."""
+    return _Phase(name) if enabled else _NO_PHASE
+
+def summary():
+    return {"counters": dict(counters), "seconds": dict(timers)}
+
+def report(stream, as_json=False):
+    """Writes the counters and timers, as aligned text or a JSON object."""
+    if as_json:
+        print(json.dumps(summary(), sort_keys=True), file=stream)
+        return
+    names = sorted(counters) + sorted(timers)
+    width = max([len(name) for name in names] + [0])
+    for name in sorted(counters):
+        print("%-*s  %d" % (width, name, counters[name]), file=stream)
+    for name in sorted(timers):
+        print("%-*s  %.6fs" % (width, name, timers[name]), file=stream)
+
+# Tests
+
+def test_disabled_records_nothing():
+    disable()
+    reset()
+    with phase("parse"):
+        pass
+    assert_equal(summary(), {"counters": {}, "seconds": {}})
+
+def test_enabled():
+    enable()
+    try:
+        count("rows", 4)
+        count("rows")
+        with phase("parse"):
+            with phase("tokenize"):
+                pass
+        assert_equal(counters, {"rows": 5})
+        assert_equal(sorted(timers), ["parse", "tokenize"])
+        out = StringIO()
+        report(out)
+        assert out.getvalue().startswith("rows      5\n")
+        out = StringIO()
+        report(out, as_json=True)
+        assert_equal(json.loads(out.getvalue())["counters"], {"rows": 5})
+    finally:
+        disable()
@@ -22,6 +22,61 @@ def meaning_of(symbol):
     """Returns the type of node this symbol represents."""
     return _symbols[symbol]
 
+# The symbol each operator is written with by to_string.
+_canonical = {nodes.AndNode: "&", nodes.OrNode: "v", nodes.XorNode: "x", nodes.IfNode: ">", nodes.IffNode: "="}
+
+def to_string(tree, shared=False):
+    """Writes a parse tree as an expression that parses back to the same tree.
+
+    Binary operators are spaced out, so lowercase atoms next to v and x stay separate. With
+    shared, each compound wff used more than once is written once, in a let naming it _1, _2,
+    and so on; otherwise it's written out in full every time, which for a DAG may be a lot."""
+    import parsing
+    names = {}
+    definitions = []
+    if shared:
+        uses = {}
+        for node in nodes.postorder(tree):
+            if not isinstance(node, nodes.AtomNode):
+                for child in node.children:
+                    uses[child] = uses.get(child, 0) + 1
+        atoms = tree.atoms()
+        for node in nodes.postorder(tree):
+            # Atoms and negated atoms are as short as any name for them.
+            literal = isinstance(node, nodes.AtomNode) or isinstance(node, nodes.NotNode) and isinstance(node.l, nodes.AtomNode)
+            if uses.get(node, 0) > 1 and not literal:
+                name = "_%d" % (len(names) + 1)
+                while name in atoms:
+                    name = "_" + name
+                definitions.append("%s %s = %s %s " % (parsing.LET, name, _write(node, names), parsing.IN))
+                names[node] = name
+    return "".join(definitions) + _write(tree, names)
+
+def _write(tree, names):
+    out = []
+    stack = [tree]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, basestring):
+            out.append(item)
+        elif item is not tree and item in names:
+            out.append(names[item])
+        elif isinstance(item, nodes.AtomNode):
+            out.append(item.l)
+        elif isinstance(item, nodes.NotNode):
+            out.append("~")
+            stack.append(item.l)
+        else:
+            separator = " %s " % _canonical[type(item)]
+            parts = ["("]
+            for i, child in enumerate(item.children):
+                if i:
+                    parts.append(separator)
+                parts.append(child)
+            parts.append(")")
+            stack.extend(reversed(parts))
+    return "".join(out)
+
 def test_symbol_mapping():
     assert meaning_of("A") == nodes.AtomNode
     assert meaning_of("B") == nodes.AtomNode
@@ -32,3 +87,19 @@ def test_symbol_mapping():
     assert meaning_of("(") == None
     assert meaning_of("d") == None
 
+
+def test_to_string():
+    import parsing
+    for exp in ["A", "~~A", "(A & (B v ~C))", "((A x B x C) = (D > E))", "(req_ok v x_1)"]:
+        assert to_string(parsing.parse(exp)) == exp
+    deep = "~" * 10000 + "(A & B)"
+    assert to_string(parsing.parse(deep)) == deep
+
+def test_to_string_shared():
+    import parsing
+    tree = parsing.parse("(((A&B)>C)&((A&B)>D)&~C&(~C v _1))")
+    assert to_string(tree, shared=True) == "let __1 = (A & B) in ((__1 > C) & (__1 > D) & ~C & (~C v _1))"
+    assert to_string(parsing.parse("(A&B)"), shared=True) == "(A & B)"
+    doubling = "let P0 = A in " + "".join("let P%d = (P%d x P%d) in " % (i + 1, i, i) for i in range(100)) + "P100"
+    text = to_string(parsing.parse(doubling), shared=True)
+    assert len(text) < 3000 and parsing.parse(text) is parsing.parse(doubling)
@@ -1,8 +1,26 @@
 from __future__ import print_function
 import parsing
-import symbols
-import string
-from nose.tools import assert_items_equal, assert_equal
+import codegen
+import sat
+import bdd
+import parallel
+import graycode
+import simplify
+import cache
+import stats
+import sys
+import random
+import binascii
+import ctypes
+import json
+import mmap
+import os
+import tempfile
+import shutil
+from StringIO import StringIO
+from nodes import Node, NotNode, IffNode, postorder
+from itertools import izip
+from nose.tools import assert_items_equal, assert_equal, assert_raises
 
 T = True
 F = False
@@ -20,37 +38,353 @@ class Row():
         return isinstance(other, Row) and self.model == other.model and self.value == other.value
 
 
-def print_truth_table(exp, verbose, output=True):
-    """Outputs the truth table for an expression to stdout."""
+# Truth tables are computed bit-parallel: row i of a table over atoms [a0, a1, ...]
+# assigns atom ak True iff bit k of i is 0, so each atom is a fixed bit pattern over
+# the rows and a whole table is one int. Tables over more than CHUNK_ATOMS atoms are
+# split into chunks of 2**CHUNK_ATOMS rows each, to bound the size of those ints.
+CHUNK_ATOMS = 20
+
+# Ways of deciding satisfiability, tautology and equivalence: enumerating the truth table,
+# searching with a SAT solver, or building a binary decision diagram.
+ENGINES = ["table", "sat", "bdd"]
+
+# Output formats for printed tables. Binary packs one bit per row, row i in bit i % 8 of byte i / 8.
+FORMATS = ["text", "csv", "tsv", "binary"]
+# Rows formatted before each write to the output stream.
+BUFFER_ROWS = 4096
+
+# The first line of a file saved by TruthTable. A JSON list of the atoms follows, then the packed rows.
+TABLE_MAGIC = "carroll truth table 1\n"
+
+# Random rows tried by equivalence checks before an exact check. The seed keeps answers reproducible.
+SIM_ROWS = 64
+SIM_SEED = 1865
+
+def print_truth_table(exp, verbose, output=True, engine="table", fmt="text", stream=None, jobs=1, gray=False):
+    """Outputs the truth table for an expression to stdout (or another stream), in one pass.
+
+    For formats other than text, the satisfiability summary goes to stderr instead.
+    With jobs > 1, large tables are computed by that many worker processes. With gray, rows
+    are evaluated one at a time (see graycode), for expressions too big to evaluate bit-parallel."""
     try:
         tree = parsing.parse(exp)
-        table = truth_table(exp)
     except IOError as e:
         print("Parse error: %s" % e)
         return
-    for row in table:
-        print(row)
+    atoms = find_atoms(exp)
+    with stats.phase("write_table"):
+        true_rows = write_table(tree, atoms, fmt, stream, jobs, gray)
     if verbose:
-        print()
-        table = truth_table(exp)
-        print_sat_info(table)
+        summary = stream if fmt == "text" else sys.stderr
+        print(file=summary)
+        if engine == "table":
+            show_sat_info(true_rows > 0, true_rows == 1 << len(atoms), summary)
+        else:
+            show_sat_info(satisfiable(tree, engine), tautology(tree, engine), summary)
+
+def write_table(tree, atoms, fmt="text", stream=None, jobs=1, gray=False):
+    """Streams the truth table of a parse tree to a file, in one pass and in large writes.
+
+    Columns are in sorted atom order. Returns how many rows are true."""
+    if stream is None:
+        stream = sys.stdout
+    width = chunk_width(atoms)
+    true_rows = 0
+    if gray:
+        chunks = graycode.gray_chunks(tree, atoms)
+    elif cache.enabled() and len(atoms) <= cache.TABLE_ATOMS:
+        chunks = [table_bits(tree, atoms, jobs)]
+    else:
+        chunks = bit_chunks(tree, atoms, jobs)
+    if fmt == "binary":
+        for bits in chunks:
+            true_rows += bin(bits).count("1")
+            stream.write(_pack(bits, width))
+        return true_rows
+
+    display = sorted(atoms)
+    column = dict((atom, j) for j, atom in enumerate(display))
+    columns = [column[atom] for atom in atoms]
+    if fmt == "text":
+        cells = [(" %s " % atom, "~%s " % atom) for atom in display]
+        values = (" False", " True")
+    else:
+        separator = "," if fmt == "csv" else "\t"
+        cells = [("1" + separator, "0" + separator)] * len(display)
+        values = ("0", "1")
+        stream.write(separator.join(display + ["value"]) + "\n")
+
+    # Consecutive rows differ in few atoms, so only the changed cells are replaced.
+    current = [true for true, false in cells]
+    lines = []
+    index = 0
+    for bits in chunks:
+        true_rows += bin(bits).count("1")
+        row_bits = row_values(bits, width)
+        for i in xrange(width):
+            if index:
+                changed = index ^ (index - 1)
+                k = 0
+                while changed:
+                    if changed & 1:
+                        j = columns[k]
+                        current[j] = cells[j][index >> k & 1]
+                    changed >>= 1
+                    k += 1
+            lines.append("".join(current) + values[row_bits[i] == "1"])
+            index += 1
+            if len(lines) == BUFFER_ROWS:
+                stream.write("\n".join(lines) + "\n")
+                lines = []
+    if lines:
+        stream.write("\n".join(lines) + "\n")
+    return true_rows
+
+def _pack(bits, width):
+    """Packs a chunk of rows into bytes, the first row in the lowest bit of the first byte."""
+    size = max(width // 8, 1)
+    return binascii.unhexlify("%0*x" % (2 * size, bits))[::-1]
+
+class TruthTable(object):
+    """A whole truth table, packed one bit per row as in the binary format: row i (see model_of)
+    is bit i % 8 of byte i / 8.
+
+    Build one with TruthTable.build, which can write straight to a file so that the table is
+    never in memory all at once, or open a saved one with TruthTable.load. Loaded tables are
+    memory-mapped: rows are only read from disk when they're looked at."""
+
+    def __init__(self, atoms, data, mapped=None):
+        self.atoms = list(atoms)
+        self._data = data
+        self._mapped = mapped
+        # Items of a memoryview are one-byte strings, whether it's over a bytearray or a map.
+        self._view = memoryview(data)
+
+    @classmethod
+    def build(cls, tree, atoms, jobs=1, path=None):
+        """Computes the table of a parse tree, in memory or (with a path) saved to a file and loaded."""
+        width = chunk_width(atoms)
+        if path is not None:
+            with open(path, "wb") as f:
+                _write_header(f, atoms)
+                for bits in bit_chunks(tree, atoms, jobs):
+                    f.write(_pack(bits, width))
+            return cls.load(path)
+        data = bytearray()
+        for bits in bit_chunks(tree, atoms, jobs):
+            data += _pack(bits, width)
+        return cls(atoms, data)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            if f.readline() != TABLE_MAGIC:
+                raise IOError("%s is not a saved truth table." % path)
+            atoms = [str(atom) for atom in json.loads(f.readline())]
+            offset = f.tell()
+            size = _packed_size(atoms)
+            if os.fstat(f.fileno()).st_size != offset + size:
+                raise IOError("%s is truncated." % path)
+            # A private (copy-on-write) map, since ctypes can only wrap writable buffers,
+            # and Python 2 can't take a memoryview of an mmap directly.
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        return cls(atoms, (ctypes.c_char * size).from_buffer(mapped, offset), mapped)
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            _write_header(f, self.atoms)
+            f.write(self.view())
+
+    def close(self):
+        """Releases the file of a loaded table. The table can't be used afterwards.
+
+        Views of the rows must be released first: memoryviews from view() and slices of them,
+        and unfinished chunks() generators. Unmapping under them would crash the next read, so
+        while any are alive this raises BufferError and leaves the table open."""
+        if self._mapped is not None:
+            # The table holds the view and the data, a Python 2 memoryview holds its object twice,
+            # and getrefcount adds one more. Anything beyond that is someone else's view.
+            if sys.getrefcount(self._view) > 2 or sys.getrefcount(self._data) > 4:
+                raise BufferError("The table's views must be released before it's closed.")
+            self._data = self._view = None
+            self._mapped.close()
+            self._mapped = None
+
+    def view(self):
+        """The packed rows as a memoryview, without copying them."""
+        return self._view
+
+    def __len__(self):
+        return 1 << len(self.atoms)
+
+    def __getitem__(self, index):
+        """The value of row `index`."""
+        if not 0 <= index < len(self):
+            raise IndexError("Row %d is outside a table of %d rows." % (index, len(self)))
+        return bool(ord(self._view[index >> 3]) >> (index & 7) & 1)
+
+    def index(self, model):
+        """The row of a truth assignment to every atom (the inverse of model_of)."""
+        return sum((not model[atom]) << k for k, atom in enumerate(self.atoms))
+
+    def value(self, model):
+        return self[self.index(model)]
+
+    def chunks(self):
+        """Yields the table in the same chunks (ints, one bit per row) as bit_chunks."""
+        width = chunk_width(self.atoms)
+        size = max(width // 8, 1)
+        view = self.view()
+        for start in xrange(0, len(view), size):
+            yield int(binascii.hexlify(view[start:start + size].tobytes()[::-1]), 16)
+
+    def count(self):
+        """How many rows are true."""
+        return sum(bin(bits).count("1") for bits in self.chunks())
+
+    def satisfiable(self):
+        return any(self.chunks())
+
+    def tautology(self):
+        full = (1 << chunk_width(self.atoms)) - 1
+        return all(bits == full for bits in self.chunks())
+
+    def models(self, value=True):
+        """Generates the truth assignments of the rows whose value is `value`."""
+        return models_from_chunks(self.chunks(), self.atoms, value)
+
+    def rows(self):
+        return rows_from_chunks(self.chunks(), self.atoms)
+
+def _packed_size(atoms):
+    return max((1 << len(atoms)) // 8, 1)
+
+def _write_header(f, atoms):
+    f.write(TABLE_MAGIC)
+    f.write(json.dumps(list(atoms)) + "\n")
 
 def truth_table(exp):
     """Generates truth table rows from a proposition string."""
     tree = parsing.parse(exp)
-    atoms = find_atoms(exp)
-    for truth in gen_truths(atoms):
-        yield Row(truth, tree.eval(truth))
+    for row in from_tree(tree, find_atoms(exp)):
+        yield row
 
-def from_tree(tree):
+def from_tree(tree, atoms=None):
     """Generates a truth table from a parse tree."""
-    atoms = list(tree.atoms())
-    for truth in gen_truths(atoms):
-        yield Row(truth, tree.eval(truth))
+    if atoms is None:
+        atoms = list(tree.atoms())
+    return rows_from_chunks(bit_chunks(tree, atoms), atoms)
+
+def atom_masks(atoms):
+    """Returns the bit pattern of each atom over all rows of a table, and the int with every row set."""
+    width = 1 << len(atoms)
+    masks = {}
+    for k, atom in enumerate(atoms):
+        # Blocks of 2**k true rows alternating with 2**k false rows, built by doubling.
+        mask = (1 << (1 << k)) - 1
+        period = 2 << k
+        while period < width:
+            mask |= mask << period
+            period *= 2
+        masks[atom] = mask
+    return masks, (1 << width) - 1
+
+def chunk_width(atoms):
+    """Returns how many rows each chunk of a table over these atoms covers."""
+    return 1 << min(len(atoms), CHUNK_ATOMS)
+
+def bit_chunks(tree, atoms, jobs=1):
+    """Yields the truth table of a parse tree as ints, one bit per row, in chunks of chunk_width(atoms) rows.
+
+    The tree is simplified first, and a constant one isn't evaluated at all."""
+    tree = simplify.simplify(tree)
+    if tree is True or tree is False:
+        bits = (1 << chunk_width(atoms)) - 1 if tree else 0
+        for chunk in xrange(1 << max(len(atoms) - CHUNK_ATOMS, 0)):
+            yield bits
+        return
+    if parallel.use_pool(atoms, jobs):
+        for bits in parallel.bit_chunks(tree, atoms, jobs):
+            yield bits
+        return
+    evaluate = codegen.compile_bits(tree, atoms)
+    low, high = atoms[:CHUNK_ATOMS], atoms[CHUNK_ATOMS:]
+    masks, full = atom_masks(low)
+    masks = [masks[atom] for atom in low] + [0] * len(high)
+    if stats.enabled:
+        nodes = sum(1 for node in postorder(tree))
+    for chunk in xrange(1 << len(high)):
+        for k in xrange(len(high)):
+            masks[CHUNK_ATOMS + k] = 0 if chunk >> k & 1 else full
+        if stats.enabled:
+            stats.count("chunks")
+            stats.count("rows", 1 << len(low))
+            stats.count("node_evaluations", nodes << len(low))
+            with stats.phase("evaluate"):
+                bits = evaluate(masks, full)
+            yield bits
+        else:
+            yield evaluate(masks, full)
+
+def table_bits(tree, atoms, jobs=1):
+    """Returns the whole truth table of a parse tree as a single int, one bit per row.
+    Small tables are kept in the disk cache, when it's on."""
+    if cache.enabled() and len(atoms) <= cache.TABLE_ATOMS:
+        return cache.cached("table", [tree, list(atoms)], lambda: _table_bits(tree, atoms, jobs),
+                            lambda bits: "%x" % bits, lambda text: int(text, 16))
+    return _table_bits(tree, atoms, jobs)
+
+def _table_bits(tree, atoms, jobs=1):
+    width = chunk_width(atoms)
+    bits = 0
+    for i, chunk in enumerate(bit_chunks(tree, atoms, jobs)):
+        bits |= chunk << (i * width)
+    return bits
+
+def model_of(index, atoms):
+    """Returns the truth assignment of a row, given the row's index."""
+    return dict((atom, not index >> k & 1) for k, atom in enumerate(atoms))
+
+def row_values(bits, width):
+    """Returns a string with one "0" or "1" per row of a chunk, in row order."""
+    return format(bits, "b").zfill(width)[::-1]
+
+def rows_from_chunks(chunks, atoms):
+    """Lazily generates Row objects from the bit chunks of a truth table."""
+    width = chunk_width(atoms)
+    index = 0
+    for bits in chunks:
+        values = row_values(bits, width)
+        for i in xrange(width):
+            yield Row(model_of(index + i, atoms), values[i] == "1")
+        index += width
+
+def models_from_chunks(chunks, atoms, value=True):
+    """Generates the truth assignments of the rows whose value is `value`, skipping all other rows."""
+    width = chunk_width(atoms)
+    full = (1 << width) - 1
+    index = 0
+    for bits in chunks:
+        if not value:
+            bits ^= full
+        if bits:
+            values = row_values(bits, width)
+            i = values.find("1")
+            while i != -1:
+                yield model_of(index + i, atoms)
+                i = values.find("1", i + 1)
+        index += width
 
 def find_atoms(exp):
-    """Returns a list of atoms in a proposition string."""
-    return list(set([char for char in exp if char in string.ascii_uppercase]))
+    """Returns a list of atoms in a proposition string (not counting names it defines with let), or parse tree."""
+    if isinstance(exp, Node):
+        return list(exp.atoms())
+    tokens = parsing.tokenize(exp)
+    if parsing.LET in tokens:
+        # Only the parse knows which uses of a defined name are outside its definition.
+        atoms = parsing.parse(exp).atoms()
+        return list(set([token for token in tokens if token in atoms]))
+    return list(set([token for token in tokens if parsing.is_atom(token)]))
 
 def gen_truths(atoms):
     """Yields all possible maps of variables to truth values."""
@@ -77,9 +411,106 @@ def all_equal(iterable):
             return False
     return True
 
-def equivalent(exp1, exp2):
-    table1, table2 = truth_table(exp1), truth_table(exp2)
-    return all([row1 == row2 for row1, row2 in zip(table1, table2)])
+def equivalent(exp1, exp2, engine="table", jobs=1):
+    """Checks whether two proposition strings compute the same function of all their atoms.
+
+    A round of random simulation comes first and rejects most inequivalent pairs outright. Only
+    pairs agreeing on all SIM_ROWS random rows get an exact check by the engine."""
+    tree1, tree2 = parsing.parse(exp1), parsing.parse(exp2)
+    if simulate(tree1, tree2, sorted(tree1.atoms() | tree2.atoms())) is not None:
+        return False
+    return distinguishing_model(tree1, tree2, engine, jobs) is None
+
+def distinguishing_model(exp1, exp2, engine="table", jobs=1):
+    """Returns the first row of the truth table over both expressions' atoms (sorted) on which
+    they differ, as a truth assignment; or None if they're equivalent.
+
+    Every engine finds the same row. The table engine scans for it and stops there; the sat
+    and bdd engines settle the atoms one at a time, last to first, without scanning."""
+    tree1, tree2 = parsing.parse(exp1), parsing.parse(exp2)
+    if cache.enabled():
+        # Equivalence is symmetric, so the pair is cached in a fixed order.
+        pair = sorted([cache.canonical(tree1), cache.canonical(tree2)])
+        return cache.cached("first_difference", pair, lambda: _distinguishing_model(tree1, tree2, engine, jobs),
+                            decode=lambda model: model and dict((str(atom), value) for atom, value in model.items()))
+    return _distinguishing_model(tree1, tree2, engine, jobs)
+
+def _distinguishing_model(tree1, tree2, engine="table", jobs=1):
+    atoms = sorted(tree1.atoms() | tree2.atoms())
+    if engine == "sat":
+        return sat.first_model(NotNode(IffNode(tree1, tree2)), atoms)
+    if engine == "bdd":
+        return bdd.distinguishing_model(tree1, tree2, atoms)
+    index = _first_difference(tree1, tree2, atoms, jobs)
+    return None if index is None else model_of(index, atoms)
+
+def simulate(tree1, tree2, atoms, rows=SIM_ROWS):
+    """Evaluates two parse trees on the same random rows, all at once.
+
+    Returns a truth assignment on which they differ, or None if none of the rows tell them apart."""
+    rng = random.Random(SIM_SEED)
+    masks = [rng.getrandbits(rows) for atom in atoms]
+    full = (1 << rows) - 1
+    diff = codegen.compile_bits(tree1, atoms)(masks, full) ^ codegen.compile_bits(tree2, atoms)(masks, full)
+    if not diff:
+        return None
+    row = (diff & -diff).bit_length() - 1
+    return dict((atom, bool(mask >> row & 1)) for atom, mask in izip(atoms, masks))
+
+def _first_difference(tree1, tree2, atoms, jobs=1):
+    """Returns the index of the first row where two trees' truth tables differ, or None."""
+    if parallel.use_pool(atoms, jobs):
+        return parallel.find_row(IffNode(tree1, tree2), atoms, jobs, False, True)
+    width = chunk_width(atoms)
+    index = 0
+    for bits1, bits2 in izip(bit_chunks(tree1, atoms), bit_chunks(tree2, atoms)):
+        diff = bits1 ^ bits2
+        if diff:
+            return index + (diff & -diff).bit_length() - 1
+        index += width
+    return None
+
+def satisfiable(tree, engine="table", jobs=1):
+    """Checks whether some row of a parse tree's truth table is true.
+
+    The table engine stops at the first true chunk, in any of its worker processes.
+    Every engine works on the simplified tree, and a constant needs no engine at all.
+    Answers are kept in the disk cache, when it's on."""
+    return cache.cached("satisfiable", [tree], lambda: _satisfiable(tree, engine, jobs))
+
+def _satisfiable(tree, engine="table", jobs=1):
+    tree = simplify.simplify(tree)
+    if tree is True or tree is False:
+        return tree
+    if engine == "sat":
+        return sat.satisfiable(tree)
+    if engine == "bdd":
+        return bdd.satisfiable(tree)
+    atoms = list(tree.atoms())
+    if parallel.use_pool(atoms, jobs):
+        return parallel.satisfiable(tree, atoms, jobs)
+    return any(bits for bits in bit_chunks(tree, atoms))
+
+def tautology(tree, engine="table", jobs=1):
+    """Checks whether every row of a parse tree's truth table is true.
+
+    The table engine stops at the first false chunk, in any of its worker processes.
+    Like satisfiable, it simplifies the tree first and uses the disk cache."""
+    return cache.cached("tautology", [tree], lambda: _tautology(tree, engine, jobs))
+
+def _tautology(tree, engine="table", jobs=1):
+    tree = simplify.simplify(tree)
+    if tree is True or tree is False:
+        return tree
+    if engine == "sat":
+        return sat.tautology(tree)
+    if engine == "bdd":
+        return bdd.tautology(tree)
+    atoms = list(tree.atoms())
+    if parallel.use_pool(atoms, jobs):
+        return parallel.tautology(tree, atoms, jobs)
+    full = (1 << chunk_width(atoms)) - 1
+    return all(bits == full for bits in bit_chunks(tree, atoms))
 
 def print_sat_info(table):
     satisfiable = False
@@ -90,8 +521,11 @@ def print_sat_info(table):
         else:
             tautology = False
 
-    print("Satisfiable:\t%s" % satisfiable)
-    print("Tautology:\t%s" % tautology)
+    return show_sat_info(satisfiable, tautology)
+
+def show_sat_info(satisfiable, tautology, stream=None):
+    print("Satisfiable:\t%s" % satisfiable, file=stream)
+    print("Tautology:\t%s" % tautology, file=stream)
 
     return (satisfiable, tautology)
 
@@ -126,10 +560,11 @@ def test_gen_truths_recursive_long():
     assert_items_equal(expected, actual)
 
 def test_find_atoms():
-    assert_items_equal(find_atoms("ABC"), list("ABC"))
     assert_items_equal(find_atoms("A B C"), list("ABC"))
     assert_items_equal(find_atoms("Av   B&C"), list("ABC"))
-    assert_items_equal(find_atoms("ABC"), list("ABC"))
+    assert_items_equal(find_atoms("(A&(BxC))"), list("ABC"))
+    assert_items_equal(find_atoms("(X1 v (X12 & req_ok))"), ["X1", "X12", "req_ok"])
+    assert_items_equal(find_atoms("(let P = (A&B) in (P>C) v P)"), ["A", "B", "C", "P"])
 
 def test_truth_table_and():
     expected_table = [
@@ -164,6 +599,43 @@ def test_equiv_complex():
     assert equivalent("(A&~B)", "(~B&(AvB))")
     assert equivalent("(AvB)", "!(!A&!B)")
 
+def test_equiv_engines():
+    for engine in ENGINES:
+        assert equivalent("(A&~B)", "(~B&(AvB))", engine)
+        assert not equivalent("(AvB)", "(!A&!B)", engine)
+        assert not equivalent("A", "(A&B)", engine)
+
+def test_equiv_union_of_atoms():
+    for engine in ENGINES:
+        assert equivalent("A", "(A&(Bv~B))", engine)
+        assert not equivalent("A", "(A&B)", engine)
+
+def test_distinguishing_model():
+    for engine in ENGINES:
+        for exp1, exp2 in [("(AvB)", "(AxB)"), ("(A&B&C&D&E&F&G&H)", "(A&B&C&D&E&F&G&H&I)")]:
+            model = distinguishing_model(exp1, exp2, engine)
+            assert_equal(sorted(model), sorted(set(find_atoms(exp1)) | set(find_atoms(exp2))))
+            assert parsing.parse(exp1).eval(model) != parsing.parse(exp2).eval(model)
+        assert_equal(distinguishing_model("(A>B)", "(~AvB)", engine), None)
+
+def test_first_distinguishing_row():
+    # They differ on every row but the first and the last; every engine reports row 1.
+    exp1, exp2 = "(A&B&C&D)", "(AvBvCvD)"
+    first = {"A": False, "B": True, "C": True, "D": True}
+    for engine in ENGINES:
+        assert_equal(distinguishing_model(exp1, exp2, engine), first)
+    # Enough atoms for a pool of workers. Rows differ in every sub-cube where Q is false, and
+    # the first of them (A false, B true, Q false) must still be the one reported.
+    tree1, tree2 = parsing.parse("(Qv(A&B))"), parsing.parse("(Qv(AvB))")
+    assert_equal(_first_difference(tree1, tree2, list("ABCDEFGHIJKLMNOPQ"), 2), (1 << 16) + 1)
+
+def test_first_difference():
+    # Too rare for random simulation: the trees differ only when all nine atoms are true.
+    tree1, tree2 = parsing.parse("(A&B&C&D&E&F&G&H)"), parsing.parse("(A&B&C&D&E&F&G&H&~I)")
+    atoms = sorted(tree2.atoms())
+    assert_equal(simulate(tree1, tree2, atoms), None)
+    assert_equal(_first_difference(tree1, tree2, atoms), 0)
+
 def test_not_equiv_complex():
     assert not equivalent("(AvB)", "(!A&!B)")
 
@@ -188,3 +660,151 @@ def test_sat_info_simple():
 def test_sat_info_harder():
     assert print_sat_info(truth_table("(A&B&C)")) == (T, F)
     assert print_sat_info(truth_table("(A&B&C&~A)")) == (F, F)
+
+def test_atom_masks():
+    masks, full = atom_masks(["A", "B"])
+    assert full == 0b1111
+    assert masks == {"A": 0b0101, "B": 0b0011}
+
+def test_rows_match_gen_truths():
+    expected = [truth for truth in gen_truths(["A", "B", "C"])]
+    actual = [row.model for row in from_tree(parsing.parse("(A&B&C)"), ["A", "B", "C"])]
+    assert_equal(expected, actual)
+
+def test_chunked_table():
+    global CHUNK_ATOMS
+    saved, CHUNK_ATOMS = CHUNK_ATOMS, 2
+    try:
+        tree = parsing.parse("((A&B)x(C>D))")
+        atoms = ["A", "B", "C", "D"]
+        assert_equal(len(list(bit_chunks(tree, atoms))), 4)
+        for row in from_tree(tree, atoms):
+            assert_equal(row.value, tree.eval(row.model))
+    finally:
+        CHUNK_ATOMS = saved
+
+def test_table_bits():
+    assert_equal(table_bits(parsing.parse("(A&B)"), ["A", "B"]), 0b0001)
+    assert_equal(table_bits(parsing.parse("(A>B)"), ["A", "B"]), 0b1011)
+
+def test_models_from_chunks():
+    tree = parsing.parse("(AxB)")
+    chunks = list(bit_chunks(tree, ["A", "B"]))
+    assert_equal(list(models_from_chunks(chunks, ["A", "B"])), [{"A": F, "B": T}, {"A": T, "B": F}])
+    assert_equal(list(models_from_chunks(chunks, ["A", "B"], False)), [{"A": T, "B": T}, {"A": F, "B": F}])
+
+def test_satisfiable_tautology():
+    for engine in ENGINES:
+        assert satisfiable(parsing.parse("(A&B)"), engine)
+        assert not satisfiable(parsing.parse("(A&~A)"), engine)
+        assert tautology(parsing.parse("(Av~A)"), engine)
+        assert not tautology(parsing.parse("(AvB)"), engine)
+
+def test_write_table_text():
+    tree = parsing.parse("((AvB)>C)")
+    atoms = ["C", "A", "B"]
+    out = StringIO()
+    assert_equal(write_table(tree, atoms, "text", out), 5)
+    expected = "".join(str(row) + "\n" for row in from_tree(tree, atoms))
+    assert_equal(out.getvalue(), expected)
+    out = StringIO()
+    write_table(tree, atoms, "text", out, gray=True)
+    assert_equal(out.getvalue(), expected)
+
+def test_write_table_csv():
+    out = StringIO()
+    write_table(parsing.parse("(A&B)"), ["A", "B"], "csv", out)
+    assert_equal(out.getvalue(), "A,B,value\n1,1,1\n0,1,0\n1,0,0\n0,0,0\n")
+    out = StringIO()
+    write_table(parsing.parse("~A"), ["A"], "tsv", out)
+    assert_equal(out.getvalue(), "A\tvalue\n1\t0\n0\t1\n")
+
+def test_write_table_binary():
+    out = StringIO()
+    write_table(parsing.parse("(A>B)"), ["A", "B"], "binary", out)
+    assert_equal(out.getvalue(), "\x0b")
+    out = StringIO()
+    write_table(parsing.parse("(A&B&C&D)"), ["A", "B", "C", "D"], "binary", out)
+    assert_equal(out.getvalue(), "\x01\x00")
+
+def test_print_truth_table_verbose():
+    out = StringIO()
+    print_truth_table("((A&B) v (~A&~B))", True, stream=out)
+    assert_equal(out.getvalue(), " A  B  True\n~A  B  False\n A ~B  False\n~A ~B  True\n\nSatisfiable:\tTrue\nTautology:\tFalse\n")
+
+def test_truth_table_object():
+    tree = parsing.parse("((A&B)v(CxD)v~(E=F))")
+    atoms = ["A", "B", "C", "D", "E", "F"]
+    table = TruthTable.build(tree, atoms)
+    bits = table_bits(tree, atoms)
+    assert_equal([table[i] for i in xrange(len(table))], [bool(bits >> i & 1) for i in xrange(64)])
+    assert_equal(table.view().tobytes(), _pack(bits, 64))
+    assert_equal(table.count(), bin(bits).count("1"))
+    assert_equal(list(table.models(False)), list(models_from_chunks(bit_chunks(tree, atoms), atoms, False)))
+    model = {"A": True, "B": True, "C": False, "D": False, "E": True, "F": True}
+    assert_equal(table.value(model), True)
+    assert_equal(table.index(model), 12)
+    small = TruthTable.build(parsing.parse("(A&~A)"), ["A"])
+    assert_equal((len(small), small.satisfiable(), small.tautology()), (2, False, False))
+    try:
+        table[64]
+        assert False
+    except IndexError:
+        pass
+
+def test_truth_table_files():
+    directory = tempfile.mkdtemp()
+    saved = CHUNK_ATOMS
+    try:
+        path = os.path.join(directory, "table")
+        globals()["CHUNK_ATOMS"] = 4
+        tree = parsing.parse("((A&B)v(CxDxE)v~(F=G))")
+        atoms = ["A", "B", "C", "D", "E", "F", "G"]
+        table = TruthTable.build(tree, atoms, path=path)
+        assert_equal(table.atoms, atoms)
+        assert_equal(list(table.chunks()), list(bit_chunks(tree, atoms)))
+        assert_equal(table.view().tobytes(), TruthTable.build(tree, atoms).view().tobytes())
+        table.close()
+        copy = os.path.join(directory, "copy")
+        TruthTable.load(path).save(copy)
+        assert_equal(open(copy, "rb").read(), open(path, "rb").read())
+        loaded = TruthTable.load(copy)
+        assert_equal((loaded.count(), loaded.tautology()), (bin(table_bits(tree, atoms)).count("1"), False))
+        loaded.close()
+        # Each kind of view keeps a table open, and usable, until it's released.
+        loaded = TruthTable.load(path)
+        view = loaded.view()
+        assert_raises(BufferError, loaded.close)
+        del view
+        part = loaded.view()[1:3]
+        assert_raises(BufferError, loaded.close)
+        del part
+        chunks = loaded.chunks()
+        next(chunks)
+        assert_raises(BufferError, loaded.close)
+        assert_equal(loaded.count(), bin(table_bits(tree, atoms)).count("1"))
+        del chunks
+        loaded.close()
+        with open(path, "ab") as f:
+            f.write("x")
+        assert_raises(IOError, TruthTable.load, path)
+    finally:
+        globals()["CHUNK_ATOMS"] = saved
+        shutil.rmtree(directory)
+
+def test_parallel_matches_sequential():
+    saved, parallel.MIN_ATOMS = parallel.MIN_ATOMS, 0
+    try:
+        tree = parsing.parse("((A&B)v(CxDxE)v~(F=G))")
+        atoms = ["A", "B", "C", "D", "E", "F", "G"]
+        assert_equal(table_bits(tree, atoms, 3), table_bits(tree, atoms))
+        out, expected = StringIO(), StringIO()
+        write_table(tree, atoms, "csv", out, 2)
+        write_table(tree, atoms, "csv", expected)
+        assert_equal(out.getvalue(), expected.getvalue())
+        assert satisfiable(tree, jobs=2)
+        assert not tautology(tree, jobs=2)
+        assert equivalent("(A&~B&C)", "(~B&(AvB)&C)", jobs=2)
+        assert not equivalent("(AvBvC)", "(AxBxC)", jobs=2)
+    finally:
+        parallel.MIN_ATOMS = saved